@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# Copyright (c) 2008 Red Hat, Inc. All rights reserved. This copyrighted material
+# is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Author: David Malcolm
+"""
+Compare scanning text for forbidden words using the compiled matcher against
+looking up each word in a plain list of terms.
+
+Usage: bench_forbiddenwords.py [NUM_TERMS [NUM_WORDS]]
+"""
+import os
+import os.path
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from docbooklint.forbiddenwords import ForbiddenWordMatcher
+
+def make_word(rng):
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    return ''.join([rng.choice(letters) for i in range(rng.randint(3, 10))])
+
+def make_terms(rng, numTerms):
+    "Generate a list of terms, a quarter of which are two- or three-word phrases"
+    terms = []
+    for i in range(numTerms):
+        if i % 4 == 0:
+            terms.append(' '.join([make_word(rng) for j in range(rng.randint(2, 3))]))
+        else:
+            terms.append(make_word(rng))
+    return terms
+
+def make_text(rng, numWords, terms):
+    "Generate text which occasionally contains one of the terms"
+    vocabulary = [make_word(rng) for i in range(5000)]
+    words = []
+    for i in range(numWords):
+        if i % 100 == 0:
+            words.append(rng.choice(terms))
+        else:
+            words.append(rng.choice(vocabulary))
+        if i % 12 == 11:
+            words[-1] += '.\n'
+    return ' '.join(words)
+
+def scan_with_list(terms, text):
+    "The original approach: split on spaces and search the list for each word"
+    matches = []
+    for line in text.splitlines():
+        for word in line.strip().split(' '):
+            word = word.strip(' .,()-:;')
+            if word in terms:
+                matches.append(word)
+    return matches
+
+def main():
+    numTerms = 2000
+    numWords = 50000
+    if len(sys.argv) > 1:
+        numTerms = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        numWords = int(sys.argv[2])
+
+    rng = random.Random(0)
+    terms = make_terms(rng, numTerms)
+    text = make_text(rng, numWords, terms)
+
+    start = time.time()
+    listMatches = scan_with_list(terms, text)
+    listTime = time.time() - start
+
+    start = time.time()
+    matcher = ForbiddenWordMatcher(terms)
+    compileTime = time.time() - start
+
+    start = time.time()
+    matcherMatches = matcher.find_matches(text)
+    matcherTime = time.time() - start
+
+    print 'terms:            %i' % numTerms
+    print 'words of text:    %i' % numWords
+    print 'list scan:        %.3fs (%i matches, single words only)' % (listTime, len(listMatches))
+    print 'matcher compile:  %.3fs' % compileTime
+    print 'matcher scan:     %.3fs (%i matches, including phrases)' % (matcherTime, len(matcherMatches))
+    print 'speedup:          %.1fx' % (listTime / matcherTime)
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# Copyright (c) 2008 Red Hat, Inc. All rights reserved. This copyrighted material
+# is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Author: David Malcolm
+"""
+Measure the speed of LineScanner over a large <screen> (e.g. a log dump),
+in megabytes of text per second, against splitting the text into a list of
+lines, as the line-length check used to.  The text is fed to the scanner in
+pieces, as it would be around inline elements.
+
+Usage: bench_linelengths.py [NUM_LINES [NUM_REPEATS]]
+"""
+import os.path
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from docbooklint.linelengths import LineScanner
+
+def make_text(numLines):
+    lines = []
+    for i in range(numLines):
+        if i % 1000 == 0:
+            lines.append(u'kernel: a line of a log that is far too long to fit in a screen '
+                         u'without being wrapped, number %i' % i)
+        elif i % 100 == 0:
+            lines.append(u'kernel:\tan indented line, number %i' % i)
+        else:
+            lines.append(u'2008-01-01 12:00:00 host kernel: something happened, number %i' % i)
+    return u'\n'.join(lines)
+
+def scan_with_splitlines(text, maxWidth):
+    return len([line for line in text.splitlines() if len(line.expandtabs()) > maxWidth])
+
+def scan_with_scanner(text, maxWidth):
+    longLines = []
+    scanner = LineScanner(maxWidth, 8, 2, lambda line, width: longLines.append(line))
+    pieceSize = len(text) // 10 + 1
+    for start in range(0, len(text), pieceSize):
+        scanner.feed(text[start:start + pieceSize])
+    scanner.finish()
+    return len(longLines)
+
+def main():
+    numLines = 500000
+    numRepeats = 3
+    if len(sys.argv) > 1:
+        numLines = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        numRepeats = int(sys.argv[2])
+
+    text = make_text(numLines)
+    megabytes = len(text) / 1e6
+    print 'lines:  %i (%.1f MB)' % (numLines, megabytes)
+    results = {}
+    for label, scan in (('splitlines', scan_with_splitlines), ('scanner', scan_with_scanner)):
+        best = None
+        for i in range(numRepeats):
+            start = time.time()
+            results[label] = scan(text, 80)
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        print '%-11s %8.1f MB/s (%i long lines)' % (label + ':', megabytes / best, results[label])
+    assert results['splitlines'] == results['scanner']
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# Copyright (c) 2008 Red Hat, Inc. All rights reserved. This copyrighted material
+# is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Author: David Malcolm
+"""
+Time how long the docbook-lint script takes to start up and check a tiny
+file, with and without the spellchecker, as a pre-commit hook would run it.
+
+Usage: bench_startup.py [NUM_REPEATS]
+"""
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+topDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+script = os.path.join(topDir, 'docbook-lint')
+
+tinyDoc = """<?xml version="1.0"?>
+<article><section id="sn-tiny"><para>Some text</para></section></article>
+"""
+
+def time_command(args, numRepeats):
+    "Return the best wall time of running the Python interpreter with the arguments"
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([topDir] + [path for path in
+                                                    [env.get('PYTHONPATH')] if path])
+    devNull = open(os.devnull, 'w')
+    best = None
+    for i in range(numRepeats):
+        start = time.time()
+        subprocess.call([sys.executable] + args, env=env,
+                        stdout=devNull, stderr=devNull)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    devNull.close()
+    return best
+
+def main():
+    numRepeats = 10
+    if len(sys.argv) > 1:
+        numRepeats = int(sys.argv[1])
+
+    dirName = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(dirName, 'tiny.xml')
+        f = open(filename, 'w')
+        f.write(tinyDoc)
+        f.close()
+
+        baseline = time_command(['-c', 'pass'], numRepeats)
+        print '%-28s %.3fs' % ('python startup:', baseline)
+        for label, args in (('--help:', ['--help']),
+                            ('tiny file, no spellcheck:', ['--no-spellcheck', filename]),
+                            ('tiny file, spellcheck:', [filename])):
+            print '%-28s %.3fs' % (label, time_command([script] + args, numRepeats))
+    finally:
+        shutil.rmtree(dirName)
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# Copyright (c) 2008 Red Hat, Inc. All rights reserved. This copyrighted material
+# is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Author: David Malcolm
+"""
+Compare the shared tokenizer against the original splitlines/split/strip
+tokenization, in time and in the peak memory used while tokenizing a MB of
+text.
+
+Each tokenizer is measured in a child process of its own, so that the peak
+resident set size that it reports is the tokenizer's, rather than the
+high-water mark of whatever ran before it.
+
+Usage: bench_tokenizer.py [MEGABYTES]
+"""
+import gc
+import os
+import os.path
+import re
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from docbooklint.tokenizer import iter_words, is_number
+
+sampleText = (u'The quick brown fox (version 3.2) jumps over the lazy dog; '
+              u'run\t<command>yum</command>, then e-mail the \u201cresults\u201d.\n'
+              u'  Indented lines, tabs\tand trailing spaces   \n')
+
+def split_words(text):
+    """
+    The original tokenization, returning the number of words checked and the
+    length of the largest intermediate list
+    """
+    numWords = 0
+    lines = text.splitlines()
+    maxListLength = len(lines)
+    for line in lines:
+        pieces = line.strip().split(' ')
+        maxListLength = max(maxListLength, len(pieces))
+        for piece in pieces:
+            word = piece.strip(' .,()-:;<>')
+            if re.match(r"^[\d.]*$", word):
+                continue
+            numWords += 1
+    return numWords, maxListLength
+
+def tokenize_words(text):
+    "As split_words, but with the shared tokenizer"
+    numWords = 0
+    for word, offset in iter_words(text):
+        if is_number(word):
+            continue
+        numWords += 1
+    return numWords, 0
+
+tokenizers = (('split/strip', split_words),
+              ('tokenizer', tokenize_words))
+
+def get_peak_rss():
+    "Get the peak resident set size of this process so far, in kilobytes"
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def measure(name, megabytes):
+    """
+    Run the named tokenizer over the text, returning the time taken, the
+    number of words, the largest intermediate list, and how far the peak RSS
+    rose above that of the text itself
+    """
+    tokenizer = dict(tokenizers)[name]
+    text = sampleText * (megabytes * 1024 * 1024 / len(sampleText))
+    gc.collect()
+    startRss = get_peak_rss()
+    start = time.time()
+    numWords, maxListLength = tokenizer(text)
+    return time.time() - start, numWords, maxListLength, get_peak_rss() - startRss
+
+def measure_in_child(name, megabytes):
+    output = subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                               '--child', name, str(megabytes)],
+                              stdout=subprocess.PIPE).communicate()[0]
+    elapsed, numWords, maxListLength, rssKb = output.split()
+    return float(elapsed), int(numWords), int(maxListLength), int(rssKb)
+
+def main():
+    if sys.argv[1:2] == ['--child']:
+        print '%r %i %i %i' % measure(sys.argv[2], int(sys.argv[3]))
+        return
+
+    megabytes = 4
+    if len(sys.argv) > 1:
+        megabytes = int(sys.argv[1])
+    for name, tokenizer in tokenizers:
+        elapsed, numWords, maxListLength, rssKb = measure_in_child(name, megabytes)
+        print '%-12s %.3fs/MB  %i words  %i KB peak RSS/MB  largest list: %i' % (
+            name, elapsed / megabytes, numWords, rssKb / megabytes, maxListLength)
+
+if __name__=='__main__':
+    main()
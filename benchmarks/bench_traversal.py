@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# Copyright (c) 2008 Red Hat, Inc. All rights reserved. This copyrighted material
+# is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Author: David Malcolm
+"""
+Compare the single-pass (fused) traversal against running each test with its
+own traversal of the document.
+
+The document cache is disabled whilst timing, so that, as before there was
+one, each traversal parses the XIncludes afresh; the linter is built, and
+the top-level file parsed, before timing starts.
+
+Usage: bench_traversal.py [NUM_CHAPTERS [NUM_REPEATS]]
+"""
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import docbooklint.linter
+from docbooklint.xmlutils import XmlFile, documentCache
+from corpus import CorpusSpec, write_book
+
+def time_run(filename, config, numRepeats):
+    "Return the best wall time of linting the file"
+    linter = docbooklint.linter.DocBookLinter(None, config)
+    xmlDoc = XmlFile(filename)
+    best = None
+    for i in range(numRepeats):
+        linter.reporter = docbooklint.linter.CollectingReporter()
+        documentCache.clear()
+        start = time.time()
+        linter.test_doc(xmlDoc)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def main():
+    numChapters = 50
+    numRepeats = 3
+    if len(sys.argv) > 1:
+        numChapters = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        numRepeats = int(sys.argv[2])
+
+    # (entries are discarded as soon as they're added)
+    documentCache.maxEntries = 0
+
+    dirName = tempfile.mkdtemp()
+    try:
+        filename = write_book(dirName, CorpusSpec(numChapters=numChapters,
+                                                  sectionsPerChapter=20))
+        results = {}
+        for singlePass in (False, True):
+            config = docbooklint.linter.Configuration()
+            config.singlePass = singlePass
+            results[singlePass] = time_run(filename, config, numRepeats)
+
+        print 'chapters:    %i' % numChapters
+        print 'multi-pass:  %.3fs' % results[False]
+        print 'single-pass: %.3fs' % results[True]
+        print 'speedup:     %.2fx' % (results[False] / results[True])
+    finally:
+        shutil.rmtree(dirName)
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# Copyright (c) 2008 Red Hat, Inc. All rights reserved. This copyrighted material
+# is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Author: David Malcolm
+"""
+Compare the speed, in nodes per second, of XmlVisitor's iterative tree walker
+against the recursive one that it replaced, over a large synthetic book.
+The files are parsed before timing starts, so that only the walk is timed.
+
+Usage: bench_walker.py [NUM_CHAPTERS [NUM_REPEATS]]
+"""
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from docbooklint.xmlutils import XmlFile, XmlVisitor, is_element, is_textual, \
+    is_xinclude, get_include_filename, find_include_problem, prefetch_includes
+from corpus import CorpusSpec, write_book
+
+class NodeCounter(XmlVisitor):
+    def __init__(self):
+        self.numNodes = 0
+
+    def visit_element(self, node):
+        self.numNodes += 1
+
+    def visit_textual(self, node):
+        self.numNodes += 1
+
+class RecursiveNodeCounter(NodeCounter):
+    "Walks the tree as XmlVisitor used to, with a Python call per node"
+    def recurse_nodes(self, node, xmlDoc):
+        self.visit(node)
+
+        child = node.firstChild
+        while child:
+            self.recurse_nodes(child, xmlDoc)
+            child = child.nextSibling
+
+        if is_xinclude(node):
+            filename = get_include_filename(node, xmlDoc)
+            problem = find_include_problem(filename, xmlDoc)
+            if problem is not None:
+                self.visit_include_problem(node, filename, problem)
+            else:
+                self.visit_include(node, filename)
+                includedXmlDoc = XmlFile(filename, xmlDoc)
+                self.recurse_nodes(includedXmlDoc.dom, includedXmlDoc)
+
+        if is_element(node):
+            self.leave_element(node)
+
+    def visit(self, node):
+        if is_element(node):
+            self.visit_element(node)
+
+        if is_textual(node):
+            self.visit_textual(node)
+
+def time_walk(visitorClass, filename, numRepeats):
+    "Return the best wall time of walking the book, and the number of nodes"
+    best = None
+    for i in range(numRepeats):
+        visitor = visitorClass()
+        start = time.time()
+        visitor.visit_doc(XmlFile(filename))
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, visitor.numNodes
+
+def main():
+    numChapters = 100
+    numRepeats = 5
+    if len(sys.argv) > 1:
+        numChapters = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        numRepeats = int(sys.argv[2])
+
+    dirName = tempfile.mkdtemp()
+    try:
+        filename = write_book(dirName, CorpusSpec(numChapters=numChapters,
+                                                  sectionsPerChapter=20,
+                                                  includeFanOut=4))
+        # Parse every file into the document cache ahead of the timings:
+        prefetch_includes(XmlFile(filename), 4)
+
+        results = {}
+        for label, visitorClass in (('recursive', RecursiveNodeCounter),
+                                    ('iterative', NodeCounter)):
+            elapsed, numNodes = time_walk(visitorClass, filename, numRepeats)
+            results[label] = elapsed
+            print '%-10s %8.3fs %10i nodes/s' % (label + ':', elapsed,
+                                                  numNodes / max(elapsed, 1e-9))
+        print 'speedup:   %.2fx' % (results['recursive'] / results['iterative'])
+    finally:
+        shutil.rmtree(dirName)
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# Copyright (c) 2008 Red Hat, Inc. All rights reserved. This copyrighted material
+# is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Author: David Malcolm
+"""
+Compare a large allow-list loaded from text (into a frozenset) with the same
+list built into a binary word list (and memory-mapped): the time taken to
+load it, the time taken to look words up in it, and the memory that it
+costs each worker process.  Each measurement is made in a fresh process.
+
+Memory is reported from /proc (so this only works on Linux) as the growth
+in anonymous memory, which is private to each process, and in file-backed
+memory, which is shared between all of the processes mapping the file.
+
+Usage: bench_wordlist.py [NUM_WORDS [NUM_LOOKUPS]]
+"""
+import os
+import os.path
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+topDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, topDir)
+
+def get_memory():
+    "Get the anonymous and file-backed resident memory of this process, in KB"
+    memory = {}
+    for line in open('/proc/self/status'):
+        name, value = line.split(':', 1)
+        if name in ('RssAnon', 'RssFile'):
+            memory[name] = int(value.split()[0])
+    return memory['RssAnon'], memory['RssFile']
+
+def measure(filename, numLookups):
+    "Load the word list and look words up in it, printing the results"
+    from docbooklint.wordlist import load_word_list
+    rng = random.Random(1)
+    words = [u'word%i' % rng.randint(0, 2000000) for i in range(numLookups)]
+
+    anonBefore, fileBefore = get_memory()
+    start = time.time()
+    wordList = load_word_list(filename)
+    loadTime = time.time() - start
+
+    start = time.time()
+    numFound = 0
+    for word in words:
+        if word in wordList:
+            numFound += 1
+    lookupTime = time.time() - start
+    anonAfter, fileAfter = get_memory()
+    print loadTime, lookupTime, anonAfter - anonBefore, fileAfter - fileBefore, numFound
+
+def run_measurement(filename, numLookups):
+    output = subprocess.Popen([sys.executable, __file__, '--measure', filename, str(numLookups)],
+                              stdout=subprocess.PIPE).communicate()[0]
+    loadTime, lookupTime, anonKb, fileKb, numFound = output.split()
+    return float(loadTime), float(lookupTime), int(anonKb), int(fileKb), int(numFound)
+
+def main():
+    if sys.argv[1:2] == ['--measure']:
+        measure(sys.argv[2], int(sys.argv[3]))
+        return
+
+    numWords = 500000
+    numLookups = 100000
+    if len(sys.argv) > 1:
+        numWords = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        numLookups = int(sys.argv[2])
+
+    from docbooklint.wordlist import build_word_list
+    dirName = tempfile.mkdtemp()
+    try:
+        textFilename = os.path.join(dirName, 'words.txt')
+        f = open(textFilename, 'w')
+        for i in range(numWords):
+            f.write('word%i\n' % (i * 4))
+        f.close()
+        binaryFilename = os.path.join(dirName, 'words.bin')
+        start = time.time()
+        build_word_list(binaryFilename, [textFilename])
+        print 'words:  %i (built in %.3fs)' % (numWords, time.time() - start)
+
+        print '%-8s %10s %14s %14s %14s' % ('', 'load (s)', 'lookups/s', 'private (KB)',
+                                            'shared (KB)')
+        results = {}
+        for label, filename in (('text', textFilename), ('binary', binaryFilename)):
+            loadTime, lookupTime, anonKb, fileKb, numFound = run_measurement(filename,
+                                                                             numLookups)
+            results[label] = numFound
+            print '%-8s %10.3f %14i %14i %14i' % (label + ':', loadTime,
+                                                  numLookups / max(lookupTime, 1e-9),
+                                                  anonKb, fileKb)
+        assert results['text'] == results['binary']
+    finally:
+        shutil.rmtree(dirName)
+
+if __name__=='__main__':
+    main()
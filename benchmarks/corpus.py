@@ -0,0 +1,193 @@
+# Copyright (c) 2008 Red Hat, Inc. All rights reserved. This copyrighted material
+# is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Author: David Malcolm
+"""
+Generator for synthetic DocBook books, for use by the benchmarks.
+
+The shape of a book is described by a CorpusSpec; write_book writes it out
+as a set of files and returns the name of the top-level file.  The output
+only depends upon the spec (including its seed).
+"""
+import os
+import os.path
+import random
+
+# Common English words, which any dictionary ought to accept:
+baseVocabulary = """
+the of and to in is that for it as was with be by on not he this are or his
+from at which but have an they you were her she there one all we their has
+been would more if will so no when who about can said other them some could
+into time these two may then do first any my now such like our over man me
+even most made after also did many before must through back years where much
+your way well down should because each just those people how too little state
+good very make world still own see men work long get here between both life
+being under never day same another know while last might great old year off
+come since against go came right used take three small large next early young
+important few public bad able system file files directory command commands
+package packages install installed server client network user users group
+example examples section chapter book guide manual option options value values
+default configure configuration service services process running run start
+stop restart enable disable kernel module modules device devices disk drive
+partition memory screen window desktop menu button select click type enter
+press key keyboard mouse display print printer text line lines word words
+version release update updates security password account login shell prompt
+output input error errors message messages warning log logs record address
+host name names domain mail web page pages browser document documents edit
+editor open close save copy move delete remove create change changes path
+""".split()
+
+class CorpusSpec:
+    """
+    The shape of a synthetic book.
+
+    The book XIncludes one file per chapter.  If includeFanOut is non-zero,
+    each chapter XIncludes its sections from that many further files;
+    otherwise the sections are written inline within the chapter.
+
+    screensPerSection is the mean number of <screen> elements per section.
+    The text is drawn from the first vocabularySize words of baseVocabulary,
+    with misspellingRate of the words having two of their letters swapped.
+    """
+    numChapters = 20
+    sectionsPerChapter = 10
+    includeFanOut = 0
+    parasPerSection = 3
+    wordsPerPara = 60
+    screensPerSection = 1.0
+    vocabularySize = 200
+    misspellingRate = 0.01
+    seed = 0
+
+    def __init__(self, **kwargs):
+        for name, value in kwargs.iteritems():
+            if not hasattr(self, name):
+                raise TypeError('unknown corpus parameter: %s' % name)
+            setattr(self, name, value)
+
+    def to_dict(self):
+        result = {}
+        for name in dir(CorpusSpec):
+            value = getattr(self, name)
+            if not name.startswith('_') and not callable(value):
+                result[name] = value
+        return result
+
+def misspell(rng, word):
+    "Swap two adjacent letters within the word"
+    if len(word) < 3:
+        return word + word[-1]
+    i = rng.randint(0, len(word) - 2)
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+class BookWriter:
+    def __init__(self, spec, dirName):
+        self.spec = spec
+        self.dirName = dirName
+        self.rng = random.Random(spec.seed)
+        self.vocabulary = baseVocabulary[:max(1, spec.vocabularySize)]
+
+    def make_word(self):
+        word = self.rng.choice(self.vocabulary)
+        if self.rng.random() < self.spec.misspellingRate:
+            word = misspell(self.rng, word)
+        return word
+
+    def make_sentence(self, numWords):
+        words = [self.make_word() for i in range(numWords)]
+        return ' '.join(words).capitalize() + '.'
+
+    def write_para(self, f):
+        numWordsLeft = self.spec.wordsPerPara
+        f.write('<para>\n')
+        while numWordsLeft > 0:
+            numWords = min(numWordsLeft, self.rng.randint(5, 15))
+            f.write('%s\n' % self.make_sentence(numWords))
+            numWordsLeft -= numWords
+        f.write('Run <command>%s</command> to see the '
+                '<computeroutput>%s</computeroutput>.\n'
+                % (self.make_word(), self.make_word()))
+        f.write('</para>\n')
+
+    def write_screen(self, f):
+        f.write('<screen>\n')
+        for i in range(self.rng.randint(2, 6)):
+            # Occasionally make the line too long to fit:
+            numWords = self.rng.choice([3, 5, 8, 20])
+            f.write('$ %s\n' % ' '.join([self.make_word() for j in range(numWords)]))
+        f.write('</screen>\n')
+
+    def write_section(self, f, chapterIndex, sectionIndex):
+        f.write('<section id="sn-chapter%i-%i">\n<title>%s</title>\n'
+                % (chapterIndex, sectionIndex, self.make_sentence(3)))
+        numScreens = int(self.spec.screensPerSection)
+        if self.rng.random() < self.spec.screensPerSection - numScreens:
+            numScreens += 1
+        for i in range(self.spec.parasPerSection):
+            self.write_para(f)
+            if i < numScreens:
+                self.write_screen(f)
+        for i in range(self.spec.parasPerSection, numScreens):
+            self.write_screen(f)
+        f.write('</section>\n')
+
+    def open_file(self, name):
+        f = open(os.path.join(self.dirName, name), 'w')
+        f.write('<?xml version="1.0"?>\n')
+        return f
+
+    def write_chapter(self, chapterIndex):
+        spec = self.spec
+        name = 'chapter%i.xml' % chapterIndex
+        f = self.open_file(name)
+        f.write('<chapter id="ch-chapter%i" xmlns:xi="http://www.w3.org/2001/XInclude">\n'
+                '<title>Chapter %i</title>\n' % (chapterIndex, chapterIndex))
+        if spec.includeFanOut:
+            # Split the sections as evenly as possible between the files:
+            for i in range(spec.includeFanOut):
+                begin = spec.sectionsPerChapter * i / spec.includeFanOut
+                end = spec.sectionsPerChapter * (i + 1) / spec.includeFanOut
+                if begin == end:
+                    continue
+                partName = 'chapter%i-part%i.xml' % (chapterIndex, i)
+                f.write('<xi:include href="%s"/>\n' % partName)
+                partFile = self.open_file(partName)
+                if end - begin > 1:
+                    # A file can only have one root element:
+                    partFile.write('<section id="sn-chapter%i-part%i"><title>Part %i</title>\n'
+                                   % (chapterIndex, i, i))
+                for j in range(begin, end):
+                    self.write_section(partFile, chapterIndex, j)
+                if end - begin > 1:
+                    partFile.write('</section>\n')
+                partFile.close()
+        else:
+            for j in range(spec.sectionsPerChapter):
+                self.write_section(f, chapterIndex, j)
+        f.write('</chapter>\n')
+        f.close()
+        return name
+
+    def write_book(self):
+        filename = os.path.join(self.dirName, 'book.xml')
+        f = self.open_file('book.xml')
+        f.write('<book xmlns:xi="http://www.w3.org/2001/XInclude">\n<title>Benchmark</title>\n')
+        for i in range(self.spec.numChapters):
+            f.write('<xi:include href="%s"/>\n' % self.write_chapter(i))
+        f.write('</book>\n')
+        f.close()
+        return filename
+
+def write_book(dirName, spec):
+    "Write a book with the given shape into the directory; return its filename"
+    return BookWriter(spec, dirName).write_book()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# Copyright (c) 2008 Red Hat, Inc. All rights reserved. This copyrighted material
+# is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Author: David Malcolm
+"""
+Generate synthetic books of various sizes, and time linting them: each check
+on its own (via DocBookLinter.test_doc, on an already-parsed document), and
+end-to-end (via check_file, including parsing).
+
+The wall time, CPU time, nodes per second and peak RSS of each run are
+printed, and written as JSON to the results file, so that the results of
+different releases can be compared.  Each measurement is made in a child
+process of its own, so that its peak RSS isn't the high-water mark of the
+measurements before it; the rise in peak RSS during the run (i.e. above that
+of loading the document, for a check on its own) is given too.
+
+Usage: run_benchmarks.py [options] [CORPUS...]
+"""
+import json
+import optparse
+import os
+import os.path
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import docbooklint.linter
+from docbooklint.xmlutils import XmlVisitor, backends, documentCache, load_file
+from corpus import CorpusSpec, write_book
+
+corpora = {'small': CorpusSpec(numChapters=5, sectionsPerChapter=5),
+           'medium': CorpusSpec(numChapters=20, sectionsPerChapter=10, includeFanOut=2),
+           'large': CorpusSpec(numChapters=100, sectionsPerChapter=20, includeFanOut=4,
+                               screensPerSection=2.0, misspellingRate=0.02)}
+
+class NodeCounter(XmlVisitor):
+    def __init__(self):
+        self.numNodes = 0
+
+    def visit_element(self, node):
+        self.numNodes += 1
+
+    def visit_textual(self, node):
+        self.numNodes += 1
+
+def count_nodes(xmlDoc):
+    "Count the elements and textual nodes in the document and its XIncludes"
+    counter = NodeCounter()
+    counter.visit_doc(xmlDoc)
+    return counter.numNodes
+
+def get_peak_rss():
+    "Get the peak resident set size of this process so far, in kilobytes"
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def time_best(fn, numRepeats):
+    "Call fn repeatedly; return the best (wall, cpu) times"
+    best = None
+    for i in range(numRepeats):
+        startWall = time.time()
+        startCpu = time.clock()
+        fn()
+        times = (time.time() - startWall, time.clock() - startCpu)
+        if best is None or times[0] < best[0]:
+            best = times
+    return best
+
+def measure(filename, checkName, config, numRepeats):
+    """
+    Time the named check (a test class name) on its own, or everything from
+    parsing onwards if checkName is 'end-to-end', returning a dictionary of
+    the wall and cpu times, the peak RSS, and its rise during the runs.  This
+    is called within a child process for each measurement (see
+    measure_in_child).
+    """
+    if checkName == 'end-to-end':
+        devNull = open(os.devnull, 'w')
+        savedStderr = sys.stderr
+        def run():
+            documentCache.clear()
+            sys.stderr = devNull
+            try:
+                docbooklint.linter.check_file(filename, config)
+            finally:
+                sys.stderr = savedStderr
+    else:
+        xmlDoc = load_file(filename, config.backend)
+        linter = docbooklint.linter.DocBookLinter(None, config)
+        linter.tests = [test for test in linter.tests
+                        if test.__class__.__name__ == checkName]
+        def run():
+            linter.reporter = docbooklint.linter.CollectingReporter()
+            linter.test_doc(xmlDoc)
+
+    startRss = get_peak_rss()
+    wall, cpu = time_best(run, numRepeats)
+    peakRss = get_peak_rss()
+    return {'wall': wall,
+            'cpu': cpu,
+            'peakRssKb': peakRss,
+            'rssIncreaseKb': peakRss - startRss}
+
+def measure_in_child(filename, checkName, config, numRepeats, numNodes):
+    "Run measure within a fresh Python process, adding the nodes per second"
+    args = [sys.executable, os.path.abspath(__file__),
+            '--measure', checkName, '--backend', config.backend,
+            '--repeats', str(numRepeats)]
+    if not config.spellCheck:
+        args.append('--no-spellcheck')
+    child = subprocess.Popen(args + [filename], stdout=subprocess.PIPE)
+    output = child.communicate()[0]
+    if child.returncode != 0:
+        raise RuntimeError('measuring %s failed (exit status %i)'
+                           % (checkName, child.returncode))
+    result = json.loads(output)
+    result['nodesPerSecond'] = numNodes / max(result['wall'], 1e-9)
+    return result
+
+def run_corpus(spec, config, numRepeats):
+    dirName = tempfile.mkdtemp()
+    try:
+        filename = write_book(dirName, spec)
+        numNodes = count_nodes(load_file(filename, config.backend))
+        documentCache.clear()
+
+        # Each check on its own:
+        checks = {}
+        for test in docbooklint.linter.DocBookLinter(None, config).tests:
+            checkName = test.__class__.__name__
+            checks[checkName] = measure_in_child(filename, checkName, config,
+                                                 numRepeats, numNodes)
+
+        # Everything, from parsing onwards:
+        endToEnd = measure_in_child(filename, 'end-to-end', config, numRepeats, numNodes)
+
+        return {'spec': spec.to_dict(),
+                'nodes': numNodes,
+                'checks': checks,
+                'endToEnd': endToEnd}
+    finally:
+        shutil.rmtree(dirName)
+
+def make_option_parser():
+    parser = optparse.OptionParser(usage="%%prog [options] [CORPUS...]\n\nCorpora: %s"
+                                   % ', '.join(sorted(corpora.keys())))
+    parser.add_option('-o', '--output', dest='outputFilename', metavar='FILE',
+                      default='benchmark-results.json', help='write the results to FILE')
+    parser.add_option('-r', '--repeats', dest='numRepeats', type='int', default=3,
+                      metavar='N', help='take the best of N runs')
+    parser.add_option('--label', dest='label', default='',
+                      help='a label for the results, e.g. the release being measured')
+    parser.add_option('--backend', dest='backend', default='dom',
+                      choices=sorted(backends.keys()),
+                      help='the XML backend to use')
+    parser.add_option('--no-spellcheck', dest='spellCheck', action='store_false',
+                      default=True, help="don't run the spellchecker")
+    # Used by the child processes that make each measurement:
+    parser.add_option('--measure', dest='measureCheck', metavar='CHECK',
+                      help=optparse.SUPPRESS_HELP)
+    return parser
+
+def main():
+    parser = make_option_parser()
+    options, args = parser.parse_args()
+
+    config = docbooklint.linter.Configuration()
+    config.backend = options.backend
+    config.spellCheck = options.spellCheck
+
+    if options.measureCheck is not None:
+        print json.dumps(measure(args[0], options.measureCheck, config, options.numRepeats))
+        return
+
+    names = args or ['small', 'medium']
+    for name in names:
+        if name not in corpora:
+            parser.error('unknown corpus: %s' % name)
+
+    results = {'label': options.label,
+               'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'python': sys.version.split()[0],
+               'backend': options.backend,
+               'repeats': options.numRepeats,
+               'corpora': {}}
+    for name in names:
+        result = run_corpus(corpora[name], config, options.numRepeats)
+        results['corpora'][name] = result
+        print '%s: %i nodes' % (name, result['nodes'])
+        for checkName, checkResult in sorted(result['checks'].items()) + [('end-to-end', result['endToEnd'])]:
+            print '  %-34s %8.3fs wall %8.3fs cpu %10i nodes/s %8i KB peak RSS (+%i KB)' % (
+                checkName, checkResult['wall'], checkResult['cpu'],
+                checkResult['nodesPerSecond'], checkResult['peakRssKb'],
+                checkResult['rssIncreaseKb'])
+
+    f = open(options.outputFilename, 'w')
+    json.dump(results, f, indent=2, sort_keys=True)
+    f.close()
+    print 'results written to %s' % options.outputFilename
+
+if __name__=='__main__':
+    main()
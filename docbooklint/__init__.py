@@ -1,6 +1,15 @@
 # -*- coding: UTF-8 -*-
-__all__ = ('fedoranamingconventions',
+__all__ = ('daemon',
+           'fedoranamingconventions',
            'forbiddenwords',
+           'idindex',
+           'incremental',
+           'profiling',
+           'rules',
            'spellcheck',
+           'tokenizer',
+           'ulinks',
+           'wordlist',
+           'xrefs',
            'xmlutils.py',
            'linter.py')
@@ -0,0 +1,316 @@
+# Copyright (c) 2008 Red Hat, Inc. All rights reserved. This copyrighted material
+# is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Author: David Malcolm
+
+from docbooklint.linter import *
+from docbooklint.xmlutils import *
+from docbooklint.incremental import get_config_fingerprint
+
+import json
+import os
+import os.path
+import shutil
+import socket
+import SocketServer
+import StringIO
+import tempfile
+import threading
+import unittest
+
+#
+# Server mode: a long-running process which keeps its linters (and hence
+# their spelling dictionaries and verdicts) and the parsed-document cache
+# warm between requests.  Cached parses are discarded when a file's mtime
+# or size changes.
+#
+# Requests are JSON-RPC 2.0, one JSON object per line, over a Unix socket or
+# stdin/stdout.  The methods are:
+#   lint(files, config)  => {"warnings": [...], "suppressed": N, "stats": {...}}
+#   shutdown()           => null
+# where config holds the client's Configuration attributes (other than
+# incrementalStateFile, which is ignored; see docbook-lint), with the paths
+# within it made absolute by the client (see configPathSettings), each warning
+# is a [kind, message, location, sourceLine, occurrences] list, as for a
+# WarningRecord, N is the number of warnings dropped by the limits in
+# config, and the stats describe the work done for this request.
+#
+
+# Statistics which describe the state of a cache, rather than counting work
+# done, and so are reported as they stand rather than for each request:
+gaugeStats = frozenset(['document cache entries', 'document cache bytes'])
+
+# The Configuration settings that are paths (or lists of paths), which the
+# client makes absolute, as the daemon's working directory may differ:
+configPathSettings = ('personalWordList', 'allowLists', 'ruleFiles',
+                      'spellingCacheDir', 'ulinkCacheDir', 'profileDumpDir')
+
+def get_request_config(config):
+    "Get the Configuration's attributes for a request, with absolute paths"
+    attributes = dict(config.__dict__)
+    for name in configPathSettings:
+        value = attributes.get(name)
+        if isinstance(value, basestring):
+            attributes[name] = os.path.abspath(value)
+        elif value:
+            attributes[name] = [os.path.abspath(path) for path in value]
+    return attributes
+
+def get_stats_delta(before, after):
+    "Get the statistics for the work done between two calls to get_stats"
+    delta = {}
+    for name, value in after.iteritems():
+        if name in gaugeStats:
+            delta[name] = value
+        else:
+            delta[name] = value - before.get(name, 0)
+    return delta
+
+PARSE_ERROR = -32700
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+class LintServer:
+    def __init__(self):
+        # Map from configuration fingerprint to linter:
+        self.linters = {}
+        self.shuttingDown = False
+
+    def get_linter(self, configDict):
+        config = Configuration()
+        for name, value in configDict.iteritems():
+            if not hasattr(config, str(name)):
+                raise ValueError('unknown configuration setting: %s' % name)
+            setattr(config, str(name), value)
+        fingerprint = get_config_fingerprint(config)
+        if not self.linters.has_key(fingerprint):
+            self.linters[fingerprint] = DocBookLinter(CollectingReporter(), config)
+        return self.linters[fingerprint]
+
+    def lint(self, files, config=None):
+        linter = self.get_linter(config or {})
+        linter.reporter, collector = make_collecting_reporter(linter.config)
+        statsBefore = linter.get_stats()
+        for filename in files:
+            linter.test_doc(load_file(filename, linter.config.backend))
+        linter.reporter.close()
+        return {'warnings': [WarningRecord.from_warning(warning).to_list()
+                             for warning in collector.warnings],
+                'suppressed': getattr(linter.reporter, 'numSuppressed', 0),
+                'stats': get_stats_delta(statsBefore, linter.get_stats())}
+
+    def shutdown(self):
+        self.shuttingDown = True
+        return None
+
+    def handle_request(self, request):
+        "Handle a decoded JSON-RPC request, returning the response"
+        requestId = request.get('id')
+        if request.get('method') not in ('lint', 'shutdown'):
+            return make_error(requestId, METHOD_NOT_FOUND,
+                              'unknown method: %s' % request.get('method'))
+        method = getattr(self, str(request['method']))
+        params = request.get('params', {})
+        if not isinstance(params, dict):
+            return make_error(requestId, INVALID_PARAMS, 'params must be an object')
+        try:
+            kwargs = dict([(str(name), value) for name, value in params.iteritems()])
+            result = method(**kwargs)
+        except (TypeError, ValueError), e:
+            return make_error(requestId, INVALID_PARAMS, str(e))
+        except Exception, e:
+            return make_error(requestId, INTERNAL_ERROR, '%s: %s' % (e.__class__.__name__, e))
+        return {'jsonrpc': '2.0', 'id': requestId, 'result': result}
+
+    def handle_line(self, line):
+        "Handle a line of JSON, returning the response as a line of JSON"
+        try:
+            request = json.loads(line)
+        except ValueError, e:
+            response = make_error(None, PARSE_ERROR, str(e))
+        else:
+            if isinstance(request, dict):
+                response = self.handle_request(request)
+            else:
+                response = make_error(None, PARSE_ERROR, 'expected a JSON object')
+        return '%s\n' % json.dumps(response)
+
+def make_error(requestId, code, message):
+    return {'jsonrpc': '2.0', 'id': requestId,
+            'error': {'code': code, 'message': message}}
+
+def serve_stream(server, inputFileObj, outputFileObj):
+    "Handle requests from one file object, until EOF or shutdown"
+    while not server.shuttingDown:
+        line = inputFileObj.readline()
+        if not line:
+            break
+        if not line.strip():
+            continue
+        outputFileObj.write(server.handle_line(line))
+        outputFileObj.flush()
+
+class UnixSocketHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        serve_stream(self.server.lintServer, self.rfile, self.wfile)
+
+def serve_unix_socket(server, socketPath, readyEvent=None):
+    "Handle requests on the Unix socket, one connection at a time, until shutdown"
+    if os.path.exists(socketPath):
+        os.unlink(socketPath)
+    socketServer = SocketServer.UnixStreamServer(socketPath, UnixSocketHandler)
+    socketServer.lintServer = server
+    if readyEvent is not None:
+        readyEvent.set()
+    try:
+        while not server.shuttingDown:
+            socketServer.handle_request()
+    finally:
+        socketServer.server_close()
+        os.unlink(socketPath)
+
+#
+# The client side
+#
+
+class DaemonError(Exception):
+    pass
+
+def call_daemon(socketPath, method, params):
+    """
+    Make a request of the daemon listening on the socket, returning the
+    result.  Raises socket.error if there's no daemon listening.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socketPath)
+        sock.sendall('%s\n' % json.dumps({'jsonrpc': '2.0', 'id': 1,
+                                          'method': method, 'params': params}))
+        sock.shutdown(socket.SHUT_WR)
+        f = sock.makefile('rb')
+        response = json.loads(f.readline())
+        f.close()
+    finally:
+        sock.close()
+    if response.has_key('error'):
+        raise DaemonError(response['error']['message'])
+    return response['result']
+
+def check_files_with_daemon(socketPath, filenames, config, reporter, stats=None):
+    """
+    As check_files, but have the daemon do the work.  Returns the number of
+    warnings.
+    """
+    params = {'files': [os.path.abspath(filename) for filename in filenames],
+              'config': get_request_config(config)}
+    result = call_daemon(socketPath, 'lint', params)
+    for warning in result['warnings']:
+        reporter.handle_warning(WarningRecord(*warning))
+    if result['suppressed']:
+        reporter.handle_suppressed(result['suppressed'])
+    if stats is not None:
+        stats.update(result['stats'])
+    return len(result['warnings']) + result['suppressed']
+
+#
+# Unit tests
+#
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        self.dirName = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dirName, 'doc.xml')
+        self.write_doc('foo')
+
+    def tearDown(self):
+        shutil.rmtree(self.dirName)
+
+    def write_doc(self, sectionId):
+        f = open(self.filename, 'w')
+        f.write('<article><section id="%s"><para>Some text</para></section></article>\n' % sectionId)
+        f.close()
+
+    def make_request(self, method, params):
+        return json.dumps({'jsonrpc': '2.0', 'id': 1, 'method': method, 'params': params})
+
+    def test_stream(self):
+        "Ensure that a changed file is parsed again, and an unchanged one isn't"
+        server = LintServer()
+        lintRequest = self.make_request('lint', {'files': [self.filename],
+                                                 'config': {'spellCheck': False}})
+        responses = []
+        for i in range(3):
+            if i == 2:
+                self.write_doc('sn-foo')
+            outputFileObj = StringIO.StringIO()
+            serve_stream(server, StringIO.StringIO(lintRequest + '\n'), outputFileObj)
+            responses.append(json.loads(outputFileObj.getvalue())['result'])
+
+        self.assertEquals(len(responses[0]['warnings']), 1)
+        self.assertEquals(responses[0]['warnings'][0][0], 'IdDoesNotStartWithPrefix')
+        self.assertEquals(responses[1]['warnings'], responses[0]['warnings'])
+        self.assertEquals(responses[2]['warnings'], [])
+        self.assertEquals(responses[0]['stats']['document cache misses'], 1)
+        self.assertEquals(responses[1]['stats']['document cache misses'], 0)
+        self.assertEquals(responses[1]['stats']['document cache hits'], 1)
+        self.assertEquals(responses[1]['stats']['document cache entries'],
+                          responses[0]['stats']['document cache entries'])
+        self.assertEquals(len(server.linters), 1)
+
+    def test_errors(self):
+        "Ensure that bad requests get the appropriate JSON-RPC errors"
+        server = LintServer()
+        self.assertEquals(json.loads(server.handle_line('{not json'))['error']['code'],
+                          PARSE_ERROR)
+        self.assertEquals(json.loads(server.handle_line(self.make_request('frobnicate', {})))['error']['code'],
+                          METHOD_NOT_FOUND)
+        request = self.make_request('lint', {'files': [], 'config': {'noSuchSetting': 1}})
+        self.assertEquals(json.loads(server.handle_line(request))['error']['code'],
+                          INVALID_PARAMS)
+
+    def test_request_config(self):
+        "Ensure that the paths within the configuration are sent as absolute paths"
+        config = Configuration()
+        config.personalWordList = 'words.txt'
+        config.allowLists = ['allow.txt', '/usr/share/allow.txt']
+        config.ulinkCacheDir = 'cache'
+        attributes = get_request_config(config)
+        self.assertEquals(attributes['personalWordList'], os.path.abspath('words.txt'))
+        self.assertEquals(attributes['allowLists'],
+                          [os.path.abspath('allow.txt'), '/usr/share/allow.txt'])
+        self.assertEquals(attributes['ulinkCacheDir'], os.path.abspath('cache'))
+        self.assertEquals(attributes['ruleFiles'], [])
+        self.assertEquals(config.personalWordList, 'words.txt')
+
+    def test_unix_socket(self):
+        "Ensure that the client can lint files using the daemon"
+        socketPath = os.path.join(self.dirName, 'socket')
+        server = LintServer()
+        readyEvent = threading.Event()
+        thread = threading.Thread(target=serve_unix_socket,
+                                  args=(server, socketPath, readyEvent))
+        thread.start()
+        try:
+            readyEvent.wait()
+            config = Configuration()
+            config.spellCheck = False
+            reporter = CollectingReporter()
+            numWarnings = check_files_with_daemon(socketPath, [self.filename],
+                                                  config, reporter)
+            self.assertEquals(numWarnings, 1)
+            self.assertEquals(reporter.warnings[0].get_location()[1:], (1, 10))
+        finally:
+            call_daemon(socketPath, 'shutdown', {})
+            thread.join()
+        self.failIf(os.path.exists(socketPath))
@@ -14,57 +14,105 @@
 # Author: David Malcolm
 from docbooklint.linter import *
 from docbooklint.xmlutils import *
+from docbooklint.idindex import IdIndexListener
 
 class IdDoesNotStartWithPrefix(DocBookError):
+    __slots__ = ('id', 'expectedPrefix')
+
     def __init__(self, node, id, expectedPrefix):
         DocBookError.__init__(self, node)
         self.id = id
         self.expectedPrefix = expectedPrefix
 
     def __str__(self):
-        return 'Node <%s>\'s id ("%s") does not start with prefix "%s"'%(self.node.nodeName, self.id, self.expectedPrefix)
+        return 'Node <%s>\'s id ("%s") does not start with prefix "%s"'%(self.nodeName, self.id, self.expectedPrefix)
+
+class SectionIdLacksChapterSuffix(DocBookError):
+    __slots__ = ('id', 'chapterSuffix')
+
+    def __init__(self, node, id, chapterSuffix):
+        DocBookError.__init__(self, node)
+        self.id = id
+        self.chapterSuffix = chapterSuffix
+
+    def __str__(self):
+        return 'Node <%s>\'s id ("%s") does not contain its chapter\'s suffix "%s"'%(self.nodeName, self.id, self.chapterSuffix)
+
+class IdTooLong(DocBookError):
+    __slots__ = ('id', 'maxLength')
+
+    def __init__(self, node, id, maxLength):
+        DocBookError.__init__(self, node)
+        self.id = id
+        self.maxLength = maxLength
+
+    def __str__(self):
+        return 'Node <%s>\'s id ("%s") is longer than %i characters'%(self.nodeName, self.id, self.maxLength)
+
+# The prefix that the id of each kind of element must start with:
+prefixMap = {'preface':  'pr-',
+             'chapter':  'ch-',
+             'section':  'sn-',
+             'sect1':    's1-',
+             'sect2':    's2-',
+             'sect3':    's3-',
+             'sect4':    's4-',
+             'figure':   'fig-',
+             'table':    'tb-',
+             'appendix': 'ap-',
+             'part':     'pt-',
+             'example':  'ex-'}
+
+# Elements whose ids must contain the suffix of their chapter's id (the part
+# after its prefix):
+sectionElements = frozenset(['section', 'sect1', 'sect2', 'sect3', 'sect4'])
+
+def get_id_suffix(id):
+    "Get the part of the id after its prefix, e.g. \"intro\" for \"ch-intro\""
+    if '-' in id:
+        return id.split('-', 1)[1]
+    return id
 
 class DocBookFedoraIdNamingConvention(DocBookTest):
-    def perform_test(self, reporter, doc):
-        visitor = DocBookFedoraIdNamingConvention.Visitor(reporter)
-        visitor.visit_doc(doc)
+    usesIdIndex = True
+
+    def __init__(self, maxIdLength=64):
+        self.maxIdLength = maxIdLength
+
+    @classmethod
+    def from_config(cls, config):
+        return DocBookFedoraIdNamingConvention(config.maxIdLength)
+
+    def make_visitor(self, reporter):
+        return DocBookFedoraIdNamingConvention.Visitor(reporter, self.maxIdLength)
 
-    class Visitor(XmlVisitor):
-        def __init__(self, reporter):
+    class Visitor(IdIndexListener):
+        """
+        The chapter that each element is within comes from the linter's
+        IdIndexer, so the checks need no searching of the tree
+        """
+        def __init__(self, reporter, maxIdLength):
             self.reporter = reporter
+            self.maxIdLength = maxIdLength
 
-        def visit_textual(self, node):
-            pass
-
-        def visit_element(self, node):
-            if node.nodeName=='chapter':
-                self.currentChapter = node
-
-            if node.hasAttribute('id'):
-                id = node.getAttribute('id')
-                # print 'id="%s"'%id
-
-                # Ensure id starts with correct prefix:
-                prefixMap = {'preface':  'pr-',
-                             'chapter':  'ch-',
-                             'section':  'sn-',
-                             'sect1':    's1-',
-                             'sect2':    's2-',
-                             'sect3':    's3-',
-                             'sect4':    's4-',
-                             'figure':   'fig-',
-                             'table':    'tb-',
-                             'appendix': 'ap-',
-                             'part':     'pt-',
-                             'example':  'ex-'}
-                if prefixMap.has_key(node.nodeName):
-                    expectedPrefix = prefixMap[node.nodeName]
-                    if not id.startswith(expectedPrefix):
-                        self.reporter.handle_warning(IdDoesNotStartWithPrefix(node, id, expectedPrefix))
-
-                # FIXME: Ensure that section IDs contain the chapter ID suffix
-
-                # FIXME: Ensure id is not too long:
+        def handle_id(self, node, id, chapterId, isNew):
+            nodeName = node.nodeName
+
+            # Ensure id starts with correct prefix:
+            if prefixMap.has_key(nodeName):
+                expectedPrefix = prefixMap[nodeName]
+                if not id.startswith(expectedPrefix):
+                    self.reporter.handle_warning(IdDoesNotStartWithPrefix(node, id, expectedPrefix))
+
+            # Ensure that section IDs contain the chapter ID suffix:
+            if chapterId and nodeName in sectionElements:
+                chapterSuffix = get_id_suffix(chapterId)
+                if chapterSuffix not in id:
+                    self.reporter.handle_warning(SectionIdLacksChapterSuffix(node, id, chapterSuffix))
+
+            # Ensure id is not too long:
+            if len(id) > self.maxIdLength:
+                self.reporter.handle_warning(IdTooLong(node, id, self.maxIdLength))
             
             # FIXME: should we complain if one of these is missing an ID?
 
@@ -86,7 +134,30 @@ goodSectionId="""<?xml version="1.0"?>
 
 class TestFedoraIdNamingConvention(SelfTest):
     def test_bad_section_id(self):
-        self.assertRaises(IdDoesNotStartWithPrefix, self.lint_string, badSectionId)
+        self.assertWarns(IdDoesNotStartWithPrefix, self.lint_string, badSectionId)
 
     def test_good_section_id(self):
         self.lint_string(goodSectionId)
+
+chapterSuffixExample="""<?xml version="1.0"?>
+<chapter id="ch-intro">
+<title>Example of section IDs within a chapter</title>
+<section id="sn-intro-start"><para>This section's ID has the chapter's suffix.</para></section>
+<section id="sn-start"><para>This one doesn't.</para></section>
+</chapter>
+"""
+
+class TestFedoraChapterSuffix(unittest.TestCase):
+    def test_chapter_suffix(self):
+        "Ensure that section IDs must contain the ID suffix of their chapter"
+        for backend in ('dom', 'stream'):
+            config = Configuration()
+            config.spellCheck = False
+            config.maxIdLength = 12
+            reporter = CollectingReporter()
+            linter = DocBookLinter(reporter=reporter, config=config)
+            linter.test_doc(load_source(chapterSuffixExample, backend))
+            self.assertEquals([(warning.__class__.__name__, warning.id)
+                               for warning in reporter.warnings],
+                              [('IdTooLong', 'sn-intro-start'),
+                               ('SectionIdLacksChapterSuffix', 'sn-start')])
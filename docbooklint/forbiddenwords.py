@@ -14,35 +14,96 @@
 # Author: David Malcolm
 from docbooklint.linter import *
 from docbooklint.xmlutils import *
+from docbooklint.tokenizer import iter_words, make_word_pattern, get_symbols
 
 class ForbiddenWord(DocBookError):
+    __slots__ = ('word',)
+
     def __init__(self, node, word):
         DocBookError.__init__(self, node)
         self.word = word
 
     def __str__(self):
-        return 'Forbidden word: "%s" in context "%s..."'%(self.word, self.node.wholeText.strip()[:100])
+        return 'Forbidden word: "%s" in context "%s..."'%(self.word, self.context)
+
+class ForbiddenWordMatcher:
+    """
+    A list of forbidden words and phrases, compiled for matching.
+
+    Each term is split into words, and indexed by its first word, so that
+    text can be scanned with a single pass over its words: each word is
+    looked up in the index, and only the phrases that start with that word
+    are compared any further.  The cost of the scan doesn't depend on the
+    number of forbidden terms.
+
+    Symbols within the terms (e.g. the "+" of "C++") are treated as parts
+    of words, by both the terms and the text, so that such terms can match.
+    """
+    def __init__(self, terms, ignoreCase=False):
+        self.ignoreCase = ignoreCase
+        self.phrasesByFirstWord = {}
+        self.maxPhraseLength = 0
+        symbols = set()
+        for term in terms:
+            symbols.update(get_symbols(term))
+        self.wordPattern = make_word_pattern(symbols)
+        for term in terms:
+            phrase = tuple([self.normalize(word)
+                            for word, offset in iter_words(term, self.wordPattern)])
+            if not phrase:
+                continue
+            self.phrasesByFirstWord.setdefault(phrase[0], []).append(phrase)
+            self.maxPhraseLength = max(self.maxPhraseLength, len(phrase))
+
+    def normalize(self, word):
+        if self.ignoreCase:
+            return word.lower()
+        return word
+
+    def find_matches(self, text):
+        "Get a list of the forbidden terms within the text, as they appear there"
+        matches = []
+        if not self.phrasesByFirstWord:
+            return matches
+        if self.maxPhraseLength == 1:
+            for word, offset in iter_words(text, self.wordPattern):
+                if self.normalize(word) in self.phrasesByFirstWord:
+                    matches.append(word)
+            return matches
+
+        words = []
+        offsets = []
+        for word, offset in iter_words(text, self.wordPattern):
+            words.append(self.normalize(word))
+            offsets.append(offset)
+        for i in range(len(words)):
+            for phrase in self.phrasesByFirstWord.get(words[i], ()):
+                end = i + len(phrase)
+                if tuple(words[i:end]) == phrase:
+                    lastWord = words[end - 1]
+                    matches.append(text[offsets[i]:offsets[end - 1] + len(lastWord)])
+        return matches
 
 class DocBookForbiddenWords(DocBookTest):
-    def __init__(self, forbiddenWords):
-        self.forbiddenWords = forbiddenWords
+    def __init__(self, forbiddenWords, ignoreCase=False):
+        self.matcher = ForbiddenWordMatcher(forbiddenWords, ignoreCase)
+
+    @classmethod
+    def from_config(cls, config):
+        return DocBookForbiddenWords(config.forbiddenWords,
+                                     config.forbiddenWordsIgnoreCase)
         
-    def perform_test(self, reporter, doc):
-        visitor = DocBookForbiddenWords.Visitor(self.forbiddenWords, reporter)
-        visitor.visit_doc(doc)
+    def make_visitor(self, reporter):
+        return DocBookForbiddenWords.Visitor(self.matcher, reporter)
 
     class Visitor(XmlVisitor):
-        def __init__(self, forbiddenWords, reporter):
-            self.forbiddenWords = forbiddenWords
+        def __init__(self, matcher, reporter):
+            self.matcher = matcher
             self.reporter = reporter
 
         def visit_textual(self, node):
-            lines = node.wholeText.splitlines()
-            for line in lines:
-                for word in line.strip().split(' '):
-                    word = word.strip(' .,()-:;')
-                    if word in self.forbiddenWords:
-                        self.reporter.handle_warning(ForbiddenWord(node, word))
+            for word in self.matcher.find_matches(node.wholeText):
+                self.reporter.handle_warning(ForbiddenWord(node, word))
 
         def visit_element(self, node):
             pass
@@ -63,5 +124,34 @@ class TestForbiddenWords(SelfTest):
         "Ensure that forbidden words are flagged"
         config = Configuration()
         config.forbiddenWords = ['ethereal']
-        self.assertRaises(ForbiddenWord, self.lint_string, badWordsExample, config)
+        self.assertWarns(ForbiddenWord, self.lint_string, badWordsExample, config)
+
+    def test_no_bad_words(self):
+        "Ensure that text without forbidden words isn't flagged"
+        config = Configuration()
+        config.forbiddenWords = ['Dickens', 'unison and timid']
+        self.lint_string(badWordsExample, config)
 
+    def test_phrases(self):
+        "Ensure that every forbidden word and phrase in the text is found"
+        matcher = ForbiddenWordMatcher(['charm', 'strong difference', 'in unison, with'])
+        text = 'the charm of her (strong\ndifference) were not in unison, with this'
+        self.assertEquals(matcher.find_matches(text),
+                          ['charm', 'strong\ndifference', 'in unison, with'])
+
+    def test_ignore_case(self):
+        "Ensure that forbidden words can be matched regardless of case"
+        self.assertEquals(ForbiddenWordMatcher(['Unison']).find_matches('in unison'), [])
+        matcher = ForbiddenWordMatcher(['Unison'], ignoreCase=True)
+        self.assertEquals(matcher.find_matches('in unison, UNISON'), ['unison', 'UNISON'])
+
+    def test_symbols(self):
+        "Ensure that forbidden terms containing symbols are found"
+        matcher = ForbiddenWordMatcher(['C++', 'C#', 'charm'])
+        self.assertEquals(matcher.find_matches('in C++, C# or C: the charm, C+'),
+                          ['C++', 'C#', 'charm'])
+        config = Configuration()
+        config.spellCheck = False
+        config.forbiddenWords = ['C++']
+        self.assertWarns(ForbiddenWord, self.lint_string,
+                         badWordsExample.replace('timid', '(C++)'), config)
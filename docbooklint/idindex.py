@@ -0,0 +1,199 @@
+# Copyright (c) 2008 Red Hat, Inc. All rights reserved. This copyrighted material
+# is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Author: David Malcolm
+
+from docbooklint.xmlutils import *
+
+import json
+import unittest
+
+#
+# An index of the IDs within a document (including everything that it
+# XIncludes), and of the links to them, built as part of the linter's single
+# traversal so that link and ID checks don't need to search the tree.
+#
+# The linter builds one index for each document, with a single IdIndexer,
+# for all of the tests that set usesIdIndex; their visitors are
+# IdIndexListeners, which are told about each ID and link as it is indexed.
+#
+
+# Elements whose IDs identify the chapter that the elements within them are
+# part of:
+chapterElements = frozenset(['chapter', 'appendix', 'preface'])
+
+# Elements whose linkend attributes are links to IDs:
+linkElements = frozenset(['xref', 'link'])
+
+# The location of nodes that weren't parsed by us (e.g. within a DOM that the
+# caller built), and so have none:
+unknownLocation = (None, None, None)
+
+class IdIndex:
+    """
+    ids: map from each ID to an (element name, filename, chapter ID) tuple for
+    the first element that has it; the chapter ID is that of the innermost
+    enclosing element in chapterElements, or None
+
+    duplicates: (ID, element name, filename) for each later element using an
+    ID that was already taken
+
+    links: (linkend, element name, filename, line, column) for each link, in
+    document order
+
+    The index can be converted to and from plain lists and dictionaries, so
+    that it can be stored as JSON (e.g. in the incremental state file).
+    """
+    def __init__(self):
+        self.ids = {}
+        self.duplicates = []
+        self.links = []
+
+    def add_id(self, id, nodeName, filename, chapterId):
+        "Add the ID; returns False if it was already in the index"
+        if self.ids.has_key(id):
+            self.duplicates.append((id, nodeName, filename))
+            return False
+        self.ids[id] = (nodeName, filename, chapterId)
+        return True
+
+    def add_link(self, linkend, nodeName, location):
+        self.links.append((linkend, nodeName) + tuple(location))
+
+    def get_dangling_links(self):
+        "Get the links whose linkend isn't an ID within the document"
+        return [link for link in self.links if not self.ids.has_key(link[0])]
+
+    def to_dict(self):
+        return {'ids': dict([(id, list(entry)) for id, entry in self.ids.iteritems()]),
+                'duplicates': [list(duplicate) for duplicate in self.duplicates],
+                'links': [list(link) for link in self.links]}
+
+    @classmethod
+    def from_dict(cls, data):
+        index = cls()
+        index.ids = dict([(id, tuple(entry)) for id, entry in data['ids'].iteritems()])
+        index.duplicates = [tuple(duplicate) for duplicate in data['duplicates']]
+        index.links = [tuple(link) for link in data['links']]
+        return index
+
+class IdIndexListener(XmlVisitor):
+    """
+    Base class for the visitors of tests that use the linter's IdIndex.  The
+    linter sets idIndex to the shared index, and registers the visitor with
+    the IdIndexer (see IdIndexer.add_listener), so that the handlers are
+    called as IDs and links are added to it.
+    """
+    idIndex = None
+
+    def visit_element(self, node):
+        pass
+
+    def visit_textual(self, node):
+        pass
+
+    def handle_id(self, node, id, chapterId, isNew):
+        """
+        Called for each element with an ID, with the ID of its chapter (or
+        None); isNew is False if the ID was already taken
+        """
+        pass
+
+    def handle_link(self, node, linkend):
+        "Called for each link, before its linkend is known to be valid"
+        pass
+
+class IdIndexer(XmlVisitor):
+    "Visitor that builds an IdIndex of the document, telling its listeners as it goes"
+    def __init__(self):
+        self.idIndex = IdIndex()
+        self.listeners = []
+        # The IDs of the enclosing chapters (None for the top level, or for a
+        # chapter without an ID):
+        self.chapterIds = [None]
+
+    def add_listener(self, listener):
+        "Call the listener's handle_id and handle_link as IDs and links are indexed"
+        self.listeners.append(listener)
+
+    def visit_textual(self, node):
+        pass
+
+    def visit_element(self, node):
+        nodeName = node.nodeName
+        id = node.getAttribute('id')
+        if id:
+            self.add_id(node, id, self.chapterIds[-1])
+        if nodeName in chapterElements:
+            self.chapterIds.append(id or None)
+        elif nodeName in linkElements:
+            linkend = node.getAttribute('linkend')
+            if linkend:
+                self.add_link(node, linkend)
+
+    def leave_element(self, node):
+        if node.nodeName in chapterElements:
+            self.chapterIds.pop()
+
+    def add_id(self, node, id, chapterId):
+        filename = (get_location(node) or unknownLocation)[0]
+        isNew = self.idIndex.add_id(id, node.nodeName, filename, chapterId)
+        for listener in self.listeners:
+            listener.handle_id(node, id, chapterId, isNew)
+
+    def add_link(self, node, linkend):
+        for listener in self.listeners:
+            listener.handle_link(node, linkend)
+        self.idIndex.add_link(linkend, node.nodeName, get_location(node) or unknownLocation)
+
+#
+# Unit tests
+#
+
+indexExample = """<?xml version="1.0"?>
+<book>
+<chapter id="ch-intro">
+<section id="sn-intro-start"><para>See <xref linkend="sn-usage-start"/>.</para></section>
+</chapter>
+<chapter id="ch-usage">
+<section id="sn-usage-start"><para><link linkend="sn-missing">More</link></para></section>
+<section id="sn-intro-start"/>
+</chapter>
+</book>
+"""
+
+class TestIdIndex(unittest.TestCase):
+    def build_index(self, backend):
+        indexer = IdIndexer()
+        indexer.visit_doc(load_source(indexExample, backend))
+        return indexer.idIndex
+
+    def test_index(self):
+        "Ensure that IDs, their chapters, duplicates and links are all indexed"
+        for backend in ('dom', 'stream'):
+            index = self.build_index(backend)
+            self.assertEquals(index.ids['sn-usage-start'], (u'section', None, u'ch-usage'))
+            self.assertEquals(index.ids['ch-usage'], (u'chapter', None, None))
+            self.assertEquals(index.duplicates, [(u'sn-intro-start', u'section', None)])
+            self.assertEquals([link[:2] for link in index.links],
+                              [(u'sn-usage-start', u'xref'), (u'sn-missing', u'link')])
+            self.assertEquals(index.get_dangling_links(),
+                              [(u'sn-missing', u'link', None, 7, 36)])
+
+    def test_serialization(self):
+        "Ensure that the index survives a round trip through JSON"
+        index = self.build_index('dom')
+        copy = IdIndex.from_dict(json.loads(json.dumps(index.to_dict())))
+        self.assertEquals(copy.ids, index.ids)
+        self.assertEquals(copy.duplicates, index.duplicates)
+        self.assertEquals(copy.links, index.links)
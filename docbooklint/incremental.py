@@ -0,0 +1,370 @@
+# Copyright (c) 2008 Red Hat, Inc. All rights reserved. This copyrighted material
+# is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Author: David Malcolm
+
+import hashlib
+import json
+import os
+import os.path
+import shutil
+import StringIO
+import tempfile
+import time
+import unittest
+
+# The Configuration settings that name files (or lists of files) whose
+# content affects the results:
+configFileSettings = ('personalWordList', 'allowLists', 'ruleFiles')
+
+def hash_file(filename):
+    f = open(filename, 'rb')
+    try:
+        return hashlib.md5(f.read()).hexdigest()
+    finally:
+        f.close()
+
+# The signature of an XIncluded file that didn't exist, so that creating it
+# causes the includer to be checked again:
+absentSignature = 'absent'
+
+def get_signature(filename):
+    "Get a [mtime, size, content hash] list describing the file"
+    stat = os.stat(filename)
+    return [stat.st_mtime, stat.st_size, hash_file(filename)]
+
+def is_unchanged(filename, signature):
+    "Does the file still have the given signature?"
+    if signature is None:
+        # (the file changed whilst it was being checked)
+        return False
+    if signature == absentSignature:
+        return not os.path.exists(filename)
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return False
+    if [stat.st_mtime, stat.st_size] == signature[:2]:
+        return True
+    # The file has been touched, but its content may still be the same:
+    return stat.st_size == signature[1] and hash_file(filename) == signature[2]
+
+def get_config_fingerprint(config):
+    """
+    Get a string identifying the configuration, including the content of the
+    files that it names (so that e.g. editing an allow-list changes it)
+    """
+    items = config.__dict__.items()
+    items.sort()
+    fingerprint = hashlib.md5(repr(items))
+    for name in configFileSettings:
+        filenames = getattr(config, name, None)
+        if not filenames:
+            continue
+        if isinstance(filenames, basestring):
+            filenames = [filenames]
+        for filename in filenames:
+            if os.path.isfile(filename):
+                fingerprint.update(hash_file(filename))
+            else:
+                fingerprint.update('missing')
+    return fingerprint.hexdigest()
+
+class IncrementalState:
+    """
+    The results of earlier runs, so that files can be skipped if neither
+    they nor anything that they XInclude have changed.
+
+    For each top-level file that was checked, the state records the files
+    that it XIncluded (directly or transitively) or tried to, the signature
+    of each of those files and of the top-level file itself, the warnings
+    that were reported, and the number that were suppressed.  The state is
+    discarded if the configuration changes.
+    """
+    # The version of the format of the state file, which must be bumped
+    # whenever it changes (including the form of the stored warnings, i.e.
+    # WarningRecord.to_list), so that older state files are ignored:
+    #   1: warnings as text
+    #   2: warnings as [kind, message, location] lists
+    #   3: warnings as [kind, message, location, sourceLine, occurrences]
+    #      lists, with each file's IdIndex
+    #   4: also the XIncludes that couldn't be followed, and the number of
+    #      suppressed warnings
+    version = 4
+
+    def __init__(self, filename, config):
+        self.filename = filename
+        # Files modified after this can't be trusted to have been checked as
+        # they now are:
+        self.startTime = time.time()
+        self.configFingerprint = get_config_fingerprint(config)
+        self.entries = {}
+        # Signatures taken before the files were checked (see take_signatures):
+        self.signatures = {}
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.filename):
+            return
+        f = open(self.filename, 'rb')
+        try:
+            try:
+                data = json.load(f)
+            except ValueError:
+                return
+        finally:
+            f.close()
+        if not isinstance(data, dict) or data.get('version') != self.version:
+            return
+        if data.get('config') != self.configFingerprint:
+            return
+        self.entries = data['files']
+
+    def save(self):
+        # Write to a temporary file and rename it, so that an interrupted
+        # run can't leave a truncated state file behind:
+        dirName = os.path.dirname(os.path.abspath(self.filename))
+        fd, tempFilename = tempfile.mkstemp(dir=dirName)
+        f = os.fdopen(fd, 'wb')
+        try:
+            json.dump({'version': self.version,
+                       'config': self.configFingerprint,
+                       'files': self.entries}, f)
+        finally:
+            f.close()
+        os.rename(tempFilename, self.filename)
+
+    def get_cached_warnings(self, filename):
+        """
+        Get the warnings for the file from an earlier run (as WarningRecords),
+        or None if the file (or something that it includes) has changed since
+        then.  An entry that can't be understood is treated as out of date.
+        """
+        from docbooklint.linter import WarningRecord
+        entry = self.entries.get(os.path.abspath(filename))
+        if entry is None:
+            return None
+        try:
+            for path, signature in entry['signatures'].iteritems():
+                if not is_unchanged(path, signature):
+                    return None
+            return [WarningRecord(*warning) for warning in entry['warnings']]
+        except (AttributeError, KeyError, IndexError, TypeError, ValueError):
+            return None
+
+    def get_cached_index_data(self, filename):
+        """
+        Get the IdIndex of the file, as a dictionary, from the earlier run
+        whose warnings get_cached_warnings found to be still valid (or None)
+        """
+        return self.entries[os.path.abspath(filename)].get('idIndex')
+
+    def get_cached_num_suppressed(self, filename):
+        """
+        Get the number of warnings that were suppressed for the file, in the
+        earlier run whose warnings get_cached_warnings found to be still valid
+        """
+        return self.entries[os.path.abspath(filename)].get('suppressed', 0)
+
+    def take_signatures(self, filenames):
+        """
+        Take the signatures of the files that are about to be checked, and of
+        the files that they included last time, before checking them, so
+        that any change made during the run is noticed by the next one
+        """
+        for filename in filenames:
+            path = os.path.abspath(filename)
+            paths = [path]
+            entry = self.entries.get(path)
+            if isinstance(entry, dict) and isinstance(entry.get('includes'), list):
+                paths += entry['includes']
+            for path in paths:
+                if not self.signatures.has_key(path) and os.path.isfile(path):
+                    self.signatures[path] = get_signature(path)
+
+    def get_signature(self, path):
+        "Get the signature of a file that has been checked"
+        signature = self.signatures.get(path)
+        if signature is None:
+            # (a file that was newly included)
+            signature = get_signature(path)
+            if signature[0] >= self.startTime:
+                return None
+        return signature
+
+    def record(self, filename, includedFiles, warnings, idIndexData=None,
+               numSuppressed=0):
+        """
+        Record the results of checking the file (a list of WarningRecords,
+        the IdIndex, as a dictionary, if there is one, and the number of
+        warnings suppressed).  The included files should include those that
+        couldn't be followed, e.g. because they were missing.
+        """
+        includedFiles = [os.path.abspath(path) for path in includedFiles]
+        signatures = {}
+        for path in [os.path.abspath(filename)] + includedFiles:
+            if os.path.exists(path):
+                signatures[path] = self.get_signature(path)
+            else:
+                signatures[path] = absentSignature
+        self.entries[os.path.abspath(filename)] = {'includes': includedFiles,
+                                                   'signatures': signatures,
+                                                   'warnings': [warning.to_list()
+                                                                for warning in warnings],
+                                                   'idIndex': idIndexData,
+                                                   'suppressed': numSuppressed}
+
+#
+# Unit tests
+#
+
+class TestIncrementalState(unittest.TestCase):
+    def setUp(self):
+        self.dirName = tempfile.mkdtemp()
+        self.mainFilename = self.write_file('main.xml', """<?xml version="1.0"?>
+<article xmlns:xi="http://www.w3.org/2001/XInclude">
+<section id="first"><para>Some text</para></section>
+<xi:include href="part.xml"/>
+</article>
+""")
+        self.write_part('sn-second')
+
+    def tearDown(self):
+        shutil.rmtree(self.dirName)
+
+    def write_file(self, name, sourceStr):
+        filename = os.path.join(self.dirName, name)
+        f = open(filename, 'w')
+        f.write(sourceStr)
+        f.close()
+        return filename
+
+    def write_part(self, sectionId):
+        self.write_file('part.xml', """<?xml version="1.0"?>
+<section id="%s"><para>Some more text</para></section>
+""" % sectionId)
+
+    def make_config(self):
+        from docbooklint.linter import Configuration
+        config = Configuration()
+        config.spellCheck = False
+        config.incrementalStateFile = os.path.join(self.dirName, 'state.json')
+        return config
+
+    def check(self, idIndexes=None, config=None):
+        "Run the linter incrementally, returning the output and statistics"
+        from docbooklint.linter import PrintingReporter, check_files
+        if config is None:
+            config = self.make_config()
+        outputFileObj = StringIO.StringIO()
+        stats = {}
+        check_files([self.mainFilename], config,
+                    reporter=PrintingReporter(outputFileObj, None), stats=stats,
+                    idIndexes=idIndexes)
+        return outputFileObj.getvalue(), stats
+
+    def test_replay(self):
+        "Ensure that unchanged files are replayed from the state file"
+        firstOutput, stats = self.check()
+        self.assertEquals(stats['incremental files checked'], 1)
+        secondOutput, stats = self.check()
+        self.assertEquals(stats['incremental files replayed'], 1)
+        self.assertEquals(stats['incremental files checked'], 0)
+        self.assertEquals(secondOutput, firstOutput)
+
+    def test_changed_include(self):
+        "Ensure that a change to an included file causes the includer to be rechecked"
+        firstOutput, stats = self.check()
+        self.assertEquals(firstOutput.count('\n'), 1)
+        self.write_part('bad-second-id')
+        secondOutput, stats = self.check()
+        self.assertEquals(stats['incremental files checked'], 1)
+        self.assertEquals(secondOutput.count('\n'), 2)
+
+    def test_replay_id_index(self):
+        "Ensure that the IdIndex of a file is replayed along with its warnings"
+        firstIndexes = {}
+        self.check(firstIndexes)
+        secondIndexes = {}
+        output, stats = self.check(secondIndexes)
+        self.assertEquals(stats['incremental files replayed'], 1)
+        self.assertEquals(secondIndexes[self.mainFilename].ids,
+                          firstIndexes[self.mainFilename].ids)
+        self.assertEquals(secondIndexes[self.mainFilename].ids['sn-second'][0], 'section')
+
+    def test_changed_allow_list(self):
+        "Ensure that a change to the content of a file named by the configuration is noticed"
+        config = self.make_config()
+        config.allowLists = [self.write_file('allow.txt', 'xyzzy\n')]
+        firstFingerprint = get_config_fingerprint(config)
+        self.assertEquals(get_config_fingerprint(config), firstFingerprint)
+        self.write_file('allow.txt', 'plugh\n')
+        self.assertNotEquals(get_config_fingerprint(config), firstFingerprint)
+
+    def test_change_during_run(self):
+        "Ensure that files changed whilst being checked are checked again"
+        state = IncrementalState(os.path.join(self.dirName, 'state.json'), self.make_config())
+        state.take_signatures([self.mainFilename])
+        self.write_file('main.xml', '<article/>')
+        state.record(self.mainFilename, [], [])
+        self.assertEquals(state.get_cached_warnings(self.mainFilename), None)
+
+        # (an included file whose signature wasn't taken beforehand)
+        partFilename = os.path.join(self.dirName, 'part.xml')
+        os.utime(partFilename, (state.startTime + 10, state.startTime + 10))
+        state.take_signatures([self.mainFilename])
+        state.record(self.mainFilename, [partFilename], [])
+        self.assertEquals(state.get_cached_warnings(self.mainFilename), None)
+
+    def test_malformed_entry(self):
+        "Ensure that an entry in an older format is rechecked rather than replayed"
+        firstOutput, stats = self.check()
+        # (as written by version 1, but with the current version number)
+        statePath = os.path.join(self.dirName, 'state.json')
+        f = open(statePath)
+        state = json.load(f)
+        f.close()
+        state['files'][os.path.abspath(self.mainFilename)]['warnings'] = ['main.xml:3:1: A warning']
+        f = open(statePath, 'w')
+        json.dump(state, f)
+        f.close()
+        secondOutput, stats = self.check()
+        self.assertEquals(stats['incremental files checked'], 1)
+        self.assertEquals(secondOutput, firstOutput)
+
+    def test_missing_include(self):
+        "Ensure that creating a missing XInclude causes the includer to be rechecked"
+        os.remove(os.path.join(self.dirName, 'part.xml'))
+        firstOutput, stats = self.check()
+        self.assert_(firstOutput.find('part.xml') >= 0)
+        secondOutput, stats = self.check()
+        self.assertEquals(stats['incremental files replayed'], 1)
+        self.write_part('sn-second')
+        thirdOutput, stats = self.check()
+        self.assertEquals(stats['incremental files checked'], 1)
+        self.assertEquals(thirdOutput.find('part.xml'), -1)
+
+    def test_replay_suppressed(self):
+        "Ensure that the number of suppressed warnings is replayed too"
+        from docbooklint.linter import CollectingReporter, WarningFilter, check_files
+        self.write_part('bad-second-id')
+        config = self.make_config()
+        config.maxWarningsPerKind = 1
+        for expectedStat in ('incremental files checked', 'incremental files replayed'):
+            reporter = WarningFilter(CollectingReporter())
+            stats = {}
+            numWarnings = check_files([self.mainFilename], config, reporter=reporter,
+                                      stats=stats)
+            self.assertEquals(stats[expectedStat], 1)
+            self.assertEquals(numWarnings, 2)
+            self.assertEquals(reporter.numSuppressed, 1)
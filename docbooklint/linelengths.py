@@ -15,60 +15,195 @@
 from docbooklint.linter import *
 from docbooklint.xmlutils import *
 
+import re
+import sys
+import unicodedata
+
+# Elements whose text is rendered as-is, line by line, and so whose lines
+# are measured:
+verbatimElements = frozenset(['screen', 'programlisting', 'literallayout'])
+
+# Characters that aren't simply one column wide: tabs, and those from which
+# East Asian wide characters begin (there are none before U+1100):
+specialCharacters = re.compile(u'[\t\u1100-%s]' % unichr(sys.maxunicode))
+
 class InlineTextTooLong(DocBookError):
-    def __init__(self, node):
+    __slots__ = ('text',)
+
+    def __init__(self, node, text):
         DocBookError.__init__(self, node)
+        self.text = text
 
     def __str__(self):
-        wholeText = self.node.wholeText
-        return 'Inline text too long: "%s" (%i characters)'%(wholeText, len(wholeText))
+        return 'Inline text too long: "%s" (%i characters)'%(self.text, len(self.text))
 
 class LineTooLong(DocBookError):
-    def __init__(self, node, line):
+    __slots__ = ('line', 'width')
+
+    def __init__(self, node, line, width):
         DocBookError.__init__(self, node)
         self.line = line
+        self.width = width
 
     def __str__(self):
-        return 'Line too long: "%s" (%i characters)'%(self.line, len(self.line))
+        return 'Line too long: "%s" (%i columns)'%(self.line, self.width)
+
+class LineScanner:
+    """
+    Measures the lines of a block of verbatim text, which is fed to it a
+    piece at a time (e.g. the text either side of a <replaceable>), calling
+    handle_long_line(line, width) for each line wider than maxWidth.
+
+    Lines are found and measured in place, so that a huge block (e.g. a log
+    dump) costs no more than a scan of its text; only the lines that are too
+    long are ever copied out.
+    """
+    def __init__(self, maxWidth, tabWidth, wideCharacterWidth, handle_long_line):
+        self.maxWidth = maxWidth
+        self.tabWidth = tabWidth
+        self.wideCharacterWidth = wideCharacterWidth
+        self.handle_long_line = handle_long_line
+        # Matches a line that's too long (with the newline before it), when
+        # each character is one column; a newline is quick to search for:
+        self.longLinePattern = re.compile(u'\n([^\n]{%i,})' % (maxWidth + 1))
+        self.column = 0
+        # (text, start) for each earlier piece of text that the current line
+        # began in, so that the line can be reconstructed if it's too long:
+        self.pieces = []
+
+    def feed(self, text):
+        # The first line continues the one from the previous piece of text,
+        # and the last may be continued by the next piece; any lines between
+        # are complete within this piece:
+        firstEnd = text.find(u'\n')
+        if firstEnd == -1:
+            self.advance(text, 0, len(text))
+            if text:
+                self.pieces.append((text, 0))
+            return
+        self.advance(text, 0, firstEnd)
+        self.end_line(text, 0, firstEnd)
+        lastStart = text.rfind(u'\n') + 1
+        self.scan_lines(text, firstEnd + 1, lastStart)
+        self.advance(text, lastStart, len(text))
+        if lastStart < len(text):
+            self.pieces.append((text, lastStart))
+
+    def scan_lines(self, text, start, end):
+        "Measure the complete lines of text[start:end], which follows a newline"
+        while True:
+            # Up to the line with the next tab or wide character, every
+            # character is one column wide, so the regular expression engine
+            # can find the long lines itself:
+            match = specialCharacters.search(text, start, end)
+            if match is None:
+                plainEnd = end
+            else:
+                plainEnd = text.rfind(u'\n', start - 1, match.start()) + 1
+            for longLine in self.longLinePattern.finditer(text, start - 1, plainEnd):
+                self.handle_long_line(longLine.group(1), longLine.end() - longLine.start(1))
+            if match is None:
+                return
+            lineEnd = text.find(u'\n', match.end(), end)
+            self.advance(text, plainEnd, lineEnd)
+            self.end_line(text, plainEnd, lineEnd)
+            start = lineEnd + 1
+
+    def finish(self):
+        "Handle the final line, if the text didn't end with a newline"
+        self.end_line(u'', 0, 0)
+
+    def advance(self, text, start, end):
+        "Advance the column over text[start:end], which has no newlines"
+        column = self.column
+        for match in specialCharacters.finditer(text, start, end):
+            index = match.start()
+            column += index - start
+            if text[index] == u'\t':
+                column += self.tabWidth - column % self.tabWidth
+            elif unicodedata.east_asian_width(text[index]) in ('W', 'F'):
+                column += self.wideCharacterWidth
+            else:
+                column += 1
+            start = index + 1
+        self.column = column + end - start
+
+    def end_line(self, text, start, end):
+        if self.column > self.maxWidth:
+            line = u''.join([piece[pieceStart:] for piece, pieceStart in self.pieces]
+                            + [text[start:end]])
+            self.handle_long_line(line, self.column)
+        self.column = 0
+        if self.pieces:
+            self.pieces = []
 
 class DocBookLineLengths(DocBookTest):
-    def __init__(self, maxLineLength):
+    """
+    Checks the lines of verbatim blocks (e.g. <screen>), as rendered, and the
+    length of <computeroutput> text
+    """
+    def __init__(self, maxLineLength, tabWidth=8, wideCharacterWidth=2):
         self.maxLineLength = maxLineLength
+        self.tabWidth = tabWidth
+        self.wideCharacterWidth = wideCharacterWidth
+
+    @classmethod
+    def from_config(cls, config):
+        return DocBookLineLengths(config.maxLineLength, config.tabWidth,
+                                  config.wideCharacterWidth)
         
-    def perform_test(self, reporter, doc):
-        visitor = DocBookLineLengths.Visitor(reporter, self.maxLineLength)
-        visitor.visit_doc(doc)
+    def make_visitor(self, reporter):
+        return DocBookLineLengths.Visitor(reporter, self.maxLineLength, self.tabWidth,
+                                          self.wideCharacterWidth)
 
     class Visitor(XmlVisitor):
-        def __init__(self, reporter, maxLineLength):
+        def __init__(self, reporter, maxLineLength, tabWidth, wideCharacterWidth):
             self.reporter = reporter
             self.maxLineLength = maxLineLength
-
-        def visit_textual(self, node):
-            pass
+            self.tabWidth = tabWidth
+            self.wideCharacterWidth = wideCharacterWidth
+            # A LineScanner for each verbatim element we're within; text is
+            # measured by the innermost:
+            self.scanners = []
+            # [node, first text node, pieces of text, length] for the
+            # <computeroutput> we're within (outside of any verbatim element),
+            # if any:
+            self.inlineText = None
 
         def visit_element(self, node):
-            #print node.nodeName
-            if node.nodeName=='screen':
-                # Crude check for length of lines:
-                if node.firstChild:
-                    if is_textual(node.firstChild):
-                        wholeText = node.firstChild.wholeText
-                        
-                        lines = wholeText.splitlines()
-                        for line in lines:
-                            if len(line)>self.maxLineLength:
-                                self.reporter.handle_warning(LineTooLong(node, line))
+            if node.nodeName in verbatimElements:
+                def handle_long_line(line, width):
+                    self.reporter.handle_warning(LineTooLong(node, line, width))
+                self.scanners.append(LineScanner(self.maxLineLength, self.tabWidth,
+                                                 self.wideCharacterWidth,
+                                                 handle_long_line))
             elif node.nodeName=='computeroutput':
                 # <computeroutput> is a non-verbatim inline environment, typically monospaced
                 # Many toolchains appear to have the implicit assumption that only short
                 # amounts of text will appear, and don't support line-breaking within it,
-                # so it's thus useful to flag problems if a text node below it has a large number of characters
-                if node.firstChild:
-                    if is_textual(node.firstChild):
-                        wholeText = node.firstChild.wholeText
-                        if len(wholeText)>self.maxLineLength:
-                            self.reporter.handle_warning(InlineTextTooLong(node.firstChild))
+                # so it's thus useful to flag problems if the text below it has a large number
+                # of characters.  (Within a verbatim element, its lines are measured instead.)
+                if not self.scanners and self.inlineText is None:
+                    self.inlineText = [node, None, [], 0]
+
+        def leave_element(self, node):
+            if node.nodeName in verbatimElements:
+                self.scanners.pop().finish()
+            elif self.inlineText is not None and self.inlineText[0] is node:
+                node, textNode, pieces, length = self.inlineText
+                self.inlineText = None
+                if length>self.maxLineLength:
+                    # (reported at where the text starts)
+                    self.reporter.handle_warning(InlineTextTooLong(textNode, u''.join(pieces)))
+
+        def visit_textual(self, node):
+            if self.scanners:
+                self.scanners[-1].feed(node.data)
+            elif self.inlineText is not None:
+                if self.inlineText[1] is None:
+                    self.inlineText[1] = node
+                self.inlineText[2].append(node.data)
+                self.inlineText[3] += len(node.data)
        
 screenTagWithReasonableLineLengths="""<?xml version="1.0"?>
 <article>
@@ -111,14 +246,45 @@ The quick brown fox jumps over the lazy dog The quick brown fox jumps over the l
 </article>
 """
 
+replaceableInScreen="""<?xml version="1.0"?>
+<article>
+<title>Example of a <tag>screen</tag> with a long line after a <tag>replaceable</tag></title>
+<screen>
+<prompt>$</prompt> <command>cp</command> <replaceable>source</replaceable> /the/quick/brown/fox/jumps/over/the/lazy/dog/the/quick/brown/fox/over
+</screen>
+</article>
+"""
+
+def make_verbatim_example(elementName, text):
+    return """<?xml version="1.0"?>
+<article>
+<title>Example of a <tag>%s</tag></title>
+<%s>%s</%s>
+</article>
+""" % (elementName, elementName, text, elementName)
+
 class TestLineLengths(SelfTest):
+    def collect_long_lines(self, sourceStr, backend='dom', **kwargs):
+        config = Configuration()
+        config.spellCheck = False
+        config.backend = backend
+        for name, value in kwargs.items():
+            setattr(config, name, value)
+        reporter = CollectingReporter()
+        linter = DocBookLinter(reporter=reporter, config=config)
+        linter.test_doc(load_source(sourceStr, backend))
+        return [(warning.__class__.__name__, warning.width)
+                for warning in reporter.warnings
+                if isinstance(warning, LineTooLong)]
+
+
     def test_screen_tag_with_reasonable_line_lengths(self):
         "Ensure no warnings for a reasonable screen tag"
         self.lint_string(screenTagWithReasonableLineLengths)
 
     def test_screen_tag_with_unreasonable_line_lengths(self):
         "Ensure a line that's too long is flagged as a warning"
-        self.assertRaises(LineTooLong, self.lint_string, screenTagWithUnreasonableLineLengths)
+        self.assertWarns(LineTooLong, self.lint_string, screenTagWithUnreasonableLineLengths)
 
     def test_ok_computeroutput(self):
         "Ensure that a long text node with line-breaks isn't flagged as a warning"
@@ -126,6 +292,44 @@ class TestLineLengths(SelfTest):
 
     def test_computeroutput_too_long(self):
         "Ensure a computeroutput that's too long is flagged as a warning"
-        self.assertRaises(InlineTextTooLong, self.lint_string, computerTagWithTooMuchText)
+        self.assertWarns(InlineTextTooLong, self.lint_string, computerTagWithTooMuchText)
+
+    def test_text_after_inline_elements(self):
+        "Ensure that the text after e.g. a <replaceable> is part of the line"
+        for backend in ('dom', 'stream'):
+            self.assertEquals(self.collect_long_lines(replaceableInScreen, backend),
+                              [('LineTooLong', 81)])
+
+    def test_other_verbatim_elements(self):
+        "Ensure that <programlisting> and <literallayout> are checked"
+        for elementName in ('programlisting', 'literallayout'):
+            sourceStr = make_verbatim_example(elementName, 'x' * 81 + '\n' + 'x' * 80)
+            self.assertEquals(self.collect_long_lines(sourceStr), [('LineTooLong', 81)])
+
+    def test_tabs(self):
+        "Ensure that tabs are expanded to the next tab stop"
+        sourceStr = make_verbatim_example('screen', '\t' * 9 + 'x' * 9)
+        self.assertEquals(self.collect_long_lines(sourceStr), [('LineTooLong', 81)])
+        self.assertEquals(self.collect_long_lines(sourceStr, tabWidth=4), [])
+
+    def test_wide_characters(self):
+        "Ensure that East Asian wide characters take two columns"
+        sourceStr = make_verbatim_example('screen', '\xe6\x97\xa5' * 41)
+        self.assertEquals(self.collect_long_lines(sourceStr), [('LineTooLong', 82)])
+        self.assertEquals(self.collect_long_lines(sourceStr, wideCharacterWidth=1), [])
 
+    def test_computeroutput_in_screen(self):
+        "Ensure that a <computeroutput> within a <screen> is measured line by line"
+        text = '<computeroutput>%s</computeroutput>' % '\n'.join(['x' * 60] * 3)
+        self.lint_string(make_verbatim_example('screen', text))
 
+    def test_scanner_pieces(self):
+        "Ensure that lines are measured and reported across pieces of text"
+        longLines = []
+        scanner = LineScanner(10, 8, 2, lambda line, width: longLines.append((line, width)))
+        for piece in [u'short\nthe quick', u' brown',
+                      u' fox\n%s\n\tx\n\t\tx\n%s\n' % (u'y' * 11, u'z' * 11), u'\u65e5' * 6]:
+            scanner.feed(piece)
+        scanner.finish()
+        self.assertEquals(longLines, [(u'the quick brown fox', 19), (u'y' * 11, 11),
+                                      (u'\t\tx', 17), (u'z' * 11, 11), (u'\u65e5' * 6, 12)])
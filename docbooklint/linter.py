@@ -15,31 +15,199 @@
 
 import unittest
 import sys
-from xmlutils import XmlFile, XmlDoc
+import os
+import os.path
+import itertools
+import json
+import shutil
+import tempfile
+from xmlutils import is_textual, XmlFile, XmlDoc, XmlMultiVisitor, load_file, load_source, documentCache, get_location, get_source_line
 
 #
 # Base class for tests
 #
 class DocBookTest:
-    def perform_test(self, reporter, dom):
+    """
+    A test is implemented as an XmlVisitor (created by make_visitor), so that
+    the linter can run all of its tests within a single traversal of the
+    document; finish_test is called once that traversal is complete.
+
+    Tests which set usesIdIndex share the IdIndex that the linter builds
+    for each document: their visitors must be IdIndexListeners (see
+    docbooklint.idindex).
+    """
+    usesIdIndex = False
+
+    def make_visitor(self, reporter):
+        raise NotImplementedError
+
+    def finish_test(self, reporter, visitor):
+        pass
+
+    def get_stats(self):
+        "Get a dictionary of named counters describing the work done"
+        return {}
+
+    @classmethod
+    def from_config(cls, config):
+        "Create the test, as set up by the configuration"
         raise NotImplementedError
 
+    def perform_test(self, reporter, doc):
+        "Run this test on its own, with a traversal of the document"
+        visitor = self.make_visitor(reporter)
+        visitor.visit_doc(doc)
+        self.finish_test(reporter, visitor)
+
 #
 # Base class for errors
 #
-class DocBookError:
+class DocBookError(object):
+    """
+    Base class for the problems found by the tests.
+
+    Everything needed to report a problem is captured from its node when the
+    warning is created, rather than keeping the node (and hence its whole
+    document) alive.  Warnings are plain objects with __slots__, so that
+    they are small; the ExceptionReporter raises them wrapped in a
+    LintWarning.
+    """
+    __slots__ = ('nodeName', 'context', 'location', 'sourceLine')
+
+    # How much of the text at the problem to keep:
+    maxContextLength = 100
+
+    # (see WarningFilter)
+    occurrences = 1
+
     def __init__(self, node):
-        self.node = node
+        self.nodeName = node.nodeName
+        self.location = get_location(node)
+        self.sourceLine = get_source_line(node)
+        if is_textual(node):
+            self.context = node.wholeText.strip()[:self.maxContextLength]
+        else:
+            self.context = None
+
+    def __unicode__(self):
+        return unicode(self.__str__())
 
     def get_context_str(self):
         maxLen = 50
-        str = self.node.wholeText.strip()
+        str = self.context
         if len(str)>maxLen:
             shortStr = "%s..."%str[:maxLen]
         else:
             shortStr = str
         return 'in context "%s"'%shortStr
 
+    def get_location(self):
+        "Get a (filename, line, column) tuple for the problem, or None"
+        return self.location
+
+    def get_kind(self):
+        "Get the name of this kind of problem"
+        return self.__class__.__name__
+
+    def get_source_line(self):
+        "Get the line of the source file on which the problem starts, or None"
+        return self.sourceLine
+
+class MissingInclude(DocBookError):
+    __slots__ = ('filename',)
+
+    def __init__(self, node, filename):
+        DocBookError.__init__(self, node)
+        self.filename = filename
+
+    def __str__(self):
+        return 'XIncluded file not found: "%s"' % self.filename
+
+class IncludeCycle(DocBookError):
+    __slots__ = ('filename',)
+
+    def __init__(self, node, filename):
+        DocBookError.__init__(self, node)
+        self.filename = filename
+
+    def __str__(self):
+        return 'XInclude of "%s" forms a cycle; not following it' % self.filename
+
+# The warning to report for each kind of problem found when following an
+# XInclude (see XmlVisitor.visit_include_problem):
+includeProblemWarnings = {'missing': MissingInclude,
+                          'cycle': IncludeCycle}
+
+class LintWarning(Exception):
+    "A warning, raised by the ExceptionReporter"
+    def __init__(self, warning):
+        Exception.__init__(self, warning)
+        self.warning = warning
+
+    def __str__(self):
+        return format_warning(self.warning).encode('utf-8')
+
+class WarningRecord(object):
+    """
+    A warning reduced to plain data: its kind, its message, its location and
+    the line of source at that location.  Warnings are sent between
+    processes, and stored between runs, in this form.
+    """
+    __slots__ = ('kind', 'message', 'location', 'sourceLine', 'occurrences')
+
+    def __init__(self, kind, message, location, sourceLine=None, occurrences=1):
+        self.kind = kind
+        self.message = message
+        if location is not None:
+            location = tuple(location)
+        self.location = location
+        self.sourceLine = sourceLine
+        self.occurrences = occurrences
+
+    @classmethod
+    def from_warning(cls, warning):
+        return WarningRecord(warning.get_kind(), u'%s' % warning,
+                             warning.get_location(), warning.get_source_line(),
+                             warning.occurrences)
+
+    def to_list(self):
+        # (if this changes, bump IncrementalState.version)
+        return [self.kind, self.message, self.location, self.sourceLine,
+                self.occurrences]
+
+    def get_location(self):
+        return self.location
+
+    def get_source_line(self):
+        return self.sourceLine
+
+    def get_kind(self):
+        return self.kind
+
+    def __str__(self):
+        return self.message
+
+    def __unicode__(self):
+        return self.message
+
+def format_warning(warning):
+    """
+    Format a warning as text, prefixed with "file:line:column: " if its
+    location is known.  Warnings which are already text are left alone.
+    """
+    if isinstance(warning, basestring):
+        return warning
+    text = u'%s' % warning
+    if warning.occurrences > 1:
+        text = u'%s (%i occurrences)' % (text, warning.occurrences)
+    location = warning.get_location()
+    if location is None:
+        return text
+    filename, line, column = location
+    if filename is None:
+        filename = '<string>'
+    return u'%s:%i:%i: %s' % (filename, line, column, text)
+
 #
 # Configuration
 #
@@ -47,9 +215,114 @@ class DocBookError:
 class Configuration:
     def __init__(self):
         self.maxLineLength = 80
+        # How verbatim text (e.g. <screen>) is measured: the columns between
+        # tab stops, and the columns taken by an East Asian wide character:
+        self.tabWidth = 8
+        self.wideCharacterWidth = 2
         self.spellCheck = True
+        # The names of checks (see checkRegistry) not to run:
+        self.disabledChecks = []
         self.defaultLangCode = "en_US"
+        # Elements whose content (including that of any elements within them)
+        # isn't spellchecked:
+        self.noSpellcheckElements = ['computeroutput', 'filename', 'ulink', 'command',
+                                     'keycap', 'tag', 'screen']
+        self.personalWordList = None
+        # Files of words to accept when spellchecking, without consulting
+        # enchant: text, one word per line, or built into the binary format
+        # of docbooklint.wordlist (better for large lists):
+        self.allowLists = []
+        # Where to persist spellchecking verdicts between runs (None to
+        # disable):
+        self.spellingCacheDir = None
+        # Threads with which to look up each document's new words:
+        self.spellcheckThreads = 1
+        # Forbidden words and phrases:
         self.forbiddenWords = []
+        self.forbiddenWordsIgnoreCase = False
+
+        # The longest ID that the Fedora naming conventions check allows:
+        self.maxIdLength = 64
+
+        # Files of declarative rules to check (see docbooklint.rules):
+        self.ruleFiles = []
+
+        # Check the URLs of <ulink> elements, with this many threads (each
+        # checking one host at a time), giving up on a request after
+        # ulinkTimeout seconds, and making no more than
+        # ulinkRequestsPerSecond requests per second to any one host (0 for
+        # no limit; check_files shares this between its worker processes):
+        self.checkULinks = False
+        self.ulinkThreads = 8
+        self.ulinkTimeout = 10.0
+        self.ulinkRequestsPerSecond = 2.0
+        # Where to keep the results between runs (None to disable), and how
+        # long, in seconds, before they need checking again:
+        self.ulinkCacheDir = None
+        self.ulinkCacheTtl = 7 * 24 * 60 * 60
+
+        # Run all tests within one traversal of the document, rather than
+        # one traversal per test:
+        self.singlePass = True
+
+        # How documents are loaded: "dom" builds a DOM for each file, whereas
+        # "stream" feeds parser events straight to the tests, so that memory
+        # usage depends on the depth of the tree rather than its size:
+        self.backend = 'dom'
+
+        # If set, the results of each run are stored in this file, and files
+        # that haven't changed since the previous run aren't checked again:
+        self.incrementalStateFile = None
+
+        # Threads with which to read and parse the XIncluded files of each
+        # document ahead of its traversal (0 to disable):
+        self.prefetchThreads = 4
+
+        # Limits on the number of warnings reported, in total and of each
+        # kind (None for no limit), and whether to fold repeated warnings
+        # together (see WarningFilter):
+        self.maxWarnings = None
+        self.maxWarningsPerKind = None
+        self.deduplicateWarnings = False
+
+        # Record the time spent in each test, and in parsing each file:
+        self.profile = False
+        # If set, each test is run under cProfile, writing a profile per
+        # test per document into this directory:
+        self.profileDumpDir = None
+
+# The checks that the linter can run, in the order in which they run: the
+# name of each check, the module and class that implement it, and the
+# Configuration attribute that must be true for it to be enabled (or None).
+# A check's module is only imported if the check is enabled.
+checkRegistry = [('line-lengths', 'docbooklint.linelengths', 'DocBookLineLengths', None),
+                 ('spellcheck', 'docbooklint.spellcheck', 'DocBookSpellChecker', 'spellCheck'),
+                 ('forbidden-words', 'docbooklint.forbiddenwords', 'DocBookForbiddenWords', None),
+                 ('fedora-ids', 'docbooklint.fedoranamingconventions',
+                  'DocBookFedoraIdNamingConvention', None),
+                 ('xrefs', 'docbooklint.xrefs', 'DocBookXrefs', None),
+                 ('ulinks', 'docbooklint.ulinks', 'DocBookULinks', 'checkULinks'),
+                 ('rules', 'docbooklint.rules', 'DocBookRules', 'ruleFiles')]
+
+def get_check_names():
+    return [name for name, moduleName, className, flag in checkRegistry]
+
+def get_enabled_checks(config):
+    "Get the (name, module, class, flag) entries for the enabled checks"
+    return [entry for entry in checkRegistry
+            if entry[0] not in config.disabledChecks
+            and (entry[3] is None or getattr(config, entry[3]))]
+
+def load_check(moduleName, className, config):
+    "Import the check's module, and create the check"
+    module = __import__(moduleName, {}, {}, [className])
+    return getattr(module, className).from_config(config)
+
+def get_default_cache_dir():
+    "Get the directory in which to keep data between runs"
+    cacheHome = os.environ.get('XDG_CACHE_HOME',
+                               os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cacheHome, 'docbook-lint')
 
 #
 # Various ways of reporting errors:
@@ -59,10 +332,88 @@ class Reporter:
     def handle_warning(self, warning):
         raise NotImplementedError
 
+    def handle_suppressed(self, numWarnings):
+        """
+        Called with the number of warnings that were dropped before reaching
+        this reporter (e.g. by a worker's WarningFilter)
+        """
+        pass
+
+    def close(self):
+        "Called once all warnings have been reported"
+        pass
+
 class ExceptionReporter(Reporter):
     """Reportin policy: raise issues as exceptions"""
     def handle_warning(self, warning):
-        raise warning
+        raise LintWarning(warning)
+
+class CollectingReporter(Reporter):
+    """Reporting policy: store warnings in a list"""
+    def __init__(self):
+        self.warnings = []
+
+    def handle_warning(self, warning):
+        self.warnings.append(warning)
+
+class WarningFilter(Reporter):
+    """
+    Reporting policy: pass warnings on to another reporter, up to a limit in
+    total (maxWarnings) and for each kind of warning (maxWarningsPerKind).
+    Further warnings are counted, but dropped.
+
+    If deduplicate is set, repeats of a warning (i.e. of the same kind, with
+    the same message) are folded into the first, which is given a count of
+    its occurrences.  These warnings are only passed on when the filter is
+    closed, as WarningRecords.
+    """
+    def __init__(self, reporter, maxWarnings=None, maxWarningsPerKind=None,
+                 deduplicate=False):
+        self.reporter = reporter
+        self.maxWarnings = maxWarnings
+        self.maxWarningsPerKind = maxWarningsPerKind
+        self.deduplicate = deduplicate
+        self.numWarnings = 0
+        self.numSuppressed = 0
+        self.countsByKind = {}
+        # When deduplicating: the distinct warnings, in order, and a map
+        # from (kind, message) to each one:
+        self.distinctWarnings = []
+        self.recordsByKey = {}
+
+    def handle_warning(self, warning):
+        kind = warning.get_kind()
+        if self.deduplicate:
+            key = (kind, u'%s' % warning)
+            record = self.recordsByKey.get(key)
+            if record is not None:
+                record.occurrences += warning.occurrences
+                return
+
+        count = self.countsByKind.get(kind, 0)
+        if ((self.maxWarnings is not None and self.numWarnings >= self.maxWarnings)
+            or (self.maxWarningsPerKind is not None and count >= self.maxWarningsPerKind)):
+            self.numSuppressed += 1
+            return
+        self.numWarnings += 1
+        self.countsByKind[kind] = count + 1
+
+        if self.deduplicate:
+            record = WarningRecord.from_warning(warning)
+            self.recordsByKey[key] = record
+            self.distinctWarnings.append(record)
+        else:
+            self.reporter.handle_warning(warning)
+
+    def handle_suppressed(self, numWarnings):
+        self.numSuppressed += numWarnings
+
+    def close(self):
+        for record in self.distinctWarnings:
+            self.reporter.handle_warning(record)
+        self.distinctWarnings = []
+        self.recordsByKey = {}
+        self.reporter.close()
 
 class PrintingReporter(Reporter):
     """
@@ -74,9 +425,127 @@ class PrintingReporter(Reporter):
         self.numWarnings = 0
 
     def handle_warning(self, warning):
-        print >> self.outputFileObj, u'%s' % warning
+        print >> self.outputFileObj, format_warning(warning)
         self.numWarnings += 1
 
+class BufferedReporter(Reporter):
+    """
+    Base class for reporters which write machine-readable output to a file
+    object.  Warnings are only formatted when the buffer is flushed, and are
+    written in chunks of bufferSize warnings.
+    """
+    def __init__(self, outputFileObj, bufferSize=1000):
+        self.outputFileObj = outputFileObj
+        self.bufferSize = bufferSize
+        self.pendingWarnings = []
+        self.numWarnings = 0
+
+    def handle_warning(self, warning):
+        self.pendingWarnings.append(warning)
+        self.numWarnings += 1
+        if len(self.pendingWarnings) >= self.bufferSize:
+            self.flush()
+
+    def flush(self):
+        if self.pendingWarnings:
+            self.outputFileObj.write(self.format_warnings(self.pendingWarnings))
+            self.pendingWarnings = []
+        self.outputFileObj.flush()
+
+    def close(self):
+        self.flush()
+
+    def format_warnings(self, warnings):
+        "Format a list of warnings as a single string"
+        raise NotImplementedError
+
+def get_warning_data(warning):
+    "Get a dictionary describing a warning, for conversion to JSON"
+    data = {'check': warning.get_kind(),
+            'message': u'%s' % warning}
+    location = warning.get_location()
+    if location is not None:
+        data['file'], data['line'], data['column'] = location
+    sourceLine = warning.get_source_line()
+    if sourceLine is not None:
+        data['source'] = sourceLine
+    if warning.occurrences > 1:
+        data['occurrences'] = warning.occurrences
+    return data
+
+class JsonLinesReporter(BufferedReporter):
+    """
+    Reporting policy: write each warning as a JSON object on a line of its
+    own, with "check", "message" and (where known) "file", "line",
+    "column", "source" (the line of source) and "occurrences" fields
+    """
+    def format_warnings(self, warnings):
+        return ''.join(['%s\n' % json.dumps(get_warning_data(warning))
+                        for warning in warnings])
+
+class SarifReporter(BufferedReporter):
+    """
+    Reporting policy: write a SARIF 2.1.0 log.
+
+    The results are streamed out as they are flushed; the tool description
+    (which lists the rules, i.e. the kinds of warning, that were seen) comes
+    after them, when the reporter is closed.
+    """
+    def __init__(self, outputFileObj, bufferSize=1000):
+        BufferedReporter.__init__(self, outputFileObj, bufferSize)
+        self.ruleIds = []
+        self.startedResults = False
+
+    def format_warnings(self, warnings):
+        results = []
+        for warning in warnings:
+            kind = warning.get_kind()
+            if kind not in self.ruleIds:
+                self.ruleIds.append(kind)
+            result = {'ruleId': kind,
+                      'level': 'warning',
+                      'message': {'text': u'%s' % warning}}
+            if warning.occurrences > 1:
+                result['occurrenceCount'] = warning.occurrences
+            location = warning.get_location()
+            if location is not None:
+                filename, line, column = location
+                physicalLocation = {'region': {'startLine': line, 'startColumn': column}}
+                sourceLine = warning.get_source_line()
+                if sourceLine is not None:
+                    physicalLocation['contextRegion'] = {'startLine': line,
+                                                         'snippet': {'text': sourceLine}}
+                if filename is not None:
+                    physicalLocation['artifactLocation'] = {'uri': filename}
+                result['locations'] = [{'physicalLocation': physicalLocation}]
+            results.append(json.dumps(result))
+
+        if self.startedResults:
+            prefix = ',\n'
+        else:
+            prefix = self.get_header()
+            self.startedResults = True
+        return prefix + ',\n'.join(results)
+
+    def get_header(self):
+        return ('{"version": "2.1.0", '
+                '"$schema": "https://json.schemastore.org/sarif-2.1.0.json", '
+                '"runs": [{"results": [\n')
+
+    def close(self):
+        BufferedReporter.close(self)
+        if not self.startedResults:
+            self.outputFileObj.write(self.get_header())
+        tool = {'driver': {'name': 'docbook-lint',
+                           'rules': [{'id': ruleId} for ruleId in self.ruleIds]}}
+        self.outputFileObj.write('\n], "tool": %s}]}\n' % json.dumps(tool))
+        self.outputFileObj.flush()
+
+# The reporters for each output format, taking an output file object:
+outputFormats = {'text': lambda outputFileObj: PrintingReporter(outputFileObj, None),
+                 'jsonl': JsonLinesReporter,
+                 'sarif': SarifReporter}
+
 class StdoutReporter(PrintingReporter):
     """
     A reporter which handles errors/warnings by printing messages to stdout
@@ -96,38 +565,295 @@ class StderrReporter(PrintingReporter):
 #
 class DocBookLinter:
     def __init__(self, reporter, config):
-        from docbooklint.fedoranamingconventions import DocBookFedoraIdNamingConvention
-        from docbooklint.forbiddenwords import DocBookForbiddenWords
-        from docbooklint.linelengths import DocBookLineLengths
-        from docbooklint.spellcheck import DocBookSpellChecker
-
         self.reporter = reporter
         self.config = config
 
-        # Gather the tests that we're going to perform:
-        self.tests = []
+        # The files XIncluded by the most recently tested document, and the
+        # XIncludes that couldn't be followed:
+        self.includedFiles = []
+        self.includeProblems = []
+        # The IdIndex of the most recently tested document, if any of the
+        # tests use one (see docbooklint.idindex):
+        self.idIndex = None
 
-        self.tests.append(DocBookLineLengths(self.config.maxLineLength))
-        
-        if self.config.spellCheck:
-            self.tests.append(DocBookSpellChecker(self.config.defaultLangCode))
+        # Gather the tests that we're going to perform:
+        self.tests = [load_check(moduleName, className, self.config)
+                      for name, moduleName, className, flag in get_enabled_checks(self.config)]
 
-        self.tests.append(DocBookForbiddenWords(self.config.forbiddenWords))
+        self.profiler = None
+        if self.config.profile:
+            from docbooklint.profiling import Profiler
+            self.profiler = Profiler()
+        self.numDocsTested = 0
 
-        self.tests.append(DocBookFedoraIdNamingConvention())
+    def get_stats(self):
+        "Get a dictionary of named counters describing the work done so far"
+        stats = {}
+        for name, value in documentCache.get_stats().iteritems():
+            stats['document cache %s' % name] = value
+        for test in self.tests:
+            stats.update(test.get_stats())
+        if self.profiler is not None:
+            stats.update(self.profiler.get_stats(documentCache.parseTimes))
+        return stats
 
     def test_doc(self, xmlDoc):
+        self.numDocsTested += 1
+        self.idIndex = None
+        if self.config.prefetchThreads:
+            xmlDoc.prefetch_includes(self.config.prefetchThreads)
+
+        if self.config.profileDumpDir:
+            self.test_doc_under_cprofile(xmlDoc)
+        elif self.config.singlePass:
+            self.test_doc_single_pass(xmlDoc)
+        else:
+            self.test_doc_multi_pass(xmlDoc)
+
+        # (reported once, however many traversals there were)
+        for node, filename, problem in self.includeProblems:
+            self.reporter.handle_warning(includeProblemWarnings[problem](node, filename))
+
+    def test_doc_single_pass(self, xmlDoc):
+        "Run all of the tests within a single traversal of the document"
+        self.run_tests(self.tests, xmlDoc)
+
+    def test_doc_multi_pass(self, xmlDoc):
+        "Run each test with its own traversal of the document"
         for test in self.tests:
-            test.perform_test(self.reporter, xmlDoc)
+            self.run_tests([test], xmlDoc)
+
+    def test_doc_under_cprofile(self, xmlDoc):
+        "Run each test with its own traversal of the document, under cProfile"
+        from docbooklint.profiling import run_under_cprofile
+        if not os.path.isdir(self.config.profileDumpDir):
+            os.makedirs(self.config.profileDumpDir)
+        for test in self.tests:
+            dumpFilename = os.path.join(self.config.profileDumpDir,
+                                        '%s-%i-%i.prof' % (test.__class__.__name__,
+                                                           os.getpid(), self.numDocsTested))
+            run_under_cprofile(dumpFilename, self.run_tests, [test], xmlDoc)
+
+    def run_tests(self, tests, xmlDoc):
+        "Run the given tests within a single traversal of the document"
+        profiler = self.profiler
+        if profiler is None:
+            reporters = [self.reporter] * len(tests)
+        else:
+            reporters = [profiler.wrap_reporter(test, self.reporter) for test in tests]
+        visitors = [test.make_visitor(reporter) for test, reporter in zip(tests, reporters)]
+
+        if profiler is None:
+            traversalVisitors = list(visitors)
+        else:
+            traversalVisitors = [profiler.wrap_visitor(test, visitor)
+                                 for test, visitor in zip(tests, visitors)]
+
+        # One IdIndex for all of the tests that use it, built ahead of them
+        # within the traversal:
+        # (the listeners are the wrapped visitors, if profiling, so that the
+        # time spent handling IDs and links is charged to their tests)
+        idIndexer = None
+        for test, visitor, traversalVisitor in zip(tests, visitors, list(traversalVisitors)):
+            if test.usesIdIndex:
+                if idIndexer is None:
+                    from docbooklint.idindex import IdIndexer
+                    idIndexer = IdIndexer()
+                    traversalVisitors.insert(0, idIndexer)
+                visitor.idIndex = idIndexer.idIndex
+                idIndexer.add_listener(traversalVisitor)
+
+        multiVisitor = XmlMultiVisitor(traversalVisitors)
+        multiVisitor.visit_doc(xmlDoc)
+        self.includedFiles = multiVisitor.includedFiles
+        self.includeProblems = multiVisitor.includeProblems
+        if idIndexer is not None:
+            self.idIndex = idIndexer.idIndex
+
+        for test, reporter, visitor in zip(tests, reporters, visitors):
+            if profiler is None:
+                test.finish_test(reporter, visitor)
+            else:
+                profiler.finish_test(test, reporter, visitor)
 
 def check_file(filename, config):
     "Check the file, outputting to stderr.  Return the number of warnings"
     reporter=StderrReporter(filename)
-    xmlDoc = XmlFile(filename)
+    xmlDoc = load_file(filename, config.backend)
     linter = DocBookLinter(reporter, config=config)
     linter.test_doc(xmlDoc)
     return reporter.numWarnings
 
+def find_files(paths):
+    "Expand any directories within the list of paths into the XML files below them"
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirPath, dirNames, fileNames in os.walk(path):
+                dirNames.sort()
+                fileNames.sort()
+                for fileName in fileNames:
+                    if fileName.endswith('.xml'):
+                        filenames.append(os.path.join(dirPath, fileName))
+        else:
+            filenames.append(path)
+    return filenames
+
+#
+# Batch mode: the files are linted by a pool of worker processes, each of
+# which has a single long-lived linter (so that e.g. spelling dictionaries
+# are only loaded once per worker).  Warnings are sent back as
+# WarningRecords, and reported in the order of the input files.
+#
+workerLinter = None
+
+def init_worker(config):
+    global workerLinter
+    workerLinter = DocBookLinter(CollectingReporter(), config=config)
+
+def make_collecting_reporter(config):
+    """
+    Make a reporter to collect the warnings for one file, returning it along
+    with its CollectingReporter.  If the configuration limits or
+    deduplicates the warnings, they pass through a WarningFilter first, so
+    that warnings which would be dropped aren't accumulated.
+    """
+    collector = CollectingReporter()
+    if (config.maxWarnings is None and config.maxWarningsPerKind is None
+        and not config.deduplicateWarnings):
+        return collector, collector
+    return WarningFilter(collector, config.maxWarnings, config.maxWarningsPerKind,
+                         config.deduplicateWarnings), collector
+
+def lint_file_in_worker(filename):
+    """
+    Lint the file with this process's linter, returning the warnings as
+    WarningRecords, along with the process ID, its statistics so far, the
+    files that were XIncluded, those whose XIncludes couldn't be followed,
+    the document's IdIndex (as a dictionary), if any, and the number of
+    warnings that were suppressed
+    """
+    reporter, collector = make_collecting_reporter(workerLinter.config)
+    workerLinter.reporter = reporter
+    workerLinter.test_doc(load_file(filename, workerLinter.config.backend))
+    reporter.close()
+    idIndexData = None
+    if workerLinter.idIndex is not None:
+        idIndexData = workerLinter.idIndex.to_dict()
+    return ([WarningRecord.from_warning(warning) for warning in collector.warnings],
+            os.getpid(), workerLinter.get_stats(), workerLinter.includedFiles,
+            [problemFilename for node, problemFilename, problem in workerLinter.includeProblems],
+            idIndexData, getattr(reporter, 'numSuppressed', 0))
+
+def check_files(filenames, config, numJobs=1, reporter=None, stats=None,
+                idIndexes=None):
+    """
+    Check the files, using numJobs worker processes, outputting to stderr
+    (or to the given reporter).  Return the total number of warnings
+    (including any that the workers suppressed, as config.maxWarnings and
+    config.maxWarningsPerKind are applied within each worker too).
+
+    If a stats dictionary is supplied, the statistics of all of the workers
+    are added to it.  If an idIndexes dictionary is supplied, the IdIndex of
+    each file is stored in it, by filename.
+
+    If config.incrementalStateFile is set, files whose results in the state
+    file are still valid aren't checked again; their warnings (and IdIndex)
+    are replayed from the state file instead.
+    """
+    if reporter is None:
+        reporter = StderrReporter(None)
+
+    state = None
+    cachedWarnings = [None] * len(filenames)
+    if config.incrementalStateFile:
+        from docbooklint.incremental import IncrementalState
+        state = IncrementalState(config.incrementalStateFile, config)
+        cachedWarnings = [state.get_cached_warnings(filename) for filename in filenames]
+    staleFilenames = [filename
+                      for filename, warnings in zip(filenames, cachedWarnings)
+                      if warnings is None]
+    if state is not None:
+        state.take_signatures(staleFilenames)
+
+    # The latest statistics from each worker process:
+    workerStats = {}
+    numWarnings = 0
+
+    pool = None
+    if numJobs > 1 and len(staleFilenames) > 1:
+        import copy
+        import multiprocessing
+        # Each worker checks URLs independently, so each gets its share of
+        # the rate limit for any one host:
+        workerConfig = copy.copy(config)
+        workerConfig.ulinkRequestsPerSecond = config.ulinkRequestsPerSecond / float(numJobs)
+        pool = multiprocessing.Pool(processes=numJobs,
+                                    initializer=init_worker,
+                                    initargs=(workerConfig,))
+        results = pool.imap(lint_file_in_worker, staleFilenames)
+    else:
+        init_worker(config)
+        results = itertools.imap(lint_file_in_worker, staleFilenames)
+
+    try:
+        for filename, warnings in zip(filenames, cachedWarnings):
+            if warnings is None:
+                (warnings, pid, latestStats, includedFiles, unfollowedFiles,
+                 idIndexData, numSuppressed) = results.next()
+                workerStats[pid] = latestStats
+                if state is not None:
+                    state.record(filename, includedFiles + unfollowedFiles, warnings,
+                                 idIndexData, numSuppressed)
+            else:
+                numSuppressed = state.get_cached_num_suppressed(filename)
+                if idIndexes is not None:
+                    idIndexData = state.get_cached_index_data(filename)
+            if numSuppressed:
+                reporter.handle_suppressed(numSuppressed)
+                numWarnings += numSuppressed
+            if idIndexes is not None and idIndexData is not None:
+                from docbooklint.idindex import IdIndex
+                idIndexes[filename] = IdIndex.from_dict(idIndexData)
+            for warning in warnings:
+                reporter.handle_warning(warning)
+            numWarnings += len(warnings)
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    if state is not None:
+        state.save()
+
+    if stats is not None:
+        for latestStats in workerStats.itervalues():
+            for name, value in latestStats.iteritems():
+                stats[name] = stats.get(name, 0) + value
+        if state is not None:
+            stats['incremental files checked'] = len(staleFilenames)
+            stats['incremental files replayed'] = len(filenames) - len(staleFilenames)
+    return numWarnings
+
+def format_stats(stats):
+    """
+    Format a dictionary of statistics as lines of text, adding a hit rate
+    for each pair of "hits" and "misses" counters.  (Profiling statistics
+    are left to docbooklint.profiling.format_profile)
+    """
+    lines = []
+    names = [name for name in stats.keys()
+             if not name.startswith('profile ')]
+    names.sort()
+    for name in names:
+        lines.append('%s: %s' % (name, stats[name]))
+        if name.endswith(' hits'):
+            prefix = name[:-len(' hits')]
+            if stats.has_key('%s misses' % prefix):
+                total = stats[name] + stats['%s misses' % prefix]
+                if total:
+                    lines.append('%s hit rate: %.1f%%' % (prefix, 100.0 * stats[name] / total))
+    return lines
+
 #
 # Unit tests
 #
@@ -138,6 +864,347 @@ class SelfTest(unittest.TestCase):
     def lint_string(self, sourceStr, config=None):
         if not config:
             config = Configuration()
-        xmlDoc = XmlDoc.from_source(sourceStr)
+        xmlDoc = load_source(sourceStr, config.backend)
         linter = DocBookLinter(reporter=ExceptionReporter(), config=config)
         linter.test_doc(xmlDoc)
+
+    def assertWarns(self, warningClass, callableObj, *args):
+        "As assertRaises, for a warning raised by an ExceptionReporter"
+        try:
+            callableObj(*args)
+        except LintWarning, e:
+            if not isinstance(e.warning, warningClass):
+                raise
+        else:
+            self.fail('%s not reported' % warningClass.__name__)
+
+passCountExample="""<?xml version="1.0"?>
+<article>
+<title>Example with several kinds of problem</title>
+<section id="first"><para>Some text</para>
+<screen>
+The quick brown fox jumps over the lazy dog The quick brown fox jumps over the lazy dog
+</screen>
+</section>
+<section id="sn-second"><para>Some more text</para>
+<computeroutput>The quick brown fox jumps over the lazy dog The quick brown fox jumps over the lazy dog</computeroutput>
+</section>
+<section id="third"><para>Yet more text</para></section>
+</article>
+"""
+
+class TestSinglePass(SelfTest):
+    def collect_warnings(self, singlePass, backend='dom'):
+        config = Configuration()
+        config.spellCheck = False
+        config.singlePass = singlePass
+        config.backend = backend
+        reporter = CollectingReporter()
+        linter = DocBookLinter(reporter=reporter, config=config)
+        linter.test_doc(load_source(passCountExample, backend))
+        return [str(warning) for warning in reporter.warnings]
+
+    def test_single_pass_matches_multi_pass(self):
+        "Ensure that fusing the tests into one traversal doesn't change the warnings"
+        singlePassWarnings = self.collect_warnings(True)
+        multiPassWarnings = self.collect_warnings(False)
+        self.assertEquals(len(singlePassWarnings), 4)
+        singlePassWarnings.sort()
+        multiPassWarnings.sort()
+        self.assertEquals(singlePassWarnings, multiPassWarnings)
+
+class TestStreamingBackend(TestSinglePass):
+    def test_stream_matches_dom(self):
+        "Ensure that the streaming backend gives the same warnings as the DOM"
+        domWarnings = self.collect_warnings(True, 'dom')
+        self.assertEquals(self.collect_warnings(True, 'stream'), domWarnings)
+        multiPassWarnings = self.collect_warnings(False, 'stream')
+        multiPassWarnings.sort()
+        domWarnings.sort()
+        self.assertEquals(multiPassWarnings, domWarnings)
+
+    def test_stream_examples(self):
+        "Ensure that each test's example documents behave the same when streamed"
+        import docbooklint.fedoranamingconventions
+        import docbooklint.forbiddenwords
+        import docbooklint.linelengths
+        config = Configuration()
+        config.backend = 'stream'
+        config.forbiddenWords = ['ethereal']
+        self.assertWarns(docbooklint.linelengths.LineTooLong, self.lint_string,
+                          docbooklint.linelengths.screenTagWithUnreasonableLineLengths, config)
+        self.assertWarns(docbooklint.linelengths.InlineTextTooLong, self.lint_string,
+                          docbooklint.linelengths.computerTagWithTooMuchText, config)
+        self.assertWarns(docbooklint.forbiddenwords.ForbiddenWord, self.lint_string,
+                          docbooklint.forbiddenwords.badWordsExample, config)
+        self.assertWarns(docbooklint.fedoranamingconventions.IdDoesNotStartWithPrefix,
+                          self.lint_string,
+                          docbooklint.fedoranamingconventions.badSectionId, config)
+        self.lint_string(docbooklint.linelengths.okComputerTag, config)
+
+class TestBatchMode(unittest.TestCase):
+    def setUp(self):
+        self.dirName = tempfile.mkdtemp()
+        self.filenames = []
+        for i in range(4):
+            filename = os.path.join(self.dirName, 'doc%i.xml' % i)
+            f = open(filename, 'w')
+            f.write(passCountExample.replace('"first"', '"first%i"' % i))
+            f.close()
+            self.filenames.append(filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.dirName)
+
+    def check_files(self, paths, numJobs):
+        import StringIO
+        config = Configuration()
+        config.spellCheck = False
+        outputFileObj = StringIO.StringIO()
+        numWarnings = check_files(find_files(paths), config, numJobs=numJobs,
+                                  reporter=PrintingReporter(outputFileObj, None))
+        return numWarnings, outputFileObj.getvalue()
+
+    def test_find_files(self):
+        "Ensure that directories are expanded into the XML files within them"
+        self.assertEquals(find_files([self.dirName]), self.filenames)
+
+    def test_parallel_matches_serial(self):
+        "Ensure that a parallel run reports the same warnings, in the same order"
+        serialResult = self.check_files(self.filenames, 1)
+        self.assertEquals(serialResult[0], 16)
+        self.assert_(serialResult[1].find('"first3"') > serialResult[1].find('"first0"'))
+        self.assertEquals(self.check_files([self.dirName], 3), serialResult)
+
+    def test_any_reporter(self):
+        "Ensure that the warnings are counted whatever the reporter"
+        config = Configuration()
+        config.spellCheck = False
+        reporter = CollectingReporter()
+        self.assertEquals(check_files(self.filenames, config, reporter=reporter), 16)
+        self.assertEquals(len(reporter.warnings), 16)
+
+class TestLocations(SelfTest):
+    def test_warning_locations(self):
+        "Ensure that warnings are reported with the location of the problem"
+        for backend in ('dom', 'stream'):
+            config = Configuration()
+            config.spellCheck = False
+            config.backend = backend
+            reporter = CollectingReporter()
+            linter = DocBookLinter(reporter=reporter, config=config)
+            linter.test_doc(load_source(passCountExample, backend))
+            self.assertEquals([format_warning(warning).split(': ')[0]
+                               for warning in reporter.warnings],
+                              ['<string>:4:1', '<string>:5:1', '<string>:10:17',
+                               '<string>:12:1'])
+
+class TestMachineReadableReporters(unittest.TestCase):
+    def get_warnings(self):
+        config = Configuration()
+        config.spellCheck = False
+        reporter = CollectingReporter()
+        linter = DocBookLinter(reporter=reporter, config=config)
+        linter.test_doc(XmlDoc.from_source(passCountExample))
+        return reporter.warnings
+
+    def test_json_lines(self):
+        "Ensure that warnings are written as JSON objects, a chunk at a time"
+        import StringIO
+        outputFileObj = StringIO.StringIO()
+        reporter = JsonLinesReporter(outputFileObj, bufferSize=3)
+        for warning in self.get_warnings():
+            reporter.handle_warning(warning)
+        self.assertEquals(len(outputFileObj.getvalue().splitlines()), 3)
+        reporter.close()
+        lines = outputFileObj.getvalue().splitlines()
+        self.assertEquals(len(lines), 4)
+        data = json.loads(lines[0])
+        self.assertEquals(data['check'], 'IdDoesNotStartWithPrefix')
+        self.assertEquals((data['line'], data['column']), (4, 1))
+        self.assertEquals(data['source'], '<section id="first"><para>Some text</para>')
+
+    def test_sarif(self):
+        "Ensure that the SARIF log is valid JSON, however it is chunked"
+        import StringIO
+        for bufferSize in (1, 1000):
+            outputFileObj = StringIO.StringIO()
+            reporter = SarifReporter(outputFileObj, bufferSize=bufferSize)
+            for warning in self.get_warnings():
+                reporter.handle_warning(WarningRecord.from_warning(warning))
+            reporter.close()
+            run = json.loads(outputFileObj.getvalue())['runs'][0]
+            self.assertEquals(len(run['results']), 4)
+            self.assertEquals(run['results'][1]['ruleId'], 'LineTooLong')
+            self.assertEquals(run['results'][1]['locations'][0]['physicalLocation']['region'],
+                              {'startLine': 5, 'startColumn': 1})
+            self.assertEquals([rule['id'] for rule in run['tool']['driver']['rules']],
+                              ['IdDoesNotStartWithPrefix', 'LineTooLong', 'InlineTextTooLong'])
+
+    def test_empty_sarif(self):
+        "Ensure that a SARIF log with no warnings is still complete"
+        import StringIO
+        outputFileObj = StringIO.StringIO()
+        SarifReporter(outputFileObj).close()
+        self.assertEquals(json.loads(outputFileObj.getvalue())['runs'][0]['results'], [])
+
+class TestCheckRegistry(unittest.TestCase):
+    def get_class_names(self, config):
+        linter = DocBookLinter(reporter=CollectingReporter(), config=config)
+        return [test.__class__.__name__ for test in linter.tests]
+
+    def test_default(self):
+        "Ensure that the default checks are loaded, in the registry's order"
+        self.assertEquals(self.get_class_names(Configuration()),
+                          ['DocBookLineLengths', 'DocBookSpellChecker',
+                           'DocBookForbiddenWords', 'DocBookFedoraIdNamingConvention',
+                           'DocBookXrefs'])
+
+    def test_disabled(self):
+        "Ensure that checks can be disabled by name, or by their flag"
+        config = Configuration()
+        config.spellCheck = False
+        config.disabledChecks = ['fedora-ids']
+        self.assertEquals([name for name, moduleName, className, flag
+                           in get_enabled_checks(config)],
+                          ['line-lengths', 'forbidden-words', 'xrefs'])
+        self.assertEquals(self.get_class_names(config),
+                          ['DocBookLineLengths', 'DocBookForbiddenWords', 'DocBookXrefs'])
+
+class TestIncludes(unittest.TestCase):
+    def setUp(self):
+        self.dirName = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dirName)
+
+    def write_file(self, name, sourceStr):
+        filename = os.path.join(self.dirName, name)
+        f = open(filename, 'w')
+        f.write(sourceStr)
+        f.close()
+        return filename
+
+    def test_problems(self):
+        "Ensure that missing and cyclic XIncludes are reported, not followed"
+        mainFilename = self.write_file('main.xml', """<?xml version="1.0"?>
+<book xmlns:xi="http://www.w3.org/2001/XInclude">
+<xi:include href="missing.xml"/>
+<xi:include href="chapter.xml"/>
+</book>
+""")
+        self.write_file('chapter.xml', """<?xml version="1.0"?>
+<chapter id="ch-chapter" xmlns:xi="http://www.w3.org/2001/XInclude">
+<xi:include href="main.xml"/>
+</chapter>
+""")
+        for backend in ('dom', 'stream'):
+            for singlePass in (True, False):
+                config = Configuration()
+                config.spellCheck = False
+                config.backend = backend
+                config.singlePass = singlePass
+                reporter = CollectingReporter()
+                linter = DocBookLinter(reporter=reporter, config=config)
+                linter.test_doc(load_file(mainFilename, backend))
+                self.assertEquals([(warning.get_kind(), warning.get_location()[1:])
+                                   for warning in reporter.warnings],
+                                  [('MissingInclude', (3, 1)), ('IncludeCycle', (3, 1))])
+                self.assertEquals(linter.includedFiles,
+                                  [os.path.join(self.dirName, 'chapter.xml')])
+
+    def test_prefetch(self):
+        "Ensure that every included file is parsed before the traversal"
+        mainFilename = self.write_file('main.xml', """<?xml version="1.0"?>
+<book xmlns:xi="http://www.w3.org/2001/XInclude">
+<xi:include href="a.xml"/>
+<xi:include href="b.xml"/>
+</book>
+""")
+        self.write_file('a.xml', """<chapter xmlns:xi="http://www.w3.org/2001/XInclude"><xi:include href="c.xml"/></chapter>""")
+        self.write_file('b.xml', """<chapter><para>B</para></chapter>""")
+        self.write_file('c.xml', """<section><para>C</para></section>""")
+        xmlDoc = XmlFile(mainFilename)
+        xmlDoc.prefetch_includes(2)
+        for name in ('a.xml', 'b.xml', 'c.xml'):
+            self.assert_(documentCache.entries.has_key(os.path.join(self.dirName, name)))
+
+    def test_deep_document(self):
+        "Ensure that documents nested more deeply than the recursion limit can be checked"
+        depth = 2 * sys.getrecursionlimit()
+        deepFilename = self.write_file('deep.xml', '<article>%s<screen>%s</screen>%s</article>'
+                                       % ('<section>' * depth, 'x' * 100, '</section>' * depth))
+        mainFilename = self.write_file('main.xml', """<?xml version="1.0"?>
+<book xmlns:xi="http://www.w3.org/2001/XInclude"><xi:include href="deep.xml"/></book>
+""")
+        import StringIO
+        config = Configuration()
+        config.spellCheck = False
+        outputFileObj = StringIO.StringIO()
+        numWarnings = check_files([mainFilename, deepFilename], config,
+                                  reporter=PrintingReporter(outputFileObj, None))
+        self.assertEquals(numWarnings, 2)
+        self.assertEquals(outputFileObj.getvalue().count('Line too long'), 2)
+
+class TestWarningFilter(unittest.TestCase):
+    def make_warnings(self, kindsAndMessages):
+        return [WarningRecord(kind, message, None) for kind, message in kindsAndMessages]
+
+    def test_limits(self):
+        "Ensure that warnings beyond the limits are dropped, but counted"
+        reporter = CollectingReporter()
+        warningFilter = WarningFilter(reporter, maxWarnings=3, maxWarningsPerKind=2)
+        for warning in self.make_warnings([('A', '1'), ('A', '2'), ('A', '3'),
+                                           ('B', '4'), ('B', '5'), ('B', '6')]):
+            warningFilter.handle_warning(warning)
+        warningFilter.close()
+        self.assertEquals([u'%s' % warning for warning in reporter.warnings], ['1', '2', '4'])
+        self.assertEquals(warningFilter.numSuppressed, 3)
+
+    def test_limits_in_workers(self):
+        "Ensure that the limits are applied within the workers too"
+        filename = os.path.join(tempfile.mkdtemp(), 'doc.xml')
+        try:
+            f = open(filename, 'w')
+            f.write(passCountExample)
+            f.close()
+            config = Configuration()
+            config.spellCheck = False
+            config.maxWarningsPerKind = 1
+            init_worker(config)
+            warnings, numSuppressed = [lint_file_in_worker(filename)[i] for i in (0, 6)]
+            self.assertEquals([warning.get_kind() for warning in warnings],
+                              ['IdDoesNotStartWithPrefix', 'LineTooLong', 'InlineTextTooLong'])
+            self.assertEquals(numSuppressed, 1)
+
+            reporter = WarningFilter(CollectingReporter(), maxWarningsPerKind=1)
+            self.assertEquals(check_files([filename], config, reporter=reporter), 4)
+            self.assertEquals(reporter.numSuppressed, 1)
+        finally:
+            shutil.rmtree(os.path.dirname(filename))
+
+    def test_deduplicate(self):
+        "Ensure that repeated warnings are reported once, with a count"
+        reporter = CollectingReporter()
+        warningFilter = WarningFilter(reporter, deduplicate=True)
+        for warning in self.make_warnings([('A', '1'), ('B', '1'), ('A', '1'), ('A', '1')]):
+            warningFilter.handle_warning(warning)
+        warningFilter.close()
+        self.assertEquals([format_warning(warning) for warning in reporter.warnings],
+                          ['1 (3 occurrences)', '1'])
+
+    def test_released_nodes(self):
+        "Ensure that warnings don't keep their documents alive"
+        import gc
+        import weakref
+        config = Configuration()
+        config.spellCheck = False
+        reporter = CollectingReporter()
+        linter = DocBookLinter(reporter=reporter, config=config)
+        xmlDoc = XmlDoc.from_source(passCountExample)
+        linter.test_doc(xmlDoc)
+        domRef = weakref.ref(xmlDoc.dom)
+        del xmlDoc
+        gc.collect()
+        self.assertEquals(domRef(), None)
+        self.assertEquals(len(reporter.warnings), 4)
@@ -0,0 +1,218 @@
+# Copyright (c) 2008 Red Hat, Inc. All rights reserved. This copyrighted material
+# is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Author: David Malcolm
+
+import time
+import unittest
+
+#
+# Measuring where the time goes within a run of the linter.
+#
+# When profiling is enabled, the linter wraps each test's visitor and
+# reporter, so that the time spent within each test (including its
+# finish_test), the nodes and text that it was given and the warnings that
+# it reported are all recorded.  When it is disabled, nothing is wrapped.
+#
+# The results are published as statistics named "profile check <TEST>
+# <FIELD>" and "profile parse <FILENAME>", so that they can be merged
+# between worker processes like any other statistics.
+#
+
+class TestProfile:
+    "The work done by one test"
+    def __init__(self, name):
+        self.name = name
+        self.wallTime = 0.0
+        self.cpuTime = 0.0
+        self.numNodes = 0
+        self.textChars = 0
+        self.numWarnings = 0
+
+    def call(self, fn, *args):
+        "Call the function, charging the time taken to this test"
+        startWall = time.time()
+        startCpu = time.clock()
+        try:
+            return fn(*args)
+        finally:
+            self.wallTime += time.time() - startWall
+            self.cpuTime += time.clock() - startCpu
+
+class ProfilingVisitor:
+    "Wraps a test's visitor, timing it and counting the nodes that it visits"
+    def __init__(self, visitor, profile):
+        self.visitor = visitor
+        self.profile = profile
+
+    def visit_element(self, node):
+        self.profile.numNodes += 1
+        self.profile.call(self.visitor.visit_element, node)
+
+    def visit_textual(self, node):
+        self.profile.numNodes += 1
+        self.profile.textChars += len(node.data)
+        self.profile.call(self.visitor.visit_textual, node)
+
+    def leave_element(self, node):
+        self.profile.call(self.visitor.leave_element, node)
+
+    def visit_include(self, node, filename):
+        self.profile.call(self.visitor.visit_include, node, filename)
+
+    # (for the visitors of tests that use the IdIndex; see docbooklint.idindex)
+    def handle_id(self, node, id, chapterId, isNew):
+        self.profile.call(self.visitor.handle_id, node, id, chapterId, isNew)
+
+    def handle_link(self, node, linkend):
+        self.profile.call(self.visitor.handle_link, node, linkend)
+
+class ProfilingReporter:
+    "Wraps the linter's reporter, counting the warnings from one test"
+    def __init__(self, reporter, profile):
+        self.reporter = reporter
+        self.profile = profile
+
+    def handle_warning(self, warning):
+        self.profile.numWarnings += 1
+        self.reporter.handle_warning(warning)
+
+    def handle_suppressed(self, numWarnings):
+        self.reporter.handle_suppressed(numWarnings)
+
+class Profiler:
+    def __init__(self):
+        # Map from test class name to TestProfile:
+        self.profiles = {}
+
+    def get_profile(self, test):
+        name = test.__class__.__name__
+        profile = self.profiles.get(name)
+        if profile is None:
+            profile = self.profiles[name] = TestProfile(name)
+        return profile
+
+    def wrap_reporter(self, test, reporter):
+        return ProfilingReporter(reporter, self.get_profile(test))
+
+    def wrap_visitor(self, test, visitor):
+        return ProfilingVisitor(visitor, self.get_profile(test))
+
+    def finish_test(self, test, reporter, visitor):
+        self.get_profile(test).call(test.finish_test, reporter, visitor)
+
+    def get_stats(self, parseTimes):
+        "Get the results as statistics, given a map from filename to parse time"
+        stats = {}
+        for profile in self.profiles.itervalues():
+            prefix = 'profile check %s' % profile.name
+            stats['%s wall time' % prefix] = profile.wallTime
+            stats['%s cpu time' % prefix] = profile.cpuTime
+            stats['%s nodes' % prefix] = profile.numNodes
+            stats['%s text chars' % prefix] = profile.textChars
+            stats['%s warnings' % prefix] = profile.numWarnings
+        for filename, parseTime in parseTimes.iteritems():
+            stats['profile parse %s' % filename] = parseTime
+        return stats
+
+def run_under_cprofile(dumpFilename, fn, *args):
+    "Call the function under cProfile, writing the profile to the file"
+    import cProfile
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(fn, *args)
+    finally:
+        profile.dump_stats(dumpFilename)
+
+def format_profile(stats):
+    "Format the profiling statistics as a table, as lines of text"
+    fields = ['wall time', 'cpu time', 'nodes', 'text chars', 'warnings']
+    checks = {}
+    parseTimes = []
+    for name, value in stats.iteritems():
+        if name.startswith('profile check '):
+            testName, field = name[len('profile check '):].split(' ', 1)
+            checks.setdefault(testName, {})[field] = value
+        elif name.startswith('profile parse '):
+            parseTimes.append((value, name[len('profile parse '):]))
+
+    lines = ['%-32s %9s %9s %9s %11s %9s' % ('check', 'wall (s)', 'cpu (s)',
+                                              'nodes', 'text chars', 'warnings')]
+    testNames = checks.keys()
+    testNames.sort()
+    for testName in testNames:
+        values = [checks[testName].get(field, 0) for field in fields]
+        lines.append('%-32s %9.3f %9.3f %9i %11i %9i' % tuple([testName] + values))
+
+    if parseTimes:
+        parseTimes.sort()
+        parseTimes.reverse()
+        lines.append('')
+        lines.append('parse time per file (total %.3fs):' % sum([t for t, f in parseTimes]))
+        for parseTime, filename in parseTimes:
+            lines.append('%9.3f  %s' % (parseTime, filename))
+    return lines
+
+#
+# Unit tests
+#
+
+class TestProfiling(unittest.TestCase):
+    def run_linter(self, config):
+        from docbooklint.linter import CollectingReporter, DocBookLinter, passCountExample
+        from docbooklint.xmlutils import XmlDoc
+        config.spellCheck = False
+        config.profile = True
+        reporter = CollectingReporter()
+        linter = DocBookLinter(reporter=reporter, config=config)
+        linter.test_doc(XmlDoc.from_source(passCountExample))
+        return reporter, linter.get_stats()
+
+    def test_counts(self):
+        "Ensure that nodes and warnings are attributed to each test"
+        from docbooklint.linter import Configuration
+        for singlePass in (True, False):
+            config = Configuration()
+            config.singlePass = singlePass
+            reporter, stats = self.run_linter(config)
+            self.assertEquals(len(reporter.warnings), 4)
+            self.assertEquals(stats['profile check DocBookLineLengths warnings'], 2)
+            self.assertEquals(stats['profile check DocBookFedoraIdNamingConvention warnings'], 2)
+            self.assertEquals(stats['profile check DocBookLineLengths nodes'],
+                              stats['profile check DocBookForbiddenWords nodes'])
+            self.assert_(stats['profile check DocBookLineLengths text chars'] > 0)
+
+    def test_id_checks(self):
+        "Ensure that the time spent handling IDs and links is charged to the ID checks"
+        from docbooklint.linter import Configuration
+        calls = []
+        originalCall = TestProfile.call
+        def recording_call(profile, fn, *args):
+            calls.append((profile.name, fn.__name__))
+            return originalCall(profile, fn, *args)
+        TestProfile.call = recording_call
+        try:
+            self.run_linter(Configuration())
+        finally:
+            TestProfile.call = originalCall
+        self.assert_(('DocBookFedoraIdNamingConvention', 'handle_id') in calls)
+        self.assert_(('DocBookXrefs', 'handle_id') in calls)
+
+    def test_table(self):
+        "Ensure that the statistics are formatted as a table, one check per row"
+        from docbooklint.linter import Configuration
+        reporter, stats = self.run_linter(Configuration())
+        lines = format_profile(stats)
+        self.assert_(lines[0].startswith('check'))
+        self.assert_(lines[1].startswith('DocBookFedoraIdNamingConvention'))
+        self.assert_(lines[3].startswith('DocBookLineLengths'))
@@ -0,0 +1,362 @@
+# Copyright (c) 2008 Red Hat, Inc. All rights reserved. This copyrighted material
+# is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Author: David Malcolm
+from docbooklint.linter import *
+from docbooklint.xmlutils import *
+
+import codecs
+import ConfigParser
+import re
+import StringIO
+
+#
+# Declarative rules, loaded from INI-style files, for simple checks that
+# would otherwise each need their own DocBookTest.  Each section of a rule
+# file is a rule, named by the section, which is reported (with its
+# message) wherever all of its conditions hold:
+#
+#   element = NAME...          the element(s) that the rule applies to ("*" for
+#                              any); required
+#   parent = NAME...           the element's parent is one of these
+#   inside = NAME...           the element is within one of these
+#   not-inside = NAME...       the element isn't within any of these
+#   has-attribute = NAME       the element has the attribute
+#   lacks-attribute = NAME     the element doesn't have the attribute
+#   attribute = NAME           the element has the attribute, and its value...
+#   value-matches = REGEX        ...matches the regular expression
+#   value-not-matches = REGEX    ...or doesn't match it
+#   text-matches = REGEX       a run of text directly within the element matches
+#                              the regular expression (the rule is then
+#                              reported at the text; for "inside" and
+#                              "not-inside", the text is within the element)
+#   message = TEXT             what to report; required
+#
+# Every rule from every file is compiled into one RuleTable, which maps each
+# element name to the rules that apply to it, so that all of the rules are
+# run within the linter's single traversal, and each node only costs a
+# dictionary lookup plus the rules that could apply to it.
+#
+
+class RuleFileError(Exception):
+    pass
+
+class RuleViolation(DocBookError):
+    __slots__ = ('ruleName', 'ruleMessage')
+
+    def __init__(self, node, rule):
+        DocBookError.__init__(self, node)
+        self.ruleName = rule.name
+        self.ruleMessage = rule.message
+
+    def __str__(self):
+        if self.context is None:
+            return 'Node <%s>: %s'%(self.nodeName, self.ruleMessage)
+        return '%s %s'%(self.ruleMessage, self.get_context_str())
+
+    def get_kind(self):
+        # (so that each rule counts as its own kind of problem)
+        return self.ruleName
+
+class Rule:
+    def __init__(self, name, message):
+        self.name = name
+        self.message = message
+        # None for "any element":
+        self.elementNames = None
+        self.parentNames = None
+        self.insideNames = None
+        self.notInsideNames = None
+        self.hasAttribute = None
+        self.lacksAttribute = None
+        self.attribute = None
+        self.valuePattern = None
+        self.valueMustMatch = True
+        self.textPattern = None
+
+    def matches_element(self, node, enclosingCounts):
+        """
+        Do the conditions (other than text-matches) hold for the element,
+        given the number of open elements with each name in
+        RuleTable.trackedNames?
+        """
+        if self.parentNames is not None:
+            parent = node.parentNode
+            if parent is None or not is_element(parent) or parent.localName not in self.parentNames:
+                return False
+        if self.insideNames is not None:
+            for name in self.insideNames:
+                if enclosingCounts.get(name):
+                    break
+            else:
+                return False
+        if self.notInsideNames is not None:
+            for name in self.notInsideNames:
+                if enclosingCounts.get(name):
+                    return False
+        if self.hasAttribute is not None and not node.hasAttribute(self.hasAttribute):
+            return False
+        if self.lacksAttribute is not None and node.hasAttribute(self.lacksAttribute):
+            return False
+        if self.attribute is not None:
+            if not node.hasAttribute(self.attribute):
+                return False
+            if self.valuePattern is not None:
+                matched = self.valuePattern.search(node.getAttribute(self.attribute)) is not None
+                if matched != self.valueMustMatch:
+                    return False
+        return True
+
+def compile_pattern(ruleName, pattern):
+    try:
+        return re.compile(pattern, re.UNICODE)
+    except re.error, e:
+        raise RuleFileError('rule "%s": bad regular expression "%s": %s' % (ruleName, pattern, e))
+
+def get_names(value):
+    names = frozenset(value.split())
+    if '*' in names:
+        return None
+    return names
+
+ruleOptions = frozenset(['element', 'parent', 'inside', 'not-inside', 'has-attribute',
+                         'lacks-attribute', 'attribute', 'value-matches',
+                         'value-not-matches', 'text-matches', 'message'])
+
+def parse_rules(fileObj, filename='<string>'):
+    "Parse a rule file (an open file object, as unicode), returning a list of Rules"
+    parser = ConfigParser.RawConfigParser()
+    try:
+        parser.readfp(fileObj, filename)
+    except ConfigParser.Error, e:
+        raise RuleFileError('%s: %s' % (filename, e))
+
+    rules = []
+    for name in parser.sections():
+        options = dict(parser.items(name))
+        for option in options:
+            if option not in ruleOptions:
+                raise RuleFileError('%s: rule "%s": unknown condition "%s"' % (filename, name, option))
+        for option in ('element', 'message'):
+            if not options.get(option):
+                raise RuleFileError('%s: rule "%s" has no %s' % (filename, name, option))
+        rule = Rule(name, options['message'])
+        rule.elementNames = get_names(options['element'])
+        if options.has_key('parent'):
+            rule.parentNames = frozenset(options['parent'].split())
+        if options.has_key('inside'):
+            rule.insideNames = frozenset(options['inside'].split())
+        if options.has_key('not-inside'):
+            rule.notInsideNames = frozenset(options['not-inside'].split())
+        rule.hasAttribute = options.get('has-attribute')
+        rule.lacksAttribute = options.get('lacks-attribute')
+        rule.attribute = options.get('attribute')
+        if options.has_key('value-matches') or options.has_key('value-not-matches'):
+            if rule.attribute is None:
+                raise RuleFileError('%s: rule "%s" tests a value, but has no attribute' % (filename, name))
+            if options.has_key('value-matches'):
+                rule.valuePattern = compile_pattern(name, options['value-matches'])
+            else:
+                rule.valuePattern = compile_pattern(name, options['value-not-matches'])
+                rule.valueMustMatch = False
+        if options.has_key('text-matches'):
+            rule.textPattern = compile_pattern(name, options['text-matches'])
+        rules.append(rule)
+    return rules
+
+def load_rules(filenames):
+    "Load the rules from each of the files (encoded as UTF-8)"
+    rules = []
+    for filename in filenames:
+        try:
+            f = codecs.open(filename, 'r', 'utf-8')
+        except IOError, e:
+            raise RuleFileError('%s: %s' % (filename, e.strerror))
+        try:
+            rules += parse_rules(f, filename)
+        finally:
+            f.close()
+    return rules
+
+class RuleTable:
+    """
+    Rules compiled into dispatch tables: maps from element name to the rules
+    that apply to that element (elementRules) and to the text directly
+    within it (textRules).  Rules for any element are included within every
+    entry, and are also all that there is for names without an entry.
+    """
+    def __init__(self, rules):
+        self.rules = rules
+        self.elementRules = self.make_table([rule for rule in rules if rule.textPattern is None])
+        self.textRules = self.make_table([rule for rule in rules if rule.textPattern is not None])
+        # The names whose enclosing elements must be counted, for "inside" and
+        # "not-inside":
+        self.trackedNames = set()
+        for rule in rules:
+            self.trackedNames.update(rule.insideNames or ())
+            self.trackedNames.update(rule.notInsideNames or ())
+
+    def make_table(self, rules):
+        anyElementRules = tuple([rule for rule in rules if rule.elementNames is None])
+        table = {}
+        for rule in rules:
+            for name in rule.elementNames or ():
+                table.setdefault(name, [])
+        for name in table:
+            # (keeping the rules in the order of the file)
+            table[name] = tuple([rule for rule in rules
+                                 if rule.elementNames is None or name in rule.elementNames])
+        return DispatchTable(table, anyElementRules)
+
+class DispatchTable(dict):
+    "A dictionary whose missing entries are a default"
+    def __init__(self, table, default):
+        dict.__init__(self, table)
+        self.default = default
+
+    def __missing__(self, name):
+        return self.default
+
+class DocBookRules(DocBookTest):
+    def __init__(self, rules):
+        self.table = RuleTable(rules)
+
+    @classmethod
+    def from_config(cls, config):
+        return DocBookRules(load_rules(config.ruleFiles))
+
+    def make_visitor(self, reporter):
+        return DocBookRules.Visitor(self.table, reporter)
+
+    class Visitor(XmlVisitor):
+        def __init__(self, table, reporter):
+            self.table = table
+            self.reporter = reporter
+            # The number of open elements with each of the tracked names:
+            self.enclosingCounts = {}
+
+        def visit_element(self, node):
+            name = node.localName
+            for rule in self.table.elementRules[name]:
+                if rule.matches_element(node, self.enclosingCounts):
+                    self.reporter.handle_warning(RuleViolation(node, rule))
+            if name in self.table.trackedNames:
+                self.enclosingCounts[name] = self.enclosingCounts.get(name, 0) + 1
+
+        def leave_element(self, node):
+            name = node.localName
+            if name in self.table.trackedNames:
+                self.enclosingCounts[name] -= 1
+
+        def visit_textual(self, node):
+            parent = node.parentNode
+            if parent is None or not is_element(parent):
+                return
+            for rule in self.table.textRules[parent.localName]:
+                if (rule.textPattern.search(node.data)
+                    and rule.matches_element(parent, self.enclosingCounts)):
+                    self.reporter.handle_warning(RuleViolation(node, rule))
+
+#
+# Unit tests
+#
+
+exampleRules = u"""
+[keycap-brackets]
+element = keycap
+text-matches = ^\\s*\\[.*\\]\\s*$
+message = Don't put brackets around the text of a <keycap>
+
+[trademark-entity]
+element = *
+text-matches = [\u2122\u00ae]
+not-inside = trademark
+message = Use <trademark> rather than a trademark symbol
+
+[listitem-text]
+element = listitem
+text-matches = \\S
+message = Text within a <listitem> should be within a <para>
+
+[section-id]
+element = chapter section
+lacks-attribute = id
+message = Missing id
+
+[image-format]
+element = imagedata
+attribute = format
+value-not-matches = ^(EPS|PNG)$
+message = Image format isn't EPS or PNG
+
+[nested-command]
+element = command
+inside = screen
+parent = para
+message = <command> within a <para> within a <screen>
+"""
+
+rulesExample = u"""<?xml version="1.0"?>
+<article>
+<section id="sn-first">
+<para>Press <keycap>[Enter]</keycap>, not <keycap>Enter</keycap>, to run Fedora\u2122
+or <trademark>Fedora\u2122</trademark></para>
+<itemizedlist><listitem>Some text<para>More text</para></listitem></itemizedlist>
+<mediaobject><imageobject><imagedata format="GIF"/></imageobject>
+<imageobject><imagedata format="PNG"/></imageobject></mediaobject>
+</section>
+<section><screen><para><command>ls</command></para><command>ls</command></screen></section>
+</article>
+""".encode('utf-8')
+
+class TestRules(unittest.TestCase):
+    def collect_warnings(self, backend):
+        config = Configuration()
+        config.spellCheck = False
+        config.disabledChecks = ['fedora-ids']
+        reporter = CollectingReporter()
+        linter = DocBookLinter(reporter=reporter, config=config)
+        linter.tests.append(DocBookRules(parse_rules(StringIO.StringIO(exampleRules))))
+        linter.test_doc(load_source(rulesExample, backend))
+        return [(warning.get_kind(), warning.get_location()[1]) for warning in reporter.warnings
+                if isinstance(warning, RuleViolation)]
+
+    def test_rules(self):
+        "Ensure that each rule is reported wherever its conditions hold"
+        for backend in ('dom', 'stream'):
+            self.assertEquals(self.collect_warnings(backend),
+                              [('keycap-brackets', 4),
+                               ('trademark-entity', 4),
+                               ('listitem-text', 6),
+                               ('image-format', 7),
+                               ('section-id', 10),
+                               ('nested-command', 10)])
+
+    def test_table(self):
+        "Ensure that rules for any element are dispatched along with the named ones"
+        table = RuleTable(parse_rules(StringIO.StringIO(exampleRules)))
+        self.assertEquals([rule.name for rule in table.textRules['keycap']],
+                          ['keycap-brackets', 'trademark-entity'])
+        self.assertEquals([rule.name for rule in table.textRules['para']],
+                          ['trademark-entity'])
+        self.assertEquals(table.elementRules['para'], ())
+        self.assertEquals(table.trackedNames, set(['trademark', 'screen']))
+
+    def test_errors(self):
+        "Ensure that mistakes in rule files are reported"
+        for ruleStr in (u'[a]\nelement = para\n',
+                        u'[a]\nelement = para\nmessage = m\ncolour = red\n',
+                        u'[a]\nelement = para\nmessage = m\ntext-matches = (\n',
+                        u'[a]\nelement = para\nmessage = m\nvalue-matches = x\n',
+                        u'element = para\n'):
+            self.assertRaises(RuleFileError, parse_rules, StringIO.StringIO(ruleStr))
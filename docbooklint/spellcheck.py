@@ -15,11 +15,21 @@
 
 from docbooklint.linter import *
 from docbooklint.xmlutils import *
+from docbooklint.tokenizer import iter_words, is_number
 
-import enchant
-import re
+import os
+import os.path
+import hashlib
+import itertools
+import shutil
+import tempfile
+import threading
+import unittest
+from array import array
 
 class SpellcheckerError(DocBookError):
+    __slots__ = ('langCode', 'word')
+
     def __init__(self, node, langCode, word):
         DocBookError.__init__(self, node)
         self.langCode = langCode
@@ -28,84 +38,362 @@ class SpellcheckerError(DocBookError):
     def __str__(self):
         return u'Possibly mispelled word for "%s": "%s" %s'%(self.langCode, self.word, self.get_context_str())
 
+def get_dictionary_fingerprint(langCode, enchantDict, personalWordList=None):
+    """
+    Get a string identifying the spelling dictionary (and personal word
+    list) in use, so that cached verdicts can be discarded when they change
+    """
+    import enchant
+    fingerprint = hashlib.md5()
+    fingerprint.update(langCode)
+    fingerprint.update(getattr(enchant, '__version__', ''))
+    provider = getattr(enchantDict, 'provider', None)
+    if provider is not None:
+        fingerprint.update(provider.name)
+        fingerprint.update(provider.file)
+        if os.path.exists(provider.file):
+            stat = os.stat(provider.file)
+            fingerprint.update('%r %r' % (stat.st_mtime, stat.st_size))
+    if personalWordList:
+        f = open(personalWordList, 'rb')
+        try:
+            fingerprint.update(f.read())
+        finally:
+            f.close()
+    return fingerprint.hexdigest()
+
+class VerdictCache:
+    """
+    Cache of spellchecking verdicts for one language, so that each distinct
+    word only needs to be looked up in the enchant dictionary once.
+
+    If a cache directory is given, the verdicts are also stored in an sqlite
+    file there (named by the language and the dictionary fingerprint), which
+    is read in full when the cache is created, so that later runs can skip
+    almost all of their lookups.
+
+    If makeDict is given, it is used to create an extra enchant dictionary
+    for each thread when checking a large batch of words with several
+    threads.
+    """
+    # The smallest number of words for which extra threads are used:
+    minWordsPerThread = 500
+
+    def __init__(self, langCode, enchantDict, cacheDir=None, fingerprint=None,
+                 makeDict=None):
+        self.langCode = langCode
+        self.enchantDict = enchantDict
+        self.makeDict = makeDict
+        self.verdicts = {}
+        self.diskVerdicts = {}
+        self.newVerdicts = []
+        self.hits = 0
+        self.diskHits = 0
+        self.misses = 0
+
+        self.connection = None
+        if cacheDir:
+            self.open_disk_cache(cacheDir, fingerprint)
+
+    def open_disk_cache(self, cacheDir, fingerprint):
+        import sqlite3
+        if not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir)
+        filename = os.path.join(cacheDir, 'spelling-%s-%s.sqlite' % (self.langCode, fingerprint))
+        self.connection = sqlite3.connect(filename, timeout=60)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS verdicts '
+                                '(word TEXT PRIMARY KEY, ok INTEGER)')
+        for word, ok in self.connection.execute('SELECT word, ok FROM verdicts'):
+            self.diskVerdicts[word] = bool(ok)
+
+    def lookup(self, word):
+        "Get the cached verdict for the word, or None if it isn't known yet"
+        verdict = self.verdicts.get(word)
+        if verdict is not None:
+            self.hits += 1
+            return verdict
+
+        verdict = self.diskVerdicts.get(word)
+        if verdict is not None:
+            self.hits += 1
+            self.diskHits += 1
+            self.verdicts[word] = verdict
+        return verdict
+
+    def add_allowed_word(self, word):
+        "Accept the word for the rest of this run (but don't store it on disk)"
+        self.verdicts[word] = True
+
+    def add_verdict(self, word, verdict):
+        self.misses += 1
+        self.verdicts[word] = verdict
+        if self.connection is not None:
+            self.newVerdicts.append((word, int(verdict)))
+
+    def check(self, word):
+        "Is the word correctly spelled?"
+        verdict = self.lookup(word)
+        if verdict is None:
+            verdict = bool(self.enchantDict.check(word))
+            self.add_verdict(word, verdict)
+        return verdict
+
+    def check_words(self, words, numThreads=1):
+        """
+        Look up a batch of distinct words that aren't yet known, optionally
+        sharing them between several threads
+        """
+        numThreads = min(numThreads, len(words) / self.minWordsPerThread)
+        if numThreads <= 1 or self.makeDict is None:
+            for word in words:
+                self.add_verdict(word, bool(self.enchantDict.check(word)))
+            return
+
+        # enchant dictionaries can't safely be shared between threads, so
+        # each thread gets its own:
+        chunks = [words[i::numThreads] for i in range(numThreads)]
+        results = [None] * numThreads
+        def check_chunk(index):
+            enchantDict = self.makeDict()
+            results[index] = [bool(enchantDict.check(word)) for word in chunks[index]]
+        threads = [threading.Thread(target=check_chunk, args=(i,))
+                   for i in range(numThreads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for chunk, verdicts in zip(chunks, results):
+            for word, verdict in zip(chunk, verdicts):
+                self.add_verdict(word, verdict)
+
+    def flush(self):
+        "Write any new verdicts to the disk cache"
+        if self.connection is not None and self.newVerdicts:
+            self.connection.executemany('INSERT OR REPLACE INTO verdicts VALUES (?, ?)',
+                                        self.newVerdicts)
+            self.connection.commit()
+            self.newVerdicts = []
+
+    def get_stats(self):
+        prefix = 'spellcheck %s' % self.langCode
+        return {'%s hits' % prefix: self.hits,
+                '%s disk hits' % prefix: self.diskHits,
+                '%s misses' % prefix: self.misses}
+
 class DocBookSpellChecker(DocBookTest):
-    def __init__(self, defaultLangCode):
+    def __init__(self, defaultLangCode, personalWordList=None, cacheDir=None,
+                 numThreads=1, noSpellcheckElements=(), allowLists=(),
+                 maxMisspellings=None):
         self.defaultLangCode = defaultLangCode
+        # The most misspellings that could be reported for each document
+        # (given the limits on warnings), or None for no limit:
+        self.maxMisspellings = maxMisspellings
+        self.noSpellcheckElements = noSpellcheckElements
+        self.personalWordList = personalWordList
+        self.cacheDir = cacheDir
+        self.numThreads = numThreads
 
-    def perform_test(self, reporter, doc):
-        visitor = DocBookSpellChecker.Visitor(self.defaultLangCode)
-        visitor.visit_doc(doc)
+        # Words to accept in any language, without asking enchant (see
+        # docbooklint.wordlist), loaded once and shared by every document:
+        self.allowList = None
+        if allowLists:
+            from docbooklint.wordlist import AllowList
+            self.allowList = AllowList(allowLists)
 
+        # The verdict caches (and hence the enchant dictionaries), shared by
+        # every document that we check:
+        self.verdictCaches = {}
+
+    @classmethod
+    def from_config(cls, config):
+        limits = [limit for limit in (config.maxWarnings, config.maxWarningsPerKind)
+                  if limit is not None]
+        maxMisspellings = None
+        if limits:
+            maxMisspellings = min(limits)
+        return DocBookSpellChecker(config.defaultLangCode,
+                                   config.personalWordList,
+                                   config.spellingCacheDir,
+                                   config.spellcheckThreads,
+                                   config.noSpellcheckElements,
+                                   config.allowLists,
+                                   maxMisspellings)
+
+    def make_enchant_dict(self, langCode):
+        # (enchant is slow to import, so wait until a word needs checking)
+        import enchant
+        if self.personalWordList:
+            return enchant.DictWithPWL(langCode, self.personalWordList)
+        return enchant.Dict(langCode)
+
+    def get_verdict_cache(self, langCode):
+        """
+        Get the verdict cache for the language, or None if there's no
+        dictionary for it
+        """
+        if not self.verdictCaches.has_key(langCode):
+            import enchant
+            if langCode != self.defaultLangCode and not enchant.dict_exists(langCode):
+                return None
+            enchantDict = self.make_enchant_dict(langCode)
+            fingerprint = None
+            if self.cacheDir:
+                fingerprint = get_dictionary_fingerprint(langCode, enchantDict,
+                                                         self.personalWordList)
+            makeDict = lambda: self.make_enchant_dict(langCode)
+            self.verdictCaches[langCode] = VerdictCache(langCode, enchantDict,
+                                                        self.cacheDir, fingerprint,
+                                                        makeDict)
+        return self.verdictCaches[langCode]
+
+    def make_visitor(self, reporter):
+        return DocBookSpellChecker.Visitor(self.defaultLangCode, self.get_verdict_cache,
+                                           self.noSpellcheckElements, self.allowList,
+                                           self.maxMisspellings)
+
+    def finish_test(self, reporter, visitor):
         for lang in visitor.languages.itervalues():
-                for misspelling in lang.misspellings:
+                lang.check_pending_words(self.numThreads)
+                lang.verdictCache.flush()
+                for misspelling in lang.get_misspellings():
                     reporter.handle_warning(misspelling)                  
+                numUnrecorded = lang.get_num_unrecorded_misspellings()
+                if numUnrecorded:
+                    reporter.handle_suppressed(numUnrecorded)
+
+    def get_stats(self):
+        stats = {}
+        for verdictCache in self.verdictCaches.itervalues():
+            stats.update(verdictCache.get_stats())
+        return stats
 
     class Visitor(XmlVisitor):
         """Visitor that gathers spellchecking errors within the document"""
-        def __init__(self, defaultLangCode):
-            self.defaultLangCode = defaultLangCode
+        def __init__(self, defaultLangCode, getVerdictCache, noSpellcheckElements=(),
+                     allowList=None, maxOccurrences=None):
+            self.getVerdictCache = getVerdictCache
+            self.allowList = allowList
+            self.maxOccurrences = maxOccurrences
             self.languages = {}
+            self.langAttributes = {}
+            # Whether we're inside an element that isn't spellchecked, and
+            # the language of the text, are tracked as we go:
+            self.context = AncestorContext(noSpellcheckElements, defaultLangCode)
 
         def __lazy_get_language(self, langCode):
-            if not self.languages.has_key(langCode):
-                self.languages[langCode]=DocBookSpellChecker.Language(langCode)
-            return self.languages[langCode]
-
-        def __should_spellcheck(self, textNode):
-            # Don't spellcheck inside certain nodes:
-            if is_named_element(textNode.parentNode, "computeroutput"):
-                return False
-            
-            if is_named_element(textNode.parentNode, "filename"):
-                return False
-            
-            if is_named_element(textNode.parentNode, "ulink"):
-                return False
-            
-            if is_named_element(textNode.parentNode, "command"):
-                return False
-            
-            if is_named_element(textNode.parentNode, "keycap"):
-                return False
-
-            if is_named_element(textNode.parentNode, "tag"):
-                return False
-
-            if is_named_element(textNode.parentNode, "screen"):
-                return False
-
-            return True
+            # Map from each lang attribute seen to its Language (or None if
+            # there's no dictionary for it):
+            if not self.langAttributes.has_key(langCode):
+                # (enchant uses "en_US" where xml:lang uses "en-US")
+                enchantLangCode = langCode.replace('-', '_')
+                if not self.languages.has_key(enchantLangCode):
+                    verdictCache = self.getVerdictCache(enchantLangCode)
+                    if verdictCache is None:
+                        self.langAttributes[langCode] = None
+                        return None
+                    self.languages[enchantLangCode] = DocBookSpellChecker.Language(enchantLangCode,
+                                                                                   verdictCache,
+                                                                                   self.allowList,
+                                                                                   self.maxOccurrences)
+                self.langAttributes[langCode] = self.languages[enchantLangCode]
+            return self.langAttributes[langCode]
 
         def visit_textual(self, node):
-            if self.__should_spellcheck(node):
-                langCode = self.defaultLangCode #FIXME
-                lang = self.__lazy_get_language(langCode)
-        
-                lines = node.wholeText.splitlines()
-                for line in lines:
-                    for word in line.strip().split(' '):
-                        lang.check_word(node, word.strip(' .,()-:;<>'))
+            if self.context.skipDepth:
+                return
+            lang = self.__lazy_get_language(self.context.langCode)
+            if lang is None:
+                return
+            for word, offset in iter_words(node.wholeText):
+                lang.check_word(node, word)
 
         def visit_element(self, node):
-            pass
+            self.context.enter(node)
+
+        def leave_element(self, node):
+            self.context.leave(node)
         
     class Language:
-        """All spellcheck information relating to a particular language in the document"""
-        def __init__(self, langCode):
+        """
+        All spellcheck information relating to a particular language in the
+        document.
+
+        Words whose verdict is already cached are dealt with immediately;
+        occurrences of any other words are recorded, so that each distinct
+        word can be looked up just once, in a batch, when the traversal is
+        complete.  The occurrences are held as parallel arrays of indexes into
+        the lists of distinct words and of text nodes.
+
+        If maxOccurrences is given, only that many occurrences of each word
+        are recorded (since no more could be reported); the rest are just
+        counted.
+        """
+        def __init__(self, langCode, verdictCache, allowList=None, maxOccurrences=None):
             self.langCode = langCode
-            self.enchantDict = enchant.Dict(langCode)
-            self.misspellings = []
+            self.verdictCache = verdictCache
+            self.allowList = allowList
+            self.maxOccurrences = maxOccurrences
+            self.words = []
+            # The number of occurrences of each word:
+            self.wordCounts = array('i')
+            self.wordIndexes = {}
+            self.nodes = []
+            self.occurrenceWords = array('i')
+            self.occurrenceNodes = array('i')
 
         def check_word(self, node, word):
             # print 'word: "%s"'%word
             
             # Don't spellcheck numbers:
-            if re.match(r"^[\d.]*$", word):
+            if is_number(word):
                 return
             
-            # Check the word:
-            if not self.enchantDict.check(word):
-                self.misspellings.append(SpellcheckerError(node, self.langCode, word))
+            # Correctly-spelled words that we've seen before need no more work:
+            if self.verdictCache.lookup(word):
+                return
+
+            # Allow-listed words are accepted without asking enchant:
+            if self.allowList is not None and word in self.allowList:
+                self.verdictCache.add_allowed_word(word)
+                return
+
+            wordIndex = self.wordIndexes.get(word)
+            if wordIndex is None:
+                wordIndex = self.wordIndexes[word] = len(self.words)
+                self.words.append(word)
+                self.wordCounts.append(0)
+            self.wordCounts[wordIndex] += 1
+            if (self.maxOccurrences is not None
+                and self.wordCounts[wordIndex] > self.maxOccurrences):
+                return
+            if not self.nodes or self.nodes[-1] is not node:
+                self.nodes.append(node)
+            self.occurrenceWords.append(wordIndex)
+            self.occurrenceNodes.append(len(self.nodes) - 1)
+
+        def check_pending_words(self, numThreads=1):
+            "Look up each distinct word whose verdict isn't yet known"
+            unknownWords = [word for word in self.words
+                            if self.verdictCache.verdicts.get(word) is None]
+            self.verdictCache.check_words(unknownWords, numThreads)
+
+        def get_misspellings(self):
+            "Generate a SpellcheckerError for each recorded misspelling, in document order"
+            verdicts = [self.verdictCache.verdicts[word] for word in self.words]
+            for wordIndex, nodeIndex in itertools.izip(self.occurrenceWords,
+                                                       self.occurrenceNodes):
+                if not verdicts[wordIndex]:
+                    yield SpellcheckerError(self.nodes[nodeIndex], self.langCode,
+                                            self.words[wordIndex])
+
+        def get_num_unrecorded_misspellings(self):
+            "Get the number of occurrences of misspelled words beyond maxOccurrences"
+            if self.maxOccurrences is None:
+                return 0
+            return sum([count - self.maxOccurrences
+                        for word, count in zip(self.words, self.wordCounts)
+                        if count > self.maxOccurrences
+                        and not self.verdictCache.verdicts[word]])
 
 
 
@@ -158,7 +446,7 @@ The quick brown fox jumps over 3.2 lazy dogs
 class TestSpellcheck(SelfTest):
     def test_spelling_mistake(self):
         "Ensure that spelling mistakes are flagged"
-        self.assertRaises(SpellcheckerError, self.lint_string, misspellingExample)
+        self.assertWarns(SpellcheckerError, self.lint_string, misspellingExample)
 
     def test_dont_spellcheck_computeroutput(self):
         "Ensure that <computeroutput> doesn't get spellchecked"
@@ -168,3 +456,174 @@ class TestSpellcheck(SelfTest):
         "Ensure that numbers don't get spellchecked"
         self.lint_string(numericSpellingExample)
 
+nestedElementsExample="""<?xml version="1.0"?>
+<article>
+<screen>Type <emphasis>quzck</emphasis> at the prompt</screen>
+<para>The <emphasis>teh</emphasis> fox</para>
+</article>
+"""
+
+multilingualExample="""<?xml version="1.0"?>
+<article>
+<para>A chien</para>
+<para xml:lang="fr-FR">Un <emphasis>chien</emphasis> et un hund</para>
+<para lang="ja">hund</para>
+<para>Another chien</para>
+</article>
+"""
+
+class FakeDictSpellChecker(DocBookSpellChecker):
+    """
+    A spellchecker whose dictionaries are CountingDicts, for the languages
+    given, so that tests don't depend upon the dictionaries installed
+    """
+    def __init__(self, goodWordsByLangCode):
+        DocBookSpellChecker.__init__(self, 'en_US',
+                                     noSpellcheckElements=Configuration().noSpellcheckElements)
+        self.goodWordsByLangCode = goodWordsByLangCode
+
+    def get_verdict_cache(self, langCode):
+        if not self.goodWordsByLangCode.has_key(langCode):
+            return None
+        if not self.verdictCaches.has_key(langCode):
+            self.verdictCaches[langCode] = VerdictCache(
+                langCode, CountingDict(self.goodWordsByLangCode[langCode]))
+        return self.verdictCaches[langCode]
+
+class TestAncestorContext(unittest.TestCase):
+    def collect_misspellings(self, sourceStr, backend, spellChecker=None):
+        config = Configuration()
+        config.backend = backend
+        config.disabledChecks = ['line-lengths', 'forbidden-words', 'fedora-ids']
+        if spellChecker is not None:
+            config.spellCheck = False
+        reporter = CollectingReporter()
+        linter = DocBookLinter(reporter=reporter, config=config)
+        if spellChecker is not None:
+            linter.tests.append(spellChecker)
+        linter.test_doc(load_source(sourceStr, backend))
+        return [(warning.langCode, warning.word) for warning in reporter.warnings]
+
+    def test_nested_elements(self):
+        "Ensure that elements within a <screen> aren't spellchecked either"
+        for backend in ('dom', 'stream'):
+            self.assertEquals(self.collect_misspellings(nestedElementsExample, backend),
+                              [('en_US', 'teh')])
+
+    def test_languages(self):
+        "Ensure that text is checked against the dictionary for its language"
+        for backend in ('dom', 'stream'):
+            spellChecker = FakeDictSpellChecker({'en_US': ['A', 'Another'],
+                                                 'fr_FR': ['Un', 'chien', 'et', 'un']})
+            misspellings = self.collect_misspellings(multilingualExample, backend,
+                                                     spellChecker)
+            misspellings.sort()
+            # (there's no dictionary for "ja", so that text isn't checked)
+            self.assertEquals(misspellings,
+                              [('en_US', 'chien'), ('en_US', 'chien'), ('fr_FR', 'hund')])
+
+class CountingDict:
+    "A trivial dictionary, which counts the lookups made in it"
+    def __init__(self, goodWords):
+        self.goodWords = goodWords
+        self.numChecks = 0
+
+    def check(self, word):
+        self.numChecks += 1
+        return word in self.goodWords
+
+class TestVerdictCache(unittest.TestCase):
+    def setUp(self):
+        self.cacheDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cacheDir)
+
+    def test_memo(self):
+        "Ensure that each distinct word is only looked up once"
+        countingDict = CountingDict(['the'])
+        cache = VerdictCache('en_US', countingDict)
+        for word in ['the', 'the', 'quzck', 'the', 'quzck']:
+            cache.check(word)
+        self.assertEquals(countingDict.numChecks, 2)
+        self.assertEquals(cache.hits, 3)
+        self.assertEquals(cache.check('quzck'), False)
+
+    def test_disk_cache(self):
+        "Ensure that verdicts are reused by later runs"
+        cache = VerdictCache('en_US', CountingDict(['the']), self.cacheDir, 'abc')
+        cache.check('the')
+        cache.check('quzck')
+        cache.flush()
+
+        countingDict = CountingDict([])
+        cache = VerdictCache('en_US', countingDict, self.cacheDir, 'abc')
+        self.assertEquals(cache.check('the'), True)
+        self.assertEquals(cache.check('quzck'), False)
+        self.assertEquals(countingDict.numChecks, 0)
+        self.assertEquals(cache.diskHits, 2)
+
+        # A different dictionary mustn't reuse those verdicts:
+        cache = VerdictCache('en_US', countingDict, self.cacheDir, 'def')
+        self.assertEquals(cache.check('the'), False)
+
+class TestBatchSpellcheck(unittest.TestCase):
+    def test_each_word_checked_once(self):
+        "Ensure that each distinct word is looked up once, after the traversal"
+        countingDict = CountingDict(['the', 'fox'])
+        lang = DocBookSpellChecker.Language('en_US', VerdictCache('en_US', countingDict))
+        nodes = {}
+        for name in 'abc':
+            nodes[name] = xml.dom.minidom.Text()
+            nodes[name].data = name
+        for name, word in [('a', 'the'), ('a', 'quzck'), ('a', 'fox'),
+                           ('b', 'teh'), ('b', 'quzck'), ('c', 'the'), ('c', '2008')]:
+            lang.check_word(nodes[name], word)
+        self.assertEquals(countingDict.numChecks, 0)
+        lang.check_pending_words()
+        self.assertEquals(countingDict.numChecks, 4)
+        self.assertEquals([(error.context, error.word) for error in lang.get_misspellings()],
+                          [('a', 'quzck'), ('b', 'teh'), ('b', 'quzck')])
+
+    def test_allow_list(self):
+        "Ensure that allow-listed words are accepted without consulting the dictionary"
+        countingDict = CountingDict(['the'])
+        lang = DocBookSpellChecker.Language('en_US', VerdictCache('en_US', countingDict),
+                                            frozenset([u'quzck']))
+        node = xml.dom.minidom.Text()
+        node.data = 'a'
+        for word in [u'the', u'quzck', u'teh', u'quzck']:
+            lang.check_word(node, word)
+        lang.check_pending_words()
+        self.assertEquals(countingDict.numChecks, 2)
+        self.assertEquals([error.word for error in lang.get_misspellings()], [u'teh'])
+
+    def test_max_occurrences(self):
+        "Ensure that occurrences beyond the limit are counted, not recorded"
+        lang = DocBookSpellChecker.Language('en_US', VerdictCache('en_US', CountingDict(['the'])),
+                                            maxOccurrences=2)
+        node = xml.dom.minidom.Text()
+        node.data = 'a'
+        for word in [u'teh', u'the', u'teh', u'teh', u'quzck', u'teh', u'the', u'the']:
+            lang.check_word(node, word)
+        self.assertEquals(len(lang.occurrenceWords), 5)
+        lang.check_pending_words()
+        self.assertEquals([error.word for error in lang.get_misspellings()],
+                          [u'teh', u'teh', u'quzck'])
+        self.assertEquals(lang.get_num_unrecorded_misspellings(), 2)
+
+    def test_threads(self):
+        "Ensure that a batch of words can be shared between threads"
+        dicts = []
+        def make_dict():
+            dicts.append(CountingDict(['word0', 'word1']))
+            return dicts[-1]
+        cache = VerdictCache('en_US', make_dict(), makeDict=make_dict)
+        cache.minWordsPerThread = 2
+        words = ['word%i' % i for i in range(10)]
+        cache.check_words(words, numThreads=3)
+        self.assertEquals(len(dicts), 4)
+        self.assertEquals(dicts[0].numChecks, 0)
+        self.assertEquals([cache.verdicts[word] for word in words],
+                          [True, True] + [False] * 8)
+        self.assertEquals(cache.misses, 10)
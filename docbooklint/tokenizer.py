@@ -0,0 +1,96 @@
+# Copyright (c) 2008 Red Hat, Inc. All rights reserved. This copyrighted material
+# is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Author: David Malcolm
+
+import re
+import unicodedata
+import unittest
+
+#
+# Splitting text into words, as used by the spellchecker and the forbidden
+# words check.
+#
+# A word is a run of letters, digits and underscores (in any script), which
+# may contain single apostrophes, hyphens or periods between those
+# characters (e.g. "don't", "e-mail", "3.2").  Everything else (whitespace
+# of any kind, and all other punctuation) separates words.
+#
+# Where symbols matter, e.g. to the forbidden words check given "C++" or
+# "C#", a pattern can be made whose words may also contain those symbols.
+#
+
+wordPattern = re.compile(u"\\w+(?:['\u2019.\\-]\\w+)*", re.UNICODE)
+
+def make_word_pattern(symbols):
+    "Get a pattern for words which may also contain any of the symbol characters"
+    if not symbols:
+        return wordPattern
+    wordChars = u'[\\w%s]' % u''.join([re.escape(symbol) for symbol in sorted(symbols)])
+    return re.compile(u"%s+(?:['\u2019.\\-]%s+)*" % (wordChars, wordChars), re.UNICODE)
+
+def get_symbols(text):
+    """
+    Get the set of symbol characters (e.g. the "+" of "C++") within the
+    text: those which aren't letters, digits, whitespace or the punctuation
+    that separates or joins words
+    """
+    if isinstance(text, str):
+        text = text.decode('utf-8', 'ignore')
+    return set([char for char in text
+                if unicodedata.category(char)[0] == 'S' or char in u'#%&*@'])
+
+numberPattern = re.compile(r'^[\d.]+$', re.UNICODE)
+
+def iter_words(text, pattern=wordPattern):
+    "Generate a (word, offset) pair for each word within the text"
+    for match in pattern.finditer(text):
+        yield match.group(), match.start()
+
+def is_number(word):
+    return numberPattern.match(word) is not None
+
+#
+# Unit tests
+#
+
+class TestTokenizer(unittest.TestCase):
+    def test_words(self):
+        "Ensure that punctuation and all kinds of whitespace separate words"
+        text = u'The (quick)\tbrown\nfox: jumps\u2014over \u201cthe\u201d dog.'
+        self.assertEquals([word for word, offset in iter_words(text)],
+                          [u'The', u'quick', u'brown', u'fox', u'jumps',
+                           u'over', u'the', u'dog'])
+
+    def test_offsets(self):
+        "Ensure that the offset of each word within the text is given"
+        text = u'  e-mail, e.g. 3.2 don\u2019t'
+        for word, offset in iter_words(text):
+            self.assertEquals(text[offset:offset + len(word)], word)
+        self.assertEquals([word for word, offset in iter_words(text)],
+                          [u'e-mail', u'e.g', u'3.2', u'don\u2019t'])
+
+    def test_symbols(self):
+        "Ensure that words can be made to contain symbols"
+        text = u'Use C++ (or C#), not C; e-mail a+b.'
+        symbols = get_symbols(u'C++ C#')
+        self.assertEquals(symbols, set([u'+', u'#']))
+        self.assertEquals([word for word, offset in iter_words(text, make_word_pattern(symbols))],
+                          [u'Use', u'C++', u'or', u'C#', u'not', u'C', u'e-mail', u'a+b'])
+        self.assert_(make_word_pattern(get_symbols(u"don't e-mail")) is wordPattern)
+
+    def test_numbers(self):
+        "Ensure that numbers, but not words containing digits, are recognized"
+        self.assert_(is_number(u'3.2'))
+        self.assert_(is_number(u'2008'))
+        self.failIf(is_number(u'i8042'))
@@ -0,0 +1,468 @@
+# Copyright (c) 2008 Red Hat, Inc. All rights reserved. This copyrighted material
+# is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Author: David Malcolm
+from docbooklint.linter import *
+from docbooklint.xmlutils import *
+
+import BaseHTTPServer
+import httplib
+import os
+import os.path
+import Queue
+import shutil
+import socket
+import SocketServer
+import tempfile
+import threading
+import time
+import unittest
+import urllib
+import urlparse
+
+#
+# Checking the URLs of <ulink> elements.
+#
+# The visitor only collects the distinct URLs (and where each is used); they
+# are checked once the traversal is complete.  URLs are grouped by host, and
+# the hosts are shared out between a pool of threads, so that each host is
+# checked over a single keep-alive connection, with at most a given number
+# of requests per second, while many hosts are checked at once.
+#
+# Results are kept in an sqlite file, so that later runs only check again
+# the URLs whose results are older than a given age.  Failures to get any
+# response (e.g. timeouts) may well be transient, so they're only kept for a
+# short while.
+#
+# The rate limit applies within a process: check_files divides it between
+# the processes of a -j run.
+#
+
+class BrokenULink(DocBookError):
+    __slots__ = ('url', 'status', 'reason')
+
+    def __init__(self, node, url, status, reason):
+        DocBookError.__init__(self, node)
+        self.url = url
+        self.status = status
+        self.reason = reason
+
+    def __str__(self):
+        if self.status:
+            return 'Broken link to "%s": %i %s'%(self.url, self.status, self.reason)
+        return 'Broken link to "%s": %s'%(self.url, self.reason)
+
+def quote_url_part(part):
+    """
+    Percent-encode any characters in the path or query of a URL that can't
+    be sent as they are (e.g. non-ASCII ones), leaving those that are
+    already escaped, or that have a meaning within URLs, alone
+    """
+    if isinstance(part, unicode):
+        part = part.encode('utf-8')
+    return urllib.quote(part, safe="/%;:@&=+$,!~*'()?")
+
+def is_broken(status):
+    "Is an HTTP status (or 0, for a failure to get one) that of a broken link?"
+    return status == 0 or status >= 400
+
+class UrlCache:
+    """
+    The result of checking each URL, as a (status, reason) pair, along with
+    the time at which it was checked.  Results older than ttl seconds (or
+    failureTtl seconds, for failures to get a response) are treated as
+    unknown.
+
+    If a cache directory is given, the results are also stored in an sqlite
+    file there, which is read in full when the cache is created.
+    """
+    def __init__(self, ttl, cacheDir=None, failureTtl=10 * 60):
+        self.ttl = ttl
+        self.failureTtl = min(failureTtl, ttl)
+        self.results = {}
+        self.newResults = []
+        self.hits = 0
+        self.misses = 0
+
+        self.connection = None
+        if cacheDir:
+            self.open_disk_cache(cacheDir)
+
+    def open_disk_cache(self, cacheDir):
+        import sqlite3
+        if not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir)
+        filename = os.path.join(cacheDir, 'ulinks.sqlite')
+        self.connection = sqlite3.connect(filename, timeout=60)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS results '
+                                '(url TEXT PRIMARY KEY, status INTEGER, reason TEXT, checked REAL)')
+        for url, status, reason, checked in self.connection.execute('SELECT * FROM results'):
+            self.results[url] = (status, reason, checked)
+
+    def lookup(self, url, now):
+        "Get the (status, reason) for the URL, or None if it needs checking"
+        result = self.results.get(url)
+        if result is not None and result[0] == 0:
+            ttl = self.failureTtl
+        else:
+            ttl = self.ttl
+        if result is None or now - result[2] > ttl:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result[:2]
+
+    def add_result(self, url, status, reason, now):
+        self.results[url] = (status, reason, now)
+        if self.connection is not None:
+            self.newResults.append((url, status, reason, now))
+
+    def flush(self):
+        "Write any new results to the disk cache"
+        if self.connection is not None and self.newResults:
+            self.connection.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                                        self.newResults)
+            self.connection.commit()
+            self.newResults = []
+
+class HostChecker:
+    """
+    Checks URLs on one host, in turn, over a single connection (which is
+    reopened if the server closes it), no more often than minInterval
+    seconds apart (or after the lastRequestTime given, from checking the
+    host's URLs for an earlier document)
+    """
+    def __init__(self, scheme, netloc, timeout, minInterval, lastRequestTime=None):
+        self.scheme = scheme
+        self.netloc = netloc
+        self.timeout = timeout
+        self.minInterval = minInterval
+        self.connection = None
+        self.lastRequestTime = lastRequestTime
+        self.numConnections = 0
+
+    def connect(self):
+        if self.scheme == 'https':
+            connectionClass = httplib.HTTPSConnection
+        else:
+            connectionClass = httplib.HTTPConnection
+        self.connection = connectionClass(self.netloc, timeout=self.timeout)
+        self.numConnections += 1
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def request(self, method, path):
+        "Make the request, returning the response status and reason"
+        if self.lastRequestTime is not None:
+            delay = self.lastRequestTime + self.minInterval - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        self.lastRequestTime = time.time()
+
+        for attempt in (0, 1):
+            reused = self.connection is not None
+            if not reused:
+                self.connect()
+            try:
+                self.connection.request(method, path, headers={'User-Agent': 'docbook-lint'})
+                response = self.connection.getresponse()
+                # (the body must be read before the connection can be reused)
+                response.read()
+            except (httplib.HTTPException, socket.error):
+                self.close()
+                # A kept-alive connection may have been closed by the server
+                # since its last use, so try again with a new one:
+                if reused:
+                    continue
+                raise
+            if response.will_close:
+                self.close()
+            return response.status, response.reason
+
+    def check(self, url):
+        "Get the (status, reason) for the URL"
+        parsed = urlparse.urlsplit(url)
+        path = quote_url_part(parsed.path or '/')
+        if parsed.query:
+            path += '?' + quote_url_part(parsed.query)
+        try:
+            status, reason = self.request('HEAD', path)
+            if status in (405, 501):
+                # The server doesn't support HEAD requests:
+                status, reason = self.request('GET', path)
+        except socket.timeout:
+            return 0, 'timed out'
+        except (httplib.HTTPException, socket.error), e:
+            return 0, str(e) or e.__class__.__name__
+        return status, reason
+
+def check_urls(urls, numThreads, timeout, requestsPerSecond, lastRequestTimes=None):
+    """
+    Check the HTTP and HTTPS URLs, returning a map from each to its (status,
+    reason), and the number of connections that were made.
+
+    requestsPerSecond may be 0, for no limit.  If a lastRequestTimes
+    dictionary is given, the limit is kept to across calls: it holds the time
+    of the last request to each (scheme, netloc), and is updated.
+    """
+    if requestsPerSecond > 0:
+        minInterval = 1.0 / requestsPerSecond
+    else:
+        minInterval = 0.0
+    if lastRequestTimes is None:
+        lastRequestTimes = {}
+
+    hosts = {}
+    for url in urls:
+        parsed = urlparse.urlsplit(url)
+        if parsed.scheme in ('http', 'https') and parsed.netloc:
+            hosts.setdefault((parsed.scheme, parsed.netloc), []).append(url)
+
+    queue = Queue.Queue()
+    for (scheme, netloc), hostUrls in hosts.iteritems():
+        queue.put(((scheme, netloc), hostUrls))
+    results = {}
+    numConnections = [0]
+    lock = threading.Lock()
+    def worker():
+        while True:
+            try:
+                (scheme, netloc), hostUrls = queue.get_nowait()
+            except Queue.Empty:
+                return
+            checker = HostChecker(scheme, netloc, timeout, minInterval,
+                                  lastRequestTimes.get((scheme, netloc)))
+            try:
+                hostResults = [(url, checker.check(url)) for url in hostUrls]
+            finally:
+                checker.close()
+            lock.acquire()
+            try:
+                results.update(hostResults)
+                numConnections[0] += checker.numConnections
+                lastRequestTimes[(scheme, netloc)] = checker.lastRequestTime
+            finally:
+                lock.release()
+
+    threads = [threading.Thread(target=worker)
+               for i in range(min(numThreads, len(hosts)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, numConnections[0]
+
+class DocBookULinks(DocBookTest):
+    def __init__(self, numThreads=8, timeout=10.0, requestsPerSecond=2.0,
+                 ttl=7 * 24 * 60 * 60, cacheDir=None):
+        self.numThreads = numThreads
+        self.timeout = timeout
+        self.requestsPerSecond = requestsPerSecond
+        # Shared by every document that we check:
+        self.urlCache = UrlCache(ttl, cacheDir)
+        self.lastRequestTimes = {}
+        self.numRequested = 0
+        self.numConnections = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return DocBookULinks(config.ulinkThreads, config.ulinkTimeout,
+                             config.ulinkRequestsPerSecond, config.ulinkCacheTtl,
+                             config.ulinkCacheDir)
+
+    def make_visitor(self, reporter):
+        return DocBookULinks.Visitor()
+
+    def finish_test(self, reporter, visitor):
+        now = time.time()
+        results = {}
+        staleUrls = []
+        for url in visitor.urls:
+            result = self.urlCache.lookup(url, now)
+            if result is None:
+                staleUrls.append(url)
+            else:
+                results[url] = result
+
+        if staleUrls:
+            newResults, numConnections = check_urls(staleUrls, self.numThreads, self.timeout,
+                                                    self.requestsPerSecond,
+                                                    self.lastRequestTimes)
+            self.numRequested += len(newResults)
+            self.numConnections += numConnections
+            for url, (status, reason) in newResults.iteritems():
+                self.urlCache.add_result(url, status, reason, now)
+            self.urlCache.flush()
+            results.update(newResults)
+
+        for url, node in visitor.occurrences:
+            # (URLs that weren't checked, e.g. "mailto:" ones, have no result)
+            status, reason = results.get(url, (200, 'OK'))
+            if is_broken(status):
+                reporter.handle_warning(BrokenULink(node, url, status, reason))
+
+    def get_stats(self):
+        return {'ulink cache hits': self.urlCache.hits,
+                'ulink cache misses': self.urlCache.misses,
+                'ulink urls requested': self.numRequested,
+                'ulink connections': self.numConnections}
+
+    class Visitor(XmlVisitor):
+        def __init__(self):
+            # The distinct URLs, in order, and (url, node) for every link:
+            self.urls = []
+            self.occurrences = []
+            self.seen = set()
+
+        def visit_textual(self, node):
+            pass
+
+        def visit_element(self, node):
+            if node.nodeName == 'ulink':
+                url = node.getAttribute('url').strip()
+                if url:
+                    self.occurrences.append((url, node))
+                    if url not in self.seen:
+                        self.seen.add(url)
+                        self.urls.append(url)
+
+#
+# Unit tests
+#
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    "Serves /ok, /no-head and /caf%C3%A9; anything else is missing"
+    protocol_version = 'HTTP/1.1'
+
+    def respond(self, status):
+        self.server.requests.append((self.command, self.path, self.client_address))
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_HEAD(self):
+        if self.path in ('/ok', '/caf%C3%A9'):
+            self.respond(200)
+        elif self.path == '/no-head':
+            self.respond(405)
+        else:
+            self.respond(404)
+
+    def do_GET(self):
+        if self.path in ('/ok', '/no-head'):
+            self.respond(200)
+        else:
+            self.respond(404)
+
+    def log_message(self, format, *args):
+        pass
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+ulinkExample="""<?xml version="1.0"?>
+<article>
+<para>See <ulink url="%(base)s/ok">this</ulink>, <ulink url="%(base)s/missing">that</ulink>,
+<ulink url="%(base)s/no-head">the other</ulink> and <ulink url="mailto:nobody@example.com">mail</ulink></para>
+<para>See <ulink url="%(base)s/missing">that</ulink> again</para>
+</article>
+"""
+
+class TestULinks(unittest.TestCase):
+    def setUp(self):
+        self.cacheDir = tempfile.mkdtemp()
+        self.server = StandInServer(('127.0.0.1', 0), StandInHandler)
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.base = 'http://127.0.0.1:%i' % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.cacheDir)
+
+    def check(self, ttl=3600):
+        config = Configuration()
+        config.spellCheck = False
+        config.checkULinks = True
+        config.ulinkCacheDir = self.cacheDir
+        config.ulinkCacheTtl = ttl
+        config.ulinkRequestsPerSecond = 1000
+        reporter = CollectingReporter()
+        linter = DocBookLinter(reporter=reporter, config=config)
+        linter.test_doc(XmlDoc.from_source(ulinkExample % {'base': self.base}))
+        return [(warning.url[len(self.base):], warning.status, warning.get_location()[1])
+                for warning in reporter.warnings], linter.get_stats()
+
+    def test_broken_links(self):
+        "Ensure that broken links are reported, checking each URL once, over one connection"
+        warnings, stats = self.check()
+        self.assertEquals(warnings, [('/missing', 404, 3), ('/missing', 404, 5)])
+        self.assertEquals([(method, path) for method, path, address in self.server.requests],
+                          [('HEAD', '/ok'), ('HEAD', '/missing'),
+                           ('HEAD', '/no-head'), ('GET', '/no-head')])
+        self.assertEquals(len(set([address for method, path, address in self.server.requests])), 1)
+        self.assertEquals(stats['ulink connections'], 1)
+
+    def test_cache(self):
+        "Ensure that results are reused by later runs, until they expire"
+        firstWarnings, stats = self.check()
+        secondWarnings, stats = self.check()
+        self.assertEquals(secondWarnings, firstWarnings)
+        self.assertEquals(len(self.server.requests), 4)
+        self.assertEquals(stats['ulink cache hits'], 3)
+        thirdWarnings, stats = self.check(ttl=-1)
+        self.assertEquals(thirdWarnings, firstWarnings)
+        self.assertEquals(len(self.server.requests), 8)
+
+    def test_unreachable(self):
+        "Ensure that a host that can't be reached gives a broken link"
+        # (find a port with nothing listening on it)
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        url = 'http://127.0.0.1:%i/ok' % sock.getsockname()[1]
+        sock.close()
+        results, numConnections = check_urls([url], 2, 1.0, 1000)
+        self.assertEquals(results[url][0], 0)
+
+    def test_non_ascii_path(self):
+        "Ensure that URLs with non-ASCII paths are sent percent-encoded"
+        url = self.base + u'/caf\xe9'
+        results, numConnections = check_urls([url], 1, 1.0, 1000)
+        self.assertEquals(results[url], (200, 'OK'))
+        self.assertEquals(self.server.requests[0][:2], ('HEAD', '/caf%C3%A9'))
+        self.assertEquals(quote_url_part(u'/a b?x=1&y=%20'), '/a%20b?x=1&y=%20')
+
+    def test_transient_failures(self):
+        "Ensure that failures to get a response are only cached for a short while"
+        cache = UrlCache(3600, failureTtl=60)
+        cache.add_result('http://a/', 404, 'Not Found', 0)
+        cache.add_result('http://b/', 0, 'timed out', 0)
+        self.assertEquals(cache.lookup('http://a/', 120), (404, 'Not Found'))
+        self.assertEquals(cache.lookup('http://b/', 30), (0, 'timed out'))
+        self.assertEquals(cache.lookup('http://b/', 120), None)
+
+    def test_rate_limit(self):
+        "Ensure that the rate limit holds across calls, and that 0 means no limit"
+        url = self.base + '/ok'
+        lastRequestTimes = {}
+        check_urls([url], 1, 1.0, 0, lastRequestTimes)
+        start = time.time()
+        check_urls([url], 1, 1.0, 4, lastRequestTimes)
+        self.assert_(time.time() - start >= 0.2)
+        self.assertEquals(len(self.server.requests), 2)
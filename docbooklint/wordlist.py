@@ -0,0 +1,180 @@
+# Copyright (c) 2008 Red Hat, Inc. All rights reserved. This copyrighted material
+# is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Author: David Malcolm
+
+from docbooklint.xmlutils import map_file
+
+import os
+import os.path
+import shutil
+import struct
+import tempfile
+import unittest
+
+#
+# Allow-lists: lists of words (e.g. product names and commands) that the
+# spellchecker accepts without consulting enchant.
+#
+# A list can be a text file, with one word per line, which is read into a
+# frozenset by each process that uses it.  A large list is better built into
+# a binary file (with build_word_list), which is memory-mapped rather than
+# read, so that it loads immediately and its pages are shared between all of
+# the worker processes.  The binary format is:
+#
+#   the magic string
+#   the number of words, N, as a little-endian 32-bit integer
+#   N + 1 offsets (likewise), of the start of each word and the end of the last
+#   the words, encoded as UTF-8, sorted, without separators
+#
+
+magic = 'docbook-lint word list 1\n'
+
+class WordList:
+    "A binary word list (usually memory-mapped), searched by bisection"
+    def __init__(self, data):
+        self.data = data
+        self.numWords = struct.unpack_from('<I', data, len(magic))[0]
+        self.offsetsStart = len(magic) + 4
+        self.wordsStart = self.offsetsStart + 4 * (self.numWords + 1)
+
+    @classmethod
+    def from_file(cls, filename):
+        f = open(filename, 'rb')
+        try:
+            return cls(map_file(f))
+        finally:
+            f.close()
+
+    def __len__(self):
+        return self.numWords
+
+    def get_word(self, index):
+        "Get the index'th word, as UTF-8"
+        start, end = struct.unpack_from('<II', self.data, self.offsetsStart + 4 * index)
+        return self.data[self.wordsStart + start:self.wordsStart + end]
+
+    def __contains__(self, word):
+        if isinstance(word, unicode):
+            word = word.encode('utf-8')
+        # (get_word, inlined, since this is the inner loop)
+        data = self.data
+        offsetsStart = self.offsetsStart
+        wordsStart = self.wordsStart
+        unpack_from = struct.unpack_from
+        lo, hi = 0, self.numWords
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start, end = unpack_from('<II', data, offsetsStart + 4 * mid)
+            if data[wordsStart + start:wordsStart + end] < word:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo < self.numWords and self.get_word(lo) == word
+
+def read_words(filename):
+    "Read a text word list, returning the words as UTF-8 strings"
+    f = open(filename, 'rb')
+    try:
+        return [line.strip() for line in f if line.strip()]
+    finally:
+        f.close()
+
+def build_word_list(outputFilename, inputFilenames):
+    "Build a binary word list from the text word lists; return the number of words"
+    words = set()
+    for filename in inputFilenames:
+        words.update(read_words(filename))
+    words = sorted(words)
+    offsets = [0]
+    for word in words:
+        offsets.append(offsets[-1] + len(word))
+
+    f = open(outputFilename, 'wb')
+    try:
+        f.write(magic)
+        f.write(struct.pack('<I', len(words)))
+        f.write(struct.pack('<%iI' % len(offsets), *offsets))
+        f.write(''.join(words))
+    finally:
+        f.close()
+    return len(words)
+
+def load_word_list(filename):
+    """
+    Load a word list, of either kind, as something supporting "in" (for
+    unicode words)
+    """
+    f = open(filename, 'rb')
+    try:
+        isBinary = (f.read(len(magic)) == magic)
+    finally:
+        f.close()
+    if isBinary:
+        return WordList.from_file(filename)
+    return frozenset([word.decode('utf-8') for word in read_words(filename)])
+
+class AllowList:
+    "The union of several word lists"
+    def __init__(self, filenames):
+        self.wordLists = [load_word_list(filename) for filename in filenames]
+
+    def __contains__(self, word):
+        for wordList in self.wordLists:
+            if word in wordList:
+                return True
+        return False
+
+#
+# Unit tests
+#
+
+class TestWordList(unittest.TestCase):
+    def setUp(self):
+        self.dirName = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dirName)
+
+    def write_file(self, name, sourceStr):
+        filename = os.path.join(self.dirName, name)
+        f = open(filename, 'wb')
+        f.write(sourceStr)
+        f.close()
+        return filename
+
+    def test_binary(self):
+        "Ensure that a built word list contains exactly the words of its inputs"
+        first = self.write_file('first.txt', 'yum\nRPM\n\nSELinux\n')
+        second = self.write_file('second.txt', 'yum\nNetworkManager\nna\xc3\xafve\n')
+        filename = os.path.join(self.dirName, 'words.bin')
+        self.assertEquals(build_word_list(filename, [first, second]), 5)
+        wordList = load_word_list(filename)
+        self.assert_(isinstance(wordList, WordList))
+        for word in ['yum', 'RPM', 'SELinux', 'NetworkManager', u'na\xefve']:
+            self.assert_(word in wordList, word)
+        for word in ['', 'rpm', 'a', 'zzz', 'SELinu', 'naive']:
+            self.failIf(word in wordList, word)
+
+    def test_text(self):
+        "Ensure that a text word list can be used directly"
+        filename = self.write_file('words.txt', 'yum\nRPM\n')
+        allowList = AllowList([filename])
+        self.assert_(u'RPM' in allowList)
+        self.failIf(u'rpm' in allowList)
+
+    def test_empty(self):
+        "Ensure that an empty word list can be built and loaded"
+        filename = os.path.join(self.dirName, 'words.bin')
+        build_word_list(filename, [self.write_file('empty.txt', '')])
+        self.failIf('yum' in load_word_list(filename))
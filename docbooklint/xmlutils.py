@@ -14,15 +14,33 @@
 # Author: David Malcolm
 
 import xml.dom.minidom
-import xml.dom.ext
+import xml.dom.expatbuilder
+import xml.parsers.expat
+import mmap
 import os.path
+import os
+import Queue
+import shutil
+import sys
+import StringIO
+import tempfile
+import threading
+import time
+import unittest
+import weakref
+from array import array
 
 #
 # XML utilities:
 #
 
+xincludeNamespace = 'http://www.w3.org/2001/XInclude'
+
+textualNodeTypes = frozenset([xml.dom.minidom.Node.TEXT_NODE,
+                              xml.dom.minidom.Node.CDATA_SECTION_NODE])
+
 def is_textual(node):
-    return node.nodeType in [xml.dom.minidom.Node.TEXT_NODE, xml.dom.minidom.Node.CDATA_SECTION_NODE]
+    return node.nodeType in textualNodeTypes
 
 def is_element(node):
     return node.nodeType == xml.dom.minidom.Node.ELEMENT_NODE
@@ -34,22 +52,686 @@ def is_named_element(node, elementName, nsURI=None):
                 return True
     return False
 
+def is_xinclude(node):
+    return is_named_element(node, 'include', xincludeNamespace)
+
+def get_include_filename(node, xmlDoc):
+    "Get the path of the file referenced by an <xi:include> element"
+    filename = node.getAttribute('href')
+    if not os.path.isabs(filename):
+        filename = os.path.join(xmlDoc.basePath, filename)
+    return filename
+
+
+#
+# Source locations:
+#
+# Nodes don't record where they came from, so the locations are gathered
+# whilst parsing, and kept in a LocationTable for each document (found via
+# the document node).  The line and column numbers are held in the table's
+# arrays, rather than as (filename, line, column) tuples or extra DOM
+# attributes on each node; each node only holds its index into the arrays,
+# as a plain Python attribute (not a DOM attribute, so it isn't visible to
+# getAttribute or serialization).  An index on the node costs a single int,
+# where a table keyed by id(node) would cost a dict entry and two ints per
+# node, and could be confused by ids reused after nodes are freed.
+#
+
+def map_file(f):
+    "Memory-map the whole of an open file for reading, or return None if it's empty"
+    size = os.fstat(f.fileno()).st_size
+    if not size:
+        return None
+    return mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+
+class SourceText:
+    """
+    The raw text of a parsed file (usually memory-mapped), kept so that
+    lines of the source can be extracted without reading the file again.
+    Lines are returned as buffer objects, i.e. without copying them.
+    """
+    def __init__(self, data, filename=None):
+        self.data = data
+        self.filename = filename
+        self.size = len(data)
+        # The offset at which each line starts, built when first needed:
+        self.lineOffsets = None
+
+    @classmethod
+    def from_file(cls, filename):
+        f = open(filename, 'rb')
+        try:
+            data = map_file(f)
+        finally:
+            f.close()
+        if data is None:
+            data = ''
+        return SourceText(data, filename)
+
+    def is_stale(self):
+        "Has the file changed size since it was mapped? (if so, reading it could fault)"
+        if self.filename is None or not isinstance(self.data, mmap.mmap):
+            return False
+        try:
+            return os.stat(self.filename).st_size != self.size
+        except OSError:
+            return True
+
+    def make_reader(self):
+        "Get a file-like object from which the parser can read the text"
+        if isinstance(self.data, mmap.mmap):
+            self.data.seek(0)
+            return self.data
+        return StringIO.StringIO(self.data)
+
+    def index_lines(self):
+        offsets = array('l', [0])
+        data = self.data
+        # (an mmap searches from its current position by default)
+        pos = data.find('\n', 0)
+        while pos != -1:
+            offsets.append(pos + 1)
+            pos = data.find('\n', pos + 1)
+        self.lineOffsets = offsets
+
+    def get_line(self, lineNumber):
+        "Get the given line (numbered from 1) without its newline, or None"
+        if self.is_stale():
+            return None
+        if self.lineOffsets is None:
+            self.index_lines()
+        if lineNumber < 1 or lineNumber > len(self.lineOffsets):
+            return None
+        begin = self.lineOffsets[lineNumber - 1]
+        if lineNumber < len(self.lineOffsets):
+            end = self.lineOffsets[lineNumber] - 1
+        else:
+            end = self.size
+        if end > begin and self.data[end - 1] == '\r':
+            end -= 1
+        if isinstance(self.data, unicode):
+            return self.data[begin:end]
+        return buffer(self.data, begin, end - begin)
+
+class LocationTable:
+    """
+    The source locations of the elements and text nodes of one parsed file,
+    held as parallel arrays of line and column numbers, together with the
+    file's SourceText (if known).  Each node holds its index into the arrays,
+    as its locationIndex attribute.
+    """
+    def __init__(self, filename, source=None):
+        self.filename = filename
+        self.source = source
+        # The href of each XInclude in the file, in document order (so that
+        # prefetching doesn't need to search the DOM for them):
+        self.includeHrefs = []
+        self.lines = array('i')
+        self.columns = array('i')
+
+    def add(self, node, line, column):
+        # (set directly, as expatbuilder sets the other node attributes)
+        node.__dict__['locationIndex'] = len(self.lines)
+        self.lines.append(line)
+        self.columns.append(column)
+
+    def get_location(self, node):
+        "Get a (filename, line, column) tuple for the node, or None"
+        index = getattr(node, 'locationIndex', None)
+        if index is None:
+            return None
+        # expat's column numbers start at 0:
+        return (self.filename, self.lines[index], self.columns[index] + 1)
+
+# Map from document node to its LocationTable:
+locationTables = weakref.WeakKeyDictionary()
+
+def get_location(node):
+    "Get a (filename, line, column) tuple for where the node was parsed from, or None"
+    location = getattr(node, 'location', None)
+    if location is not None:
+        return location
+    document = getattr(node, 'ownerDocument', None)
+    if document is None:
+        return None
+    table = locationTables.get(document)
+    if table is None:
+        return None
+    return table.get_location(node)
+
+def get_source_line(node):
+    "Get the line of source text on which the node starts (as unicode), or None"
+    document = getattr(node, 'ownerDocument', None)
+    if document is None:
+        return None
+    table = locationTables.get(document)
+    if table is None or table.source is None:
+        return None
+    location = table.get_location(node)
+    if location is None:
+        return None
+    line = table.source.get_line(location[1])
+    if line is None or isinstance(line, unicode):
+        return line
+    return str(line).decode('utf-8', 'replace')
+
+class LocatingBuilder(xml.dom.expatbuilder.ExpatBuilderNS):
+    """
+    Builds a minidom DOM as usual, recording the location of each element
+    and text node as it is created.
+
+    expat only reports the correct starting position of text if the text
+    isn't buffered, so it is received in chunks, which are accumulated in a
+    list and joined once the text node is complete.
+    """
+    def __init__(self, filename=None, source=None):
+        xml.dom.expatbuilder.ExpatBuilderNS.__init__(self)
+        self.locations = LocationTable(filename, source)
+        self.pendingNode = None
+        self.pendingChunks = []
+
+    def install(self, parser):
+        xml.dom.expatbuilder.ExpatBuilderNS.install(self, parser)
+        parser.buffer_text = False
+
+    def start_element_handler(self, name, attributes):
+        xml.dom.expatbuilder.ExpatBuilderNS.start_element_handler(self, name, attributes)
+        self.add_location(self.curNode)
+        if is_xinclude(self.curNode):
+            self.locations.includeHrefs.append(self.curNode.getAttribute('href'))
+
+    def character_data_handler(self, data):
+        self.add_text(xml.dom.expatbuilder.ExpatBuilderNS.character_data_handler, data)
+
+    def character_data_handler_cdata(self, data):
+        if self._cdata:
+            # CDATA sections are kept as separate nodes:
+            self.flush_text()
+            childNodes = self.curNode.childNodes
+            numChildren = len(childNodes)
+            xml.dom.expatbuilder.ExpatBuilderNS.character_data_handler_cdata(self, data)
+            if len(childNodes) > numChildren:
+                self.add_location(childNodes[-1])
+            return
+        self.add_text(xml.dom.expatbuilder.ExpatBuilderNS.character_data_handler_cdata, data)
+
+    def add_text(self, baseHandler, data):
+        childNodes = self.curNode.childNodes
+        if childNodes and childNodes[-1] is self.pendingNode:
+            self.pendingChunks.append(data)
+            return
+        self.flush_text()
+        numChildren = len(childNodes)
+        baseHandler(self, data)
+        if len(childNodes) > numChildren:
+            self.pendingNode = childNodes[-1]
+            self.pendingChunks = [data]
+            self.add_location(self.pendingNode)
+
+    def add_location(self, node):
+        self.locations.add(node, self._parser.CurrentLineNumber,
+                           self._parser.CurrentColumnNumber)
+
+    def flush_text(self):
+        if self.pendingNode is not None:
+            d = self.pendingNode.__dict__
+            d['data'] = d['nodeValue'] = ''.join(self.pendingChunks)
+            self.pendingNode = None
+            self.pendingChunks = []
+
+    def finish(self, document):
+        self.flush_text()
+        locationTables[document] = self.locations
+        return document
+
+    def parseFile(self, file):
+        return self.finish(xml.dom.expatbuilder.ExpatBuilderNS.parseFile(self, file))
+
+    def parseString(self, string):
+        return self.finish(xml.dom.expatbuilder.ExpatBuilderNS.parseString(self, string))
+
+def parse_file(filename):
+    """
+    Parse the file into a DOM, recording the locations of its nodes.  The
+    parser reads the file through a memory mapping, which is kept for as
+    long as the DOM is alive.
+    """
+    source = SourceText.from_file(filename)
+    return LocatingBuilder(filename, source).parseFile(source.make_reader())
+
+def parse_string(sourceStr):
+    "Parse the string into a DOM, recording the locations of its nodes"
+    return LocatingBuilder(None, SourceText(sourceStr)).parseString(sourceStr)
+
+class DocumentCache:
+    """
+    Process-wide cache of parsed XML files.
+
+    Entries are keyed by absolute path, and are only reused whilst the file's
+    mtime and size are unchanged.  The least-recently-used entries are
+    discarded once there are more than maxEntries of them, or once the total
+    size of the cached files exceeds maxBytes.
+    """
+    def __init__(self, maxEntries=256, maxBytes=64*1024*1024):
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        # (files may be parsed by several prefetching threads at once)
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        # Map from absolute path to [lastUse, (mtime, size), dom]:
+        self.entries = {}
+        self.totalBytes = 0
+        self.clock = 0
+        self.hits = 0
+        self.misses = 0
+        # Map from absolute path to the total time spent parsing it:
+        self.parseTimes = {}
+
+    def parse(self, filename):
+        "Get the DOM for the given file, parsing it only if necessary"
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        signature = (stat.st_mtime, stat.st_size)
+
+        self.lock.acquire()
+        try:
+            self.clock += 1
+            entry = self.entries.get(path)
+            if entry is not None:
+                if entry[1] == signature:
+                    self.hits += 1
+                    entry[0] = self.clock
+                    return entry[2]
+                # The file has changed since we parsed it:
+                self.discard(path)
+            self.misses += 1
+        finally:
+            self.lock.release()
+
+        start = time.time()
+        dom = parse_file(path)
+        parseTime = time.time() - start
+
+        self.lock.acquire()
+        try:
+            self.parseTimes[path] = self.parseTimes.get(path, 0.0) + parseTime
+            if stat.st_size <= self.maxBytes:
+                if self.entries.has_key(path):
+                    # Another thread parsed it in the meantime:
+                    self.discard(path)
+                self.entries[path] = [self.clock, signature, dom]
+                self.totalBytes += stat.st_size
+                self.evict()
+        finally:
+            self.lock.release()
+        return dom
+
+    def discard(self, path):
+        entry = self.entries.pop(path)
+        self.totalBytes -= entry[1][1]
+
+    def evict(self):
+        "Discard least-recently-used entries until we're within our limits"
+        while len(self.entries) > self.maxEntries or self.totalBytes > self.maxBytes:
+            oldestPath = None
+            oldestUse = None
+            for path, entry in self.entries.iteritems():
+                if oldestUse is None or entry[0] < oldestUse:
+                    oldestPath = path
+                    oldestUse = entry[0]
+            self.discard(oldestPath)
+
+    def get_stats(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.entries),
+                'bytes': self.totalBytes}
+
+# The cache used when loading files, shared by all visitors and linters in
+# the process:
+documentCache = DocumentCache()
+
+def find_include_problem(filename, xmlDoc):
+    """
+    Check whether the file XIncluded by the document can be loaded,
+    returning "missing" if it doesn't exist, "cycle" if it is the document
+    itself or one of the documents that (directly or indirectly) included
+    it, or None if there's no problem
+    """
+    if not os.path.isfile(filename):
+        return 'missing'
+    path = os.path.abspath(filename)
+    while xmlDoc is not None:
+        if xmlDoc.filename is not None and os.path.abspath(xmlDoc.filename) == path:
+            return 'cycle'
+        xmlDoc = xmlDoc.parentDoc
+    return None
 
 class XmlDoc:
     # Wrapper for a DOM
+    parentDoc = None
+
     def __init__(self, dom):
         self.dom = dom
+        self.filename = None
+        self.basePath = ''
 
     @classmethod
     def from_source(cls, sourceStr):
-        return XmlDoc(xml.dom.minidom.parseString(sourceStr))
+        return XmlDoc(parse_string(sourceStr))
+
+    def accept(self, visitor):
+        visitor.recurse_nodes(self.dom, self)
+
+    def prefetch_includes(self, numThreads):
+        prefetch_includes(self, numThreads)
 
 class XmlFile(XmlDoc):
     # Wrapper for a DOM loaded from a file
-    def __init__(self, filename):
+    def __init__(self, filename, parentDoc=None):
+        self.filename = filename
+        self.basePath = os.path.dirname(filename)
+        # The document that XIncluded this one, if any:
+        self.parentDoc = parentDoc
+        self.dom = documentCache.parse(filename)
+
+def get_include_hrefs(dom):
+    "Get the href of each XInclude within the DOM, in document order"
+    table = locationTables.get(dom)
+    if table is not None:
+        return table.includeHrefs
+    # A DOM that we didn't parse ourselves, so search it, with an explicit
+    # stack (getElementsByTagNameNS recurses, and so fails on deep documents):
+    hrefs = []
+    stack = [dom]
+    while stack:
+        node = stack.pop()
+        if is_xinclude(node):
+            hrefs.append(node.getAttribute('href'))
+        stack.extend(reversed(node.childNodes))
+    return hrefs
+
+def prefetch_includes(xmlDoc, numThreads):
+    """
+    Parse every file that the document XIncludes (directly or indirectly)
+    into documentCache, using a pool of numThreads threads, so that a
+    traversal of the document doesn't have to wait for each file in turn.
+
+    Files that are missing or can't be parsed are skipped here; the
+    traversal deals with them.  The XIncludes of each file are recorded when
+    it is parsed, so those already in the cache cost only a stat().
+    """
+    pending = Queue.Queue()
+    seenPaths = {}
+    lock = threading.Lock()
+
+    def add_includes(dom, basePath):
+        "Queue up the files included by the DOM that haven't been seen yet"
+        lock.acquire()
+        try:
+            for filename in get_include_hrefs(dom):
+                if not os.path.isabs(filename):
+                    filename = os.path.join(basePath, filename)
+                path = os.path.abspath(filename)
+                if not seenPaths.has_key(path):
+                    seenPaths[path] = True
+                    pending.put(path)
+        finally:
+            lock.release()
+
+    def worker():
+        while True:
+            path = pending.get()
+            try:
+                if path is None:
+                    return
+                try:
+                    dom = documentCache.parse(path)
+                except (EnvironmentError, xml.parsers.expat.ExpatError):
+                    pass
+                else:
+                    add_includes(dom, os.path.dirname(path))
+            finally:
+                pending.task_done()
+
+    if xmlDoc.filename is not None:
+        seenPaths[os.path.abspath(xmlDoc.filename)] = True
+    add_includes(xmlDoc.dom, xmlDoc.basePath)
+    if pending.empty():
+        return
+
+    threads = [threading.Thread(target=worker) for i in range(numThreads)]
+    for thread in threads:
+        thread.setDaemon(True)
+        thread.start()
+    pending.join()
+    for thread in threads:
+        pending.put(None)
+    for thread in threads:
+        thread.join()
+
+#
+# Streaming backend:
+#
+# Rather than building a DOM, the document is parsed incrementally and each
+# node is passed to the visitor as soon as it is complete enough to be
+# inspected.  The nodes are lightweight stand-ins for DOM nodes, providing
+# the subset of the DOM API that the visitors use: each one knows its
+# parentNode, an element knows its attributes and its firstChild, and a
+# textual node knows its wholeText.  Only the chain of ancestors of the
+# current node, and the current run of text, are held in memory.
+#
+
+class StreamNode:
+    nextSibling = None
+    firstChild = None
+    namespaceURI = None
+    localName = None
+    location = None
+
+    def __init__(self, nodeType, parentNode):
+        self.nodeType = nodeType
+        self.parentNode = parentNode
+
+class StreamElement(StreamNode):
+    def __init__(self, parentNode, nodeName, localName, namespaceURI, attributes,
+                 location=None):
+        StreamNode.__init__(self, xml.dom.Node.ELEMENT_NODE, parentNode)
+        self.location = location
+        self.nodeName = self.tagName = nodeName
+        self.localName = localName
+        self.namespaceURI = namespaceURI
+        self.attributes = attributes
+
+    def hasAttribute(self, name):
+        return self.attributes.has_key(name)
+
+    def getAttribute(self, name):
+        return self.attributes.get(name, '')
+
+class StreamText(StreamNode):
+    nodeName = '#text'
+
+    def __init__(self, parentNode, text, location=None):
+        StreamNode.__init__(self, xml.dom.Node.TEXT_NODE, parentNode)
+        self.data = self.nodeValue = self.wholeText = text
+        self.location = location
+
+class StreamComment(StreamNode):
+    nodeName = '#comment'
+
+    def __init__(self, parentNode, text):
+        StreamNode.__init__(self, xml.dom.Node.COMMENT_NODE, parentNode)
+        self.data = self.nodeValue = text
+
+def split_expat_name(name):
+    """
+    Convert a name reported by expat in namespace mode ("uri local prefix")
+    into a (nodeName, localName, namespaceURI) tuple
+    """
+    parts = name.split(' ')
+    if len(parts) == 1:
+        return (name, name, None)
+    if len(parts) == 2:
+        return (parts[1], parts[1], parts[0])
+    return ('%s:%s' % (parts[2], parts[1]), parts[1], parts[0])
+
+class XmlStreamHandler:
+    """
+    Receives expat events for a document, and feeds StreamNodes to a visitor.
+
+    An element isn't passed to the visitor until its first child is known
+    (or until it ends, if it has no children), so that visitors can look at
+    node.firstChild, as they would with a DOM.
+    """
+    def __init__(self, visitor, xmlDoc):
+        self.visitor = visitor
+        self.xmlDoc = xmlDoc
+        self.ancestors = []
+        self.pendingElement = None
+        self.textRun = []
+        self.textLocation = None
+        self.parser = None
+
+    def make_parser(self):
+        # (the text isn't buffered by expat, so that we get its starting
+        # position; we join it ourselves)
+        parser = xml.parsers.expat.ParserCreate(namespace_separator=' ')
+        parser.namespace_prefixes = True
+        parser.buffer_text = False
+        self.parser = parser
+        parser.StartElementHandler = self.start_element
+        parser.EndElementHandler = self.end_element
+        parser.CharacterDataHandler = self.characters
+        parser.CommentHandler = self.comment
+        return parser
+
+    def get_current_location(self):
+        return (self.xmlDoc.filename, self.parser.CurrentLineNumber,
+                self.parser.CurrentColumnNumber + 1)
+
+    def get_parent(self):
+        if self.ancestors:
+            return self.ancestors[-1]
+        return None
+
+    def add_child(self, node):
+        "Record the node as a first child if necessary, then visit it"
+        if self.pendingElement is not None:
+            self.pendingElement.firstChild = node
+            self.visitor.visit(self.pendingElement)
+            self.pendingElement = None
+        self.visitor.visit(node)
+
+    def flush_text(self):
+        if self.textRun:
+            text = ''.join(self.textRun)
+            self.textRun = []
+            self.add_child(StreamText(self.get_parent(), text, self.textLocation))
+
+    def start_element(self, name, attrs):
+        self.flush_text()
+        attributes = {}
+        for attrName, value in attrs.iteritems():
+            attributes[split_expat_name(attrName)[0]] = value
+        nodeName, localName, namespaceURI = split_expat_name(name)
+        element = StreamElement(self.get_parent(), nodeName, localName,
+                                namespaceURI, attributes, self.get_current_location())
+        if self.pendingElement is not None:
+            self.pendingElement.firstChild = element
+            self.visitor.visit(self.pendingElement)
+        self.pendingElement = element
+        self.ancestors.append(element)
+
+    def end_element(self, name):
+        self.flush_text()
+        element = self.ancestors.pop()
+        if self.pendingElement is element:
+            self.visitor.visit(element)
+            self.pendingElement = None
+
+        # recurse into other files via XInclude:
+        if is_xinclude(element):
+            filename = get_include_filename(element, self.xmlDoc)
+            problem = find_include_problem(filename, self.xmlDoc)
+            if problem is not None:
+                self.visitor.visit_include_problem(element, filename, problem)
+            else:
+                self.visitor.visit_include(element, filename)
+                XmlStreamFile(filename, self.xmlDoc).accept(self.visitor)
+
+        self.visitor.leave_element(element)
+
+    def characters(self, data):
+        if not self.textRun:
+            self.textLocation = self.get_current_location()
+        self.textRun.append(data)
+
+    def comment(self, data):
+        self.flush_text()
+        if self.pendingElement is not None:
+            self.pendingElement.firstChild = StreamComment(self.get_parent(), data)
+            self.visitor.visit(self.pendingElement)
+            self.pendingElement = None
+
+class XmlStreamDoc:
+    """
+    A document that is visited by streaming it through the parser, rather
+    than by building a DOM
+    """
+    parentDoc = None
+
+    def __init__(self, sourceStr):
+        self.sourceStr = sourceStr
+        self.filename = None
+        self.basePath = ''
+
+    @classmethod
+    def from_source(cls, sourceStr):
+        return XmlStreamDoc(sourceStr)
+
+    def accept(self, visitor):
+        handler = XmlStreamHandler(visitor, self)
+        self.feed(handler.make_parser())
+
+    def feed(self, parser):
+        parser.Parse(self.sourceStr, True)
+
+    def prefetch_includes(self, numThreads):
+        # Nothing to do: the included files are streamed as they're reached
+        pass
+
+class XmlStreamFile(XmlStreamDoc):
+    def __init__(self, filename, parentDoc=None):
         self.filename = filename
         self.basePath = os.path.dirname(filename)
-        self.dom = xml.dom.minidom.parse(filename)
+        self.parentDoc = parentDoc
+
+    def feed(self, parser):
+        f = open(self.filename, 'rb')
+        try:
+            data = map_file(f)
+            if data is None:
+                parser.ParseFile(f)
+                return
+            try:
+                parser.ParseFile(data)
+            finally:
+                data.close()
+        finally:
+            f.close()
+
+# The ways of loading a document, as selected by Configuration.backend:
+backends = {'dom': (XmlDoc, XmlFile),
+            'stream': (XmlStreamDoc, XmlStreamFile)}
+
+def load_source(sourceStr, backend='dom'):
+    return backends[backend][0].from_source(sourceStr)
+
+def load_file(filename, backend='dom'):
+    return backends[backend][1](filename)
 
         
 class XmlVisitor:
@@ -57,36 +739,80 @@ class XmlVisitor:
     Base class for a visiting nodes of an XML DOM tree
     """
     def visit_file(self, filename):
-        xmlDoc = XmlFile(filename)
-        self.recurse_nodes(xml.dom, xmlDoc)
+        self.visit_doc(XmlFile(filename))
 
     def visit_doc(self, xmlDoc):
-        self.recurse_nodes(xmlDoc.dom, xmlDoc)
+        xmlDoc.accept(self)
+
+    def make_dispatch_table(self):
+        "Map from each node type that the visitor handles to its handler"
+        table = {xml.dom.Node.ELEMENT_NODE: self.visit_element}
+        for nodeType in textualNodeTypes:
+            table[nodeType] = self.visit_textual
+        return table
 
     def recurse_nodes(self, node, xmlDoc):
-        "Depth-first traversal of tree"
-        self.visit(node)
+        """
+        Depth-first traversal of tree, including any files that it XIncludes.
 
-        child = node.firstChild
-        while child:
-            self.recurse_nodes(child, xmlDoc)
-            child = child.nextSibling
+        This follows the firstChild, nextSibling and parentNode links, rather
+        than recursing, so that deeply-nested documents neither need a Python
+        stack frame per level nor hit the recursion limit.  The only stack is
+        of the XIncludes being traversed.
+        """
+        dispatch = self.make_dispatch_table()
+        leaveElement = self.leave_element
+        ELEMENT_NODE = xml.dom.Node.ELEMENT_NODE
+        root = node
+        # (include element, xmlDoc, root) for each XIncluded file being
+        # traversed:
+        includes = []
+        while True:
+            handler = dispatch.get(node.nodeType)
+            if handler is not None:
+                handler(node)
+            child = node.firstChild
+            if child is not None:
+                node = child
+                continue
 
-        # recurse into other files via XInclude:
-        if is_named_element(node, 'include', 'http://www.w3.org/2001/XInclude'):
-            filename = node.getAttribute('href')
-            if not os.path.isabs(filename):
-                filename = os.path.join(xmlDoc.basePath, filename)
-            includedXmlDoc = XmlFile(filename)
-            self.recurse_nodes(includedXmlDoc.dom, includedXmlDoc)
+            # Finish the node, and then each ancestor that has no more
+            # children, until we find the next node to visit:
+            resuming = False
+            while True:
+                if node.nodeType == ELEMENT_NODE:
+                    if (not resuming and node.localName == 'include'
+                        and node.namespaceURI == xincludeNamespace):
+                        # recurse into other files via XInclude:
+                        filename = get_include_filename(node, xmlDoc)
+                        problem = find_include_problem(filename, xmlDoc)
+                        if problem is not None:
+                            self.visit_include_problem(node, filename, problem)
+                        else:
+                            self.visit_include(node, filename)
+                            includes.append((node, xmlDoc, root))
+                            xmlDoc = XmlFile(filename, xmlDoc)
+                            node = root = xmlDoc.dom
+                            break
+                    leaveElement(node)
+                resuming = False
+                if node is root:
+                    if not includes:
+                        return
+                    # Back to the include element, which can now be left:
+                    node, xmlDoc, root = includes.pop()
+                    resuming = True
+                    continue
+                if node.nextSibling is not None:
+                    node = node.nextSibling
+                    break
+                node = node.parentNode
 
     def visit(self, node):
-        #print node
-        #print dir(node)
-        if is_element(node):
+        nodeType = node.nodeType
+        if nodeType == xml.dom.Node.ELEMENT_NODE:
             self.visit_element(node)
-
-        if is_textual(node):
+        elif nodeType in textualNodeTypes:
             self.visit_textual(node)
 
     def visit_element(self, node):
@@ -95,3 +821,299 @@ class XmlVisitor:
     def visit_textual(self, node):
         raise NotImplementedError
 
+    def leave_element(self, node):
+        """
+        Hook called once the traversal has finished with everything within
+        the element (including any file that it XIncludes)
+        """
+        pass
+
+    def visit_include(self, node, filename):
+        "Hook called before the traversal enters an XIncluded file"
+        pass
+
+    def visit_include_problem(self, node, filename, problem):
+        """
+        Hook called instead of visit_include when an XIncluded file can't be
+        entered, because it is "missing" or would form a "cycle"
+        """
+        pass
+
+class AncestorContext:
+    """
+    State that a node inherits from the elements that it is within, kept up
+    to date on a stack by a visitor calling enter from visit_element and
+    leave from leave_element, so that it can be looked up in constant time
+    for each node, rather than by walking up the tree:
+
+      skipDepth: how many of the enclosing elements have names in skipNames
+      (hence the node is within such an element if it is non-zero)
+
+      langCode: the innermost lang or xml:lang attribute, or the default
+      language if there isn't one
+    """
+    SKIP = 1
+    LANG = 2
+
+    def __init__(self, skipNames, defaultLangCode):
+        self.skipNames = frozenset(skipNames)
+        self.skipDepth = 0
+        self.langCode = defaultLangCode
+        self.outerLangCodes = []
+        # What each open element changed, as a bitmask of SKIP and LANG:
+        self.changes = array('b')
+
+    def enter(self, element):
+        changes = 0
+        if element.localName in self.skipNames:
+            self.skipDepth += 1
+            changes = self.SKIP
+        langCode = element.getAttribute('xml:lang') or element.getAttribute('lang')
+        if langCode:
+            self.outerLangCodes.append(self.langCode)
+            self.langCode = langCode
+            changes |= self.LANG
+        self.changes.append(changes)
+
+    def leave(self, element):
+        changes = self.changes.pop()
+        if changes & self.SKIP:
+            self.skipDepth -= 1
+        if changes & self.LANG:
+            self.langCode = self.outerLangCodes.pop()
+
+def overrides(boundMethod, baseMethod):
+    "Is the bound method something other than the given base class method?"
+    return getattr(boundMethod, 'im_func', None) is not baseMethod.im_func
+
+class XmlMultiVisitor(XmlVisitor):
+    """
+    Visitor which dispatches every node to a list of other visitors, so that
+    several visitors can share a single traversal of the tree (and a single
+    parse of each XIncluded file)
+    """
+    def __init__(self, visitors):
+        self.visitors = visitors
+        self.elementHandlers = [visitor.visit_element for visitor in visitors]
+        self.textualHandlers = [visitor.visit_textual for visitor in visitors]
+        # (most visitors don't care when an element ends, so only call those
+        # that do)
+        self.leaveHandlers = [visitor.leave_element for visitor in visitors
+                              if overrides(visitor.leave_element, XmlVisitor.leave_element)]
+
+        # Every file that the traversal included, in order:
+        self.includedFiles = []
+        # (node, filename, problem) for each XInclude that couldn't be followed:
+        self.includeProblems = []
+
+    def visit_element(self, node):
+        for handler in self.elementHandlers:
+            handler(node)
+
+    def visit_textual(self, node):
+        for handler in self.textualHandlers:
+            handler(node)
+
+    def leave_element(self, node):
+        for handler in self.leaveHandlers:
+            handler(node)
+
+    def visit_include(self, node, filename):
+        self.includedFiles.append(filename)
+        for visitor in self.visitors:
+            visitor.visit_include(node, filename)
+
+    def visit_include_problem(self, node, filename, problem):
+        self.includeProblems.append((node, filename, problem))
+
+    def make_dispatch_table(self):
+        table = XmlVisitor.make_dispatch_table(self)
+        # With just one visitor, there's no need to go through the lists:
+        if len(self.visitors) == 1:
+            table[xml.dom.Node.ELEMENT_NODE] = self.elementHandlers[0]
+            for nodeType in textualNodeTypes:
+                table[nodeType] = self.textualHandlers[0]
+        return table
+
+#
+# Unit tests
+#
+
+class TestDocumentCache(unittest.TestCase):
+    def setUp(self):
+        self.dirName = tempfile.mkdtemp()
+        self.cache = DocumentCache(maxEntries=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.dirName)
+
+    def write_file(self, name, sourceStr):
+        filename = os.path.join(self.dirName, name)
+        f = open(filename, 'w')
+        f.write(sourceStr)
+        f.close()
+        return filename
+
+    def test_hit(self):
+        "Ensure that an unchanged file is only parsed once"
+        filename = self.write_file('a.xml', '<para>Some text</para>')
+        dom = self.cache.parse(filename)
+        self.assert_(self.cache.parse(filename) is dom)
+        self.assertEquals(self.cache.misses, 1)
+        self.assertEquals(self.cache.hits, 1)
+
+    def test_changed_file(self):
+        "Ensure that a modified file is parsed again"
+        filename = self.write_file('a.xml', '<para>Some text</para>')
+        self.cache.parse(filename)
+        self.write_file('a.xml', '<para>Some longer text</para>')
+        dom = self.cache.parse(filename)
+        self.assertEquals(dom.documentElement.firstChild.data, 'Some longer text')
+        self.assertEquals(self.cache.misses, 2)
+
+    def test_lru_eviction(self):
+        "Ensure that the least-recently-used file is the one discarded"
+        a = self.write_file('a.xml', '<para>A</para>')
+        b = self.write_file('b.xml', '<para>B</para>')
+        c = self.write_file('c.xml', '<para>C</para>')
+        self.cache.parse(a)
+        self.cache.parse(b)
+        self.cache.parse(a)
+        self.cache.parse(c)
+        self.assertEquals(len(self.cache.entries), 2)
+        self.assert_(os.path.abspath(a) in self.cache.entries)
+        self.assert_(os.path.abspath(b) not in self.cache.entries)
+
+locationExample = """<?xml version="1.0"?>
+<article>
+  <para>Some <emphasis>text</emphasis>
+  &amp; more</para>
+</article>
+"""
+
+class LocationRecorder(XmlVisitor):
+    def __init__(self):
+        self.locations = []
+
+    def visit_element(self, node):
+        self.locations.append((node.nodeName, get_location(node)))
+
+    def visit_textual(self, node):
+        if node.wholeText.strip():
+            self.locations.append((node.wholeText, get_location(node)))
+
+class TestLocations(unittest.TestCase):
+    expectedLocations = [(u'article', (None, 2, 1)),
+                         (u'para', (None, 3, 3)),
+                         (u'Some ', (None, 3, 9)),
+                         (u'emphasis', (None, 3, 14)),
+                         (u'text', (None, 3, 24)),
+                         (u'\n  & more', (None, 3, 39))]
+
+    def test_dom_locations(self):
+        "Ensure that the DOM backend records the location of each node"
+        visitor = LocationRecorder()
+        visitor.visit_doc(XmlDoc.from_source(locationExample))
+        self.assertEquals(visitor.locations, self.expectedLocations)
+
+    def test_stream_locations(self):
+        "Ensure that the streaming backend gives the same locations"
+        visitor = LocationRecorder()
+        visitor.visit_doc(XmlStreamDoc.from_source(locationExample))
+        self.assertEquals(visitor.locations, self.expectedLocations)
+
+class TestSourceText(unittest.TestCase):
+    def setUp(self):
+        self.dirName = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dirName, 'doc.xml')
+        f = open(self.filename, 'wb')
+        f.write(locationExample.replace('\n', '\r\n'))
+        f.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dirName)
+
+    def test_lines(self):
+        "Ensure that lines are extracted from the mapped file, without their newlines"
+        source = SourceText.from_file(self.filename)
+        self.assertEquals(str(source.get_line(3)), '  <para>Some <emphasis>text</emphasis>')
+        self.assertEquals(str(source.get_line(5)), '</article>')
+        self.assertEquals(str(source.get_line(6)), '')
+        self.assertEquals(source.get_line(7), None)
+
+    def test_source_line(self):
+        "Ensure that the source line of a node can be found from the DOM"
+        dom = parse_file(self.filename)
+        para = dom.getElementsByTagName('para')[0]
+        self.assertEquals(get_source_line(para), u'  <para>Some <emphasis>text</emphasis>')
+        self.assertEquals(get_source_line(para.getElementsByTagName('emphasis')[0].firstChild),
+                          u'  <para>Some <emphasis>text</emphasis>')
+
+    def test_stale(self):
+        "Ensure that nothing is read from a mapping once the file has changed size"
+        source = SourceText.from_file(self.filename)
+        f = open(self.filename, 'wb')
+        f.write('<article/>')
+        f.close()
+        self.assertEquals(source.get_line(1), None)
+
+class EventRecorder(XmlVisitor):
+    "Records the order in which the hooks are called"
+    def __init__(self):
+        self.events = []
+
+    def visit_element(self, node):
+        self.events.append(('enter', node.nodeName))
+
+    def visit_textual(self, node):
+        if node.data.strip():
+            self.events.append(('text', node.data.strip()))
+
+    def leave_element(self, node):
+        self.events.append(('leave', node.nodeName))
+
+    def visit_include(self, node, filename):
+        self.events.append(('include', os.path.basename(filename)))
+
+class TestTraversal(unittest.TestCase):
+    def setUp(self):
+        self.dirName = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dirName)
+
+    def write_file(self, name, sourceStr):
+        filename = os.path.join(self.dirName, name)
+        f = open(filename, 'w')
+        f.write(sourceStr)
+        f.close()
+        return filename
+
+    def test_order(self):
+        "Ensure that nodes are visited and left in document order, through XIncludes"
+        filename = self.write_file('book.xml',
+                                   '<book xmlns:xi="%s"><title>A</title>'
+                                   '<xi:include href="chapter.xml"/><para>C</para></book>'
+                                   % xincludeNamespace)
+        self.write_file('chapter.xml', '<chapter><para>B</para></chapter>')
+        expected = [('enter', 'book'),
+                    ('enter', 'title'), ('text', 'A'), ('leave', 'title'),
+                    ('enter', 'xi:include'), ('include', 'chapter.xml'),
+                    ('enter', 'chapter'),
+                    ('enter', 'para'), ('text', 'B'), ('leave', 'para'),
+                    ('leave', 'chapter'),
+                    ('leave', 'xi:include'),
+                    ('enter', 'para'), ('text', 'C'), ('leave', 'para'),
+                    ('leave', 'book')]
+        for backend in backends.keys():
+            visitor = EventRecorder()
+            visitor.visit_doc(load_file(filename, backend))
+            self.assertEquals(visitor.events, expected)
+
+    def test_deep_nesting(self):
+        "Ensure that documents nested more deeply than the recursion limit can be traversed"
+        depth = sys.getrecursionlimit() * 2
+        visitor = EventRecorder()
+        visitor.visit_doc(XmlDoc.from_source('<para>' * depth + 'Deep' + '</para>' * depth))
+        self.assertEquals(len(visitor.events), depth * 2 + 1)
+        self.assertEquals(visitor.events[depth], ('text', 'Deep'))
@@ -0,0 +1,149 @@
+# Copyright (c) 2008 Red Hat, Inc. All rights reserved. This copyrighted material
+# is made available to anyone wishing to use, modify, copy, or
+# redistribute it subject to the terms and conditions of the GNU General
+# Public License v.2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# Author: David Malcolm
+from docbooklint.linter import *
+from docbooklint.xmlutils import *
+from docbooklint.idindex import IdIndexListener
+
+# Links are only checked within complete documents, rather than e.g. within
+# a chapter file checked on its own, whose links may well be to other
+# chapters:
+completeDocumentElements = frozenset(['book', 'article', 'set'])
+
+class DuplicateId(DocBookError):
+    __slots__ = ('id',)
+
+    def __init__(self, node, id):
+        DocBookError.__init__(self, node)
+        self.id = id
+
+    def __str__(self):
+        return 'Node <%s>\'s id ("%s") has already been used'%(self.nodeName, self.id)
+
+class DanglingLink(DocBookError):
+    __slots__ = ('linkend',)
+
+    def __init__(self, node, linkend):
+        DocBookError.__init__(self, node)
+        self.linkend = linkend
+
+    def __str__(self):
+        return 'Node <%s>\'s linkend ("%s") does not match any id'%(self.nodeName, self.linkend)
+
+class DocBookXrefs(DocBookTest):
+    """
+    Checks that IDs are unique, and that every <xref> and <link> within a
+    complete document links to one of them
+    """
+    usesIdIndex = True
+
+    @classmethod
+    def from_config(cls, config):
+        return DocBookXrefs()
+
+    def make_visitor(self, reporter):
+        return DocBookXrefs.Visitor(reporter)
+
+    def finish_test(self, reporter, visitor):
+        if visitor.rootName not in completeDocumentElements:
+            return
+        ids = visitor.idIndex.ids
+        for node, linkend in visitor.forwardLinks:
+            if not ids.has_key(linkend):
+                reporter.handle_warning(DanglingLink(node, linkend))
+
+    class Visitor(IdIndexListener):
+        def __init__(self, reporter):
+            self.reporter = reporter
+            self.rootName = None
+            # (node, linkend) for each link to an ID that hadn't been seen
+            # yet when we reached it; only these need checking at the end:
+            self.forwardLinks = []
+
+        def visit_element(self, node):
+            if self.rootName is None:
+                self.rootName = node.nodeName
+
+        def handle_id(self, node, id, chapterId, isNew):
+            if not isNew:
+                self.reporter.handle_warning(DuplicateId(node, id))
+
+        def handle_link(self, node, linkend):
+            if not self.idIndex.ids.has_key(linkend):
+                self.forwardLinks.append((node, linkend))
+
+linksExample="""<?xml version="1.0"?>
+<article>
+<title>Example with links</title>
+<section id="sn-first"><para>See <xref linkend="sn-second"/> and <xref linkend="sn-first"/>,
+but not <link linkend="sn-third">this</link></para></section>
+<section id="sn-second"><para>Some text</para></section>
+<section id="sn-first"><para>Some more text</para></section>
+</article>
+"""
+
+class TestXrefs(unittest.TestCase):
+    def collect_warnings(self, sourceStr, backend):
+        config = Configuration()
+        config.spellCheck = False
+        config.backend = backend
+        reporter = CollectingReporter()
+        linter = DocBookLinter(reporter=reporter, config=config)
+        linter.test_doc(load_source(sourceStr, backend))
+        return [(warning.__class__.__name__, warning.get_location()[1])
+                for warning in reporter.warnings]
+
+    def test_links(self):
+        "Ensure that duplicate IDs and dangling links are reported"
+        for backend in ('dom', 'stream'):
+            self.assertEquals(self.collect_warnings(linksExample, backend),
+                              [('DuplicateId', 7), ('DanglingLink', 5)])
+
+    def test_partial_document(self):
+        "Ensure that links aren't checked within e.g. a chapter on its own"
+        chapter = linksExample.replace('article>', 'chapter>')
+        self.assertEquals(self.collect_warnings(chapter, 'dom'), [('DuplicateId', 7)])
+
+    def test_unlocated_document(self):
+        "Ensure that a DOM that wasn't parsed by the linter can be checked"
+        import xml.dom.minidom
+        config = Configuration()
+        config.spellCheck = False
+        reporter = CollectingReporter()
+        linter = DocBookLinter(reporter=reporter, config=config)
+        linter.test_doc(XmlDoc(xml.dom.minidom.parseString(linksExample)))
+        self.assertEquals([warning.__class__.__name__ for warning in reporter.warnings],
+                          ['DuplicateId', 'DanglingLink'])
+
+    def test_shared_index(self):
+        "Ensure that the ID checks share a single IdIndex for each document"
+        import docbooklint.idindex
+        indexers = []
+        originalIndexer = docbooklint.idindex.IdIndexer
+        class RecordingIndexer(originalIndexer):
+            def __init__(self):
+                originalIndexer.__init__(self)
+                indexers.append(self)
+        docbooklint.idindex.IdIndexer = RecordingIndexer
+        try:
+            config = Configuration()
+            config.spellCheck = False
+            linter = DocBookLinter(reporter=CollectingReporter(), config=config)
+            linter.test_doc(load_source(linksExample, 'dom'))
+        finally:
+            docbooklint.idindex.IdIndexer = originalIndexer
+        self.assertEquals(len(indexers), 1)
+        self.assertEquals([listener.__class__.__module__ for listener in indexers[0].listeners],
+                          ['docbooklint.fedoranamingconventions', 'docbooklint.xrefs'])
+        self.assert_(linter.idIndex is indexers[0].idIndex)